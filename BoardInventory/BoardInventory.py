@@ -0,0 +1,100 @@
+import time
+import threading
+import subprocess
+from collections import namedtuple
+from Exceptions import Exceptions
+
+# The details the lab inventory (IVLab) holds for a board
+BoardRecord = namedtuple("BoardRecord", ["name", "ivlab_id", "nb_of_eth_ports", "arch", "bootloader", "cpu"])
+
+class BoardInventory:
+    """Provides the lab inventory details of the boards. The inventory host is queried with a
+    single targetadmin call per board and the parsed record is cached for a limited time,
+    so that all the jobs (and the ResourcePool) working with the same board reuse it."""
+
+    # The inventory command prints a header, a separator line and then the board details
+    INVENTORY_COMMAND = "targetadmin --display --name %s"
+    RECORD_LINE = 2
+
+    # Column index (as split on whitespace) of each attribute within the record line
+    COLUMNS = {"ivlab_id" : 1, "nb_of_eth_ports" : 4, "arch" : 6, "bootloader" : 7, "cpu" : 8}
+
+    def __init__(self, ttl=300, logger_handle=None, inventory_command=None):
+        """Object constructor. Cached records older than ttl seconds are fetched again"""
+        self.ttl = ttl
+        self.logger = logger_handle
+        self.inventory_command = inventory_command or self.INVENTORY_COMMAND
+
+        # board name -> (fetch timestamp, BoardRecord)
+        self.records = {}
+        self.lock = threading.Lock()
+
+        # One lock per board, so that concurrent lookups of the same board only
+        # query the inventory host once
+        self.board_locks = {}
+
+    def get_board_record(self, board_name):
+        """Returns the BoardRecord of the given board, from the cache when possible"""
+        record = self._cached_record(board_name)
+        if record is not None:
+            return record
+
+        with self.lock:
+            board_lock = self.board_locks.setdefault(board_name, threading.Lock())
+
+        with board_lock:
+            # Someone else may have fetched it while we were waiting
+            record = self._cached_record(board_name)
+            if record is None:
+                record = self.fetch_board_record(board_name)
+                with self.lock:
+                    self.records[board_name] = (time.time(), record)
+        return record
+
+    def _cached_record(self, board_name):
+        with self.lock:
+            cache_entry = self.records.get(board_name)
+        if cache_entry is not None and time.time() - cache_entry[0] < self.ttl:
+            return cache_entry[1]
+        return None
+
+    def fetch_board_record(self, board_name):
+        """Query the inventory host for the given board, bypassing the cache"""
+        output = subprocess.getoutput(self.inventory_command % board_name)
+        if self.logger:
+            self.logger.debug("Inventory details for %s:\n%s" % (board_name, output))
+        return self.parse_board_record(board_name, output)
+
+    def parse_board_record(self, board_name, output):
+        """Builds a BoardRecord out of the inventory command output"""
+        lines = output.split('\n')
+        if len(lines) <= self.RECORD_LINE:
+            raise Exceptions.InventoryLookupFailed(board_name, output)
+
+        fields = lines[self.RECORD_LINE].split()
+        if len(fields) <= max(self.COLUMNS.values()):
+            raise Exceptions.InventoryLookupFailed(board_name, output)
+
+        return BoardRecord(name=board_name, **dict((attribute, fields[column])
+                                                   for attribute, column in self.COLUMNS.items()))
+
+    def invalidate(self, board_name=None):
+        """Drop the cached record of a board, or of all boards if no name is given"""
+        with self.lock:
+            if board_name is None:
+                self.records.clear()
+            else:
+                self.records.pop(board_name, None)
+
+
+# The inventory shared by all the components of this process
+_shared_inventory = None
+_shared_inventory_lock = threading.Lock()
+
+def get_shared_inventory():
+    """Returns the process-wide BoardInventory instance, creating it if needed"""
+    global _shared_inventory
+    with _shared_inventory_lock:
+        if _shared_inventory is None:
+            _shared_inventory = BoardInventory()
+        return _shared_inventory
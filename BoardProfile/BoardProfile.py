@@ -0,0 +1,230 @@
+import os
+import re
+import pickle
+import threading
+from collections import namedtuple
+import yaml
+
+# Use the libyaml-based loader when PyYAML was built with it; it is several times faster
+try:
+    from yaml import CSafeLoader as BoardFileLoader
+except ImportError:
+    from yaml import SafeLoader as BoardFileLoader
+
+class BootTemplate:
+    """A list of boot commands compiled into literal text and {PLACEHOLDER} references, so
+    that it can be rendered in a single pass for any set of values. Templates never change
+    once compiled; rendering always returns a new list of commands."""
+
+    # Placeholders are upper case, as the values are (see DeviceObject.submit_config_params).
+    # U-Boot and shell variable references (${loadaddr}) are left alone.
+    PLACEHOLDER_PATTERN = re.compile(r"(?<!\$)\{([A-Z_][A-Z0-9_]*)\}")
+
+    def __init__(self, commands):
+        """Object constructor. Splits every command into (literal, placeholder) pairs"""
+        self.commands = tuple(commands)
+        self.segments = tuple(self._compile(command) for command in self.commands)
+        self.placeholders = frozenset(placeholder for command_segments in self.segments
+                                      for (literal, placeholder) in command_segments if placeholder)
+
+    def _compile(self, command):
+        command_segments = []
+        position = 0
+        for match in self.PLACEHOLDER_PATTERN.finditer(command):
+            command_segments.append((command[position:match.start()], match.group(1)))
+            position = match.end()
+        command_segments.append((command[position:], None))
+        return tuple(command_segments)
+
+    def missing_placeholders(self, values):
+        """Returns the placeholders (sorted) for which no value was given"""
+        return sorted(self.placeholders.difference(values))
+
+    def render(self, values):
+        """Returns the list of commands with all the placeholders replaced. Raises KeyError
+        if a value is missing; use missing_placeholders() for validating the values first."""
+        return ["".join(literal + (str(values[placeholder]) if placeholder else "")
+                        for (literal, placeholder) in command_segments)
+                for command_segments in self.segments]
+
+    def __getstate__(self):
+        return self.commands
+
+    def __setstate__(self, commands):
+        self.__init__(commands)
+
+
+class BoardProfile(namedtuple("BoardProfile", ["board_type", "boot_commands", "attributes", "prompts",
+                                               "root_prompt", "has_ssh", "ipmi_managed", "ipmi_tools", "boards",
+                                               "boot_templates", "ipmi_templates"])):
+    """The compiled, immutable contents of a board file. Profiles are shared between all the
+    board objects of the same type, so everything is stored as tuples; the getters hand out
+    fresh copies that the caller is free to change."""
+    __slots__ = ()
+
+    def get_boot_commands(self, boot_method):
+        """Returns the list of bootloader commands for the given boot method (e.g. ramdisk, nfs)"""
+        return list(dict(self.boot_commands).get(boot_method, ()))
+
+    def get_boot_methods(self):
+        return [boot_method for (boot_method, commands) in self.boot_commands]
+
+    def get_boot_template(self, boot_method):
+        """Returns the compiled BootTemplate of the given boot method, or None"""
+        return dict(self.boot_templates).get(boot_method)
+
+    def get_ipmi_templates(self):
+        """Returns the compiled templates of the IPMI tool commands, by tool name"""
+        return dict(self.ipmi_templates)
+
+    def get_attributes(self):
+        return dict(self.attributes)
+
+    def get_prompts(self):
+        return dict(self.prompts)
+
+    def get_ipmi_tools(self):
+        return dict(self.ipmi_tools)
+
+
+def compile_board_file(board_type, documents):
+    """Builds a BoardProfile out of the YAML documents of a board file"""
+    boot_commands = []
+    attributes = {}
+    prompts = {}
+    ipmi_tools = {}
+    boards = []
+
+    for entry in documents:
+        if not entry:
+            continue
+        for section, section_contents in entry.items():
+            if section == "commands":
+                for command_type, commands in section_contents.items():
+                    # Boot commands are listed as <boot method>_boot (ramdisk_boot, nfs_boot...)
+                    if command_type.endswith("_boot"):
+                        boot_commands.append((command_type[:-len("_boot")], tuple(commands)))
+
+                    # If dealing with an IPMI-managed board that does not provide direct access
+                    # to the bootloader, we must take a different approach
+                    if command_type == "ipmi_managed":
+                        ipmi_tools.update(commands)
+
+            if section == "attributes":
+                attributes.update(section_contents)
+
+            if section == "prompts":
+                prompts.update(section_contents)
+
+            if section == "boards":
+                boards.extend(section_contents)
+
+    ipmi_managed = attributes.get("ipmi_managed") in ("yes", True)
+    if not ipmi_managed:
+        ipmi_tools = {}
+    return BoardProfile(
+                board_type=board_type,
+                boot_commands=tuple(boot_commands),
+                attributes=tuple(attributes.items()),
+                prompts=tuple(prompts.items()),
+                root_prompt=attributes.get("root_prompt"),
+                has_ssh=attributes.get("has_ssh") in ("yes", True),
+                ipmi_managed=ipmi_managed,
+                ipmi_tools=tuple(ipmi_tools.items()),
+                boards=tuple(boards),
+                boot_templates=tuple((boot_method, BootTemplate(commands)) for (boot_method, commands) in boot_commands),
+                ipmi_templates=tuple((tool, BootTemplate([str(command)])) for (tool, command) in ipmi_tools.items()))
+
+
+class BoardFileRegistry:
+    """Parses each board file once and keeps the compiled BoardProfile in memory. A cached
+    profile is used for as long as the board file is not modified. The cache can also be
+    stored on disk (pickled), so that a freshly started framework does not need to parse
+    hundreds of board files again."""
+
+    def __init__(self, board_files_path, cache_file=None, logger_handle=None):
+        """Object constructor"""
+        self.board_file_path = board_files_path
+        self.cache_file = cache_file
+        self.logger = logger_handle
+
+        # board type -> (board file mtime, board file size, BoardProfile)
+        self.profiles = {}
+        self.lock = threading.Lock()
+
+        if self.cache_file and os.path.exists(self.cache_file):
+            try:
+                with open(self.cache_file, "rb") as cache_stream:
+                    self.profiles = pickle.load(cache_stream)
+            except Exception as e:
+                # A stale or corrupted cache only costs us a re-parse
+                self._log_debug("Ignoring the board file cache %s: %s" % (self.cache_file, e))
+                self.profiles = {}
+
+    def _log_debug(self, message):
+        if self.logger:
+            self.logger.debug(message)
+
+    def get_board_file(self, board_type):
+        return "%s%s.yml" % (self.board_file_path, board_type)
+
+    def get_board_types(self):
+        """Returns the board types for which a board file exists"""
+        return sorted(board_file[:-len(".yml")] for board_file in os.listdir(self.board_file_path)
+                      if board_file.endswith(".yml"))
+
+    def get_profile(self, board_type, save_cache=True):
+        """Returns the compiled profile of the given board type, parsing the board file only
+        if it changed since it was last compiled"""
+        file_stat = os.stat(self.get_board_file(board_type))
+        with self.lock:
+            cache_entry = self.profiles.get(board_type)
+        if cache_entry is not None and cache_entry[:2] == (file_stat.st_mtime_ns, file_stat.st_size):
+            return cache_entry[2]
+
+        self._log_debug("Parsing board file for %s" % board_type)
+        with open(self.get_board_file(board_type)) as file_stream:
+            board_profile = compile_board_file(board_type, yaml.load_all(file_stream, Loader=BoardFileLoader))
+
+        with self.lock:
+            self.profiles[board_type] = (file_stat.st_mtime_ns, file_stat.st_size, board_profile)
+        if save_cache:
+            self.save_cache()
+        return board_profile
+
+    def load_all(self):
+        """Compiles (or validates the cached profiles of) all the board files"""
+        board_profiles = dict((board_type, self.get_profile(board_type, save_cache=False))
+                              for board_type in self.get_board_types())
+        self.save_cache()
+        return board_profiles
+
+    def invalidate(self, board_type=None):
+        """Drop a cached profile, or all of them if no board type is given"""
+        with self.lock:
+            if board_type is None:
+                self.profiles.clear()
+            else:
+                self.profiles.pop(board_type, None)
+
+    def save_cache(self):
+        """Write the compiled profiles to the cache file, if one was configured"""
+        if not self.cache_file:
+            return
+        with self.lock:
+            temp_file = "%s.%d.tmp" % (self.cache_file, threading.get_ident())
+            with open(temp_file, "wb") as cache_stream:
+                pickle.dump(self.profiles, cache_stream, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_file, self.cache_file)
+
+
+# Registries shared by all the components of this process, one per board files folder
+_shared_registries = {}
+_shared_registries_lock = threading.Lock()
+
+def get_shared_registry(board_files_path):
+    """Returns the process-wide BoardFileRegistry for the given board files folder"""
+    with _shared_registries_lock:
+        if board_files_path not in _shared_registries:
+            _shared_registries[board_files_path] = BoardFileRegistry(board_files_path)
+        return _shared_registries[board_files_path]
@@ -0,0 +1,282 @@
+import os
+import re
+import pty
+import shlex
+import signal
+import codecs
+import asyncio
+import threading
+import subprocess
+import pexpect
+
+class ConsoleManager:
+    """Drives the serial consoles of many boards from a single event loop, running in a
+    background thread. Console output is read without blocking as soon as it arrives and
+    goes to a per-board log file, instead of being interleaved on stdout.
+    The sessions handed out by open_console() offer the blocking, pexpect-like interface the
+    board objects already use (send, sendline, expect...), so the caller's thread only waits
+    for its own board while the actual I/O for all the boards is multiplexed here."""
+
+    def __init__(self, logger_handle=None):
+        """Object constructor. Starts the event loop thread"""
+        self.logger = logger_handle
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, name="damf-consoles")
+        self.loop_thread.daemon = True
+        self.loop_thread.start()
+
+        # board name -> ConsoleSession
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def run(self, coroutine, timeout=None):
+        """Runs a coroutine on the event loop and waits for its result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def open_console(self, board_name, command, log_file_path):
+        """Starts the console command (e.g. "target <board>") on a new pseudo-terminal and
+        returns the ConsoleSession driving it. Any previous session of the board is closed."""
+        self.close_console(board_name)
+        console_session = ConsoleSession(self, board_name, command, log_file_path)
+        self.run(console_session.start())
+        with self.lock:
+            self.sessions[board_name] = console_session
+        if self.logger:
+            self.logger.debug("Console of %s opened (%s)" % (board_name, command))
+        return console_session
+
+    def close_console(self, board_name):
+        with self.lock:
+            console_session = self.sessions.pop(board_name, None)
+        if console_session is not None:
+            console_session.close()
+
+    def shutdown(self):
+        """Close all the consoles and stop the event loop"""
+        with self.lock:
+            board_names = list(self.sessions)
+        for board_name in board_names:
+            self.close_console(board_name)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+
+
+class ExpectStateMachine:
+    """Describes how to react to console output. Each state holds a list of transitions
+    (pattern, response, next state): when the pattern shows up on the console, the response
+    (a line of text, or None) is sent and the machine moves to the next state. The machine
+    stops when it reaches a state that has no transitions."""
+
+    def __init__(self, initial_state, timeout=30):
+        self.initial_state = initial_state
+        self.timeout = timeout
+        self.transitions = {}
+
+    def add_transition(self, state, pattern, next_state, response=None):
+        self.transitions.setdefault(state, []).append((pattern, response, next_state))
+        return self
+
+
+class ConsoleSession:
+    """A single board console, driven by the ConsoleManager event loop. The *_async
+    methods must run on the event loop; the others are blocking wrappers meant to be called
+    from the board worker threads and mimic the pexpect spawn interface."""
+
+    # Size of a single non-blocking read
+    READ_SIZE = 65536
+
+    # Amount of unconsumed console output kept for pattern matching; older output is only
+    # available in the log file
+    MAX_BUFFER_SIZE = 262144
+
+    # Seconds the console command gets for exiting after SIGTERM, before it is killed
+    CLOSE_TIMEOUT = 5
+
+    def __init__(self, manager, board_name, command, log_file_path):
+        self.manager = manager
+        self.board_name = board_name
+        self.command = command
+        self.log_file = open(log_file_path, "a")
+
+        # Extra sink for the console output (same use as pexpect's logfile attribute)
+        self.logfile = None
+
+        self.process = None
+        self.master_fd = None
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        # Console output received but not consumed by expect() yet
+        self.buffer = ""
+        self.eof = False
+        # The (compiled patterns, future) pair expect() is waiting on, if any
+        self.waiter = None
+
+        # Same meaning as the pexpect attributes
+        self.before = ""
+        self.after = ""
+        self.match = None
+
+    async def start(self):
+        """Spawns the console command on a pseudo-terminal and registers it with the loop"""
+        self.master_fd, slave_fd = pty.openpty()
+        self.process = subprocess.Popen(shlex.split(self.command),
+                                        stdin=slave_fd, stdout=slave_fd, stderr=slave_fd,
+                                        start_new_session=True, close_fds=True)
+        os.close(slave_fd)
+        os.set_blocking(self.master_fd, False)
+        asyncio.get_running_loop().add_reader(self.master_fd, self._on_readable)
+
+    def _on_readable(self):
+        """Called by the event loop whenever console output is available"""
+        try:
+            data = os.read(self.master_fd, self.READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            # EIO: the console command exited and the terminal is gone
+            data = b""
+
+        if not data:
+            self._on_eof()
+            return
+
+        text = self.decoder.decode(data)
+        self.log_file.write(text)
+        self.log_file.flush()
+        if self.logfile is not None:
+            self.logfile.write(text)
+        self.buffer += text
+        if len(self.buffer) > self.MAX_BUFFER_SIZE:
+            self.buffer = self.buffer[-self.MAX_BUFFER_SIZE:]
+        self._check_waiter()
+
+    def _on_eof(self):
+        self.eof = True
+        asyncio.get_running_loop().remove_reader(self.master_fd)
+        self._check_waiter()
+
+    def _search(self, patterns):
+        """Returns the index and match of the pattern matching earliest in the buffer"""
+        best_index, best_match = None, None
+        for pattern_index, pattern in enumerate(patterns):
+            match = pattern.search(self.buffer)
+            if match is not None and (best_match is None or match.start() < best_match.start()):
+                best_index, best_match = pattern_index, match
+        return best_index, best_match
+
+    def _check_waiter(self):
+        if self.waiter is None:
+            return
+        (patterns, future) = self.waiter
+        if future.done():
+            self.waiter = None
+            return
+        (pattern_index, match) = self._search(patterns)
+        if match is not None:
+            self._consume(match)
+            self.waiter = None
+            future.set_result(pattern_index)
+        elif self.eof:
+            self.waiter = None
+            future.set_exception(pexpect.EOF("Console of %s closed" % self.board_name))
+
+    def _consume(self, match):
+        self.before = self.buffer[:match.start()]
+        self.after = match.group(0)
+        self.match = match
+        self.buffer = self.buffer[match.end():]
+
+    @staticmethod
+    def _compile(patterns):
+        if not isinstance(patterns, (list, tuple)):
+            patterns = [patterns]
+        return [pattern if hasattr(pattern, "search") else re.compile(pattern) for pattern in patterns]
+
+    async def expect_async(self, patterns, timeout=30):
+        """Waits for one of the patterns to show up on the console and returns its index.
+        Raises pexpect.TIMEOUT or pexpect.EOF, like pexpect does."""
+        patterns = self._compile(patterns)
+        (pattern_index, match) = self._search(patterns)
+        if match is not None:
+            self._consume(match)
+            return pattern_index
+        if self.eof:
+            raise pexpect.EOF("Console of %s closed" % self.board_name)
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiter = (patterns, future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.before = self.buffer
+            raise pexpect.TIMEOUT("Timeout waiting for %s on %s" % ([p.pattern for p in patterns], self.board_name))
+        finally:
+            self.waiter = None
+
+    async def send_async(self, text):
+        data = text.encode("utf-8")
+        while data:
+            try:
+                written = os.write(self.master_fd, data)
+                data = data[written:]
+            except BlockingIOError:
+                # The terminal buffer is full; give the board some time to catch up
+                await asyncio.sleep(0.01)
+        return len(text)
+
+    async def run_state_machine_async(self, machine):
+        """Runs an ExpectStateMachine on this console and returns the final state"""
+        state = machine.initial_state
+        while state in machine.transitions:
+            transitions = machine.transitions[state]
+            transition_index = await self.expect_async([pattern for (pattern, response, next_state) in transitions],
+                                                       machine.timeout)
+            (pattern, response, next_state) = transitions[transition_index]
+            if response is not None:
+                await self.send_async(response + "\n")
+            state = next_state
+        return state
+
+    # Blocking, pexpect-like interface
+    def expect(self, patterns, timeout=30):
+        return self.manager.run(self.expect_async(patterns, timeout))
+
+    def send(self, text):
+        return self.manager.run(self.send_async(text))
+
+    def sendline(self, text=""):
+        return self.send(text + "\n")
+
+    def sendcontrol(self, char):
+        return self.send(chr(ord(char) & 0x1f))
+
+    def run_state_machine(self, machine):
+        return self.manager.run(self.run_state_machine_async(machine))
+
+    async def _release_async(self):
+        if self.master_fd is not None:
+            if not self.eof:
+                asyncio.get_running_loop().remove_reader(self.master_fd)
+            os.close(self.master_fd)
+            self.master_fd = None
+
+    def close(self):
+        """Stops the console command and releases the terminal"""
+        self.manager.run(self._release_async())
+        if self.process is not None and self.process.poll() is None:
+            try:
+                os.killpg(self.process.pid, signal.SIGTERM)
+            except OSError:
+                pass
+            try:
+                self.process.wait(self.CLOSE_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                # The console command ignores SIGTERM; do not let it hold up the shutdown
+                if self.manager.logger:
+                    self.manager.logger.warning("Console command of %s did not exit, killing it" % self.board_name)
+                try:
+                    os.killpg(self.process.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+                self.process.wait()
+        self.log_file.close()
@@ -1,11 +1,12 @@
-import xml.etree.cElementTree as ET
+import os
+import xml.etree.ElementTree as ET
 import yaml
 
 class Constants:
     """Provides access to the constants we are using throughout our tools.
     More specifically, it uses an INI-like file as it's data source."""
 
-    def __init__(self, constantsFile = '/homes/drio/git.enea.se/current_work/lava-replacement/target_manager/Constants/Constants.xml'):
+    def __init__(self, constantsFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Constants.xml')):
         """Constants object constructor. Defines dictionaries used to hold various
         constants (strings, messages, credentials, etc.)"""
         self.tree = ET.ElementTree(file=constantsFile)
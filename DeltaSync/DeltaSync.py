@@ -0,0 +1,150 @@
+import os
+import json
+import hashlib
+import threading
+
+class DeltaSync:
+    """Incremental deployment of test files. The content hash of every deployed file is
+    kept in a manifest, stored locally for each board. A small marker file on the board
+    holds the digest of the manifest that was last deployed there: when it matches the local
+    manifest we know what the board already has, and only added or changed files are sent
+    (stale ones are deleted). A missing or different marker (e.g. the board was reflashed)
+    simply means a full deployment."""
+
+    # Where the marker is stored on the board
+    MARKER_PATH = "/home/root/.damf_manifest"
+
+    # Read size used when hashing files
+    CHUNK_SIZE = 1048576
+
+    def __init__(self, manifest_dir, logger_handle=None):
+        """Object constructor"""
+        self.manifest_dir = manifest_dir
+        self.logger = logger_handle
+        if not os.path.exists(self.manifest_dir):
+            os.makedirs(self.manifest_dir)
+
+        # Deployments to the same board must not interleave
+        self.board_locks = {}
+        self.lock = threading.Lock()
+
+    def _log_info(self, message):
+        if self.logger:
+            self.logger.info(message)
+
+    def hash_file(self, file_path):
+        file_hash = hashlib.sha1()
+        with open(file_path, "rb") as file_stream:
+            for chunk in iter(lambda: file_stream.read(self.CHUNK_SIZE), b""):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+    def build_manifest(self, entries, executables=(), exclude_names=()):
+        """Returns a dictionary mapping each remote file path to a (content hash, mode) pair,
+        along with the local path of each remote file. entries is a list of (local path,
+        absolute remote path) pairs, as for SSHSession.put_archive."""
+        executables = set(executables)
+        exclude_names = set(exclude_names)
+        manifest = {}
+        local_paths = {}
+
+        def add_file(local_path, remote_path):
+            manifest[remote_path] = (self.hash_file(local_path), 0o755 if remote_path in executables else 0o644)
+            local_paths[remote_path] = local_path
+
+        for (local_path, remote_path) in entries:
+            if not os.path.isdir(local_path):
+                add_file(local_path, remote_path)
+                continue
+            local_root = os.path.normpath(local_path)
+            for (dir_path, dir_names, file_names) in os.walk(local_root):
+                dir_names[:] = [dir_name for dir_name in dir_names if dir_name not in exclude_names]
+                relative_dir = os.path.relpath(dir_path, local_root)
+                for file_name in file_names:
+                    if file_name in exclude_names:
+                        continue
+                    remote_file = os.path.normpath(os.path.join(remote_path, relative_dir, file_name))
+                    add_file(os.path.join(dir_path, file_name), remote_file)
+        return (manifest, local_paths)
+
+    @staticmethod
+    def manifest_digest(manifest):
+        return hashlib.sha1(json.dumps(sorted(manifest.items())).encode("utf-8")).hexdigest()
+
+    def _manifest_file(self, board_name):
+        return os.path.join(self.manifest_dir, "%s.json" % board_name)
+
+    def load_board_manifest(self, ssh_session, board_name):
+        """Returns the manifest of what the board currently holds (empty if unknown)"""
+        try:
+            with open(self._manifest_file(board_name)) as manifest_file:
+                manifest = dict((remote_path, tuple(file_entry))
+                                for remote_path, file_entry in json.load(manifest_file).items())
+        except (IOError, ValueError):
+            return {}
+
+        (exit_code, marker) = ssh_session.run("cat %s" % self.MARKER_PATH)
+        if exit_code != 0 or marker.strip() != self.manifest_digest(manifest):
+            return {}
+        return manifest
+
+    def save_board_manifest(self, ssh_session, board_name, manifest):
+        """Records the new board contents, locally and in the marker on the board"""
+        temp_file = self._manifest_file(board_name) + ".tmp"
+        with open(temp_file, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(temp_file, self._manifest_file(board_name))
+        return ssh_session.run("cat > %s" % self.MARKER_PATH,
+                               input_data=self.manifest_digest(manifest).encode("utf-8"))
+
+    def sync(self, ssh_session, board_name, entries, executables=(), exclude_names=(), compress=True,
+             prebuilt_manifest=None):
+        """Brings the board up to date with the given entries, transferring only what changed.
+        prebuilt_manifest is the result of build_manifest for the same entries, if it was
+        computed beforehand (e.g. while the board was booting).
+        Returns an (exit code, output) tuple."""
+        with self.lock:
+            board_lock = self.board_locks.setdefault(board_name, threading.Lock())
+
+        with board_lock:
+            if prebuilt_manifest is not None:
+                (local_manifest, local_paths) = prebuilt_manifest
+            else:
+                (local_manifest, local_paths) = self.build_manifest(entries, executables, exclude_names)
+            board_manifest = self.load_board_manifest(ssh_session, board_name)
+
+            changed_files = sorted(remote_path for remote_path, file_entry in local_manifest.items()
+                                   if board_manifest.get(remote_path) != file_entry)
+            stale_files = sorted(remote_path for remote_path in board_manifest if remote_path not in local_manifest)
+            self._log_info("Delta deployment to %s: %d changed, %d stale, %d unchanged files" % (
+                                board_name,
+                                len(changed_files),
+                                len(stale_files),
+                                len(local_manifest) - len(changed_files)))
+
+            # Invalidate the marker first: if anything below fails, the next deployment
+            # will be a full one
+            ssh_session.run("rm -f %s" % self.MARKER_PATH)
+
+            output = []
+            if stale_files:
+                (exit_code, command_output) = ssh_session.run(
+                                    "while IFS= read -r stale_file; do rm -f \"$stale_file\"; done",
+                                    input_data="".join("%s\n" % remote_path for remote_path in stale_files).encode("utf-8"))
+                output.append(command_output)
+                if exit_code != 0:
+                    return (exit_code, "".join(output))
+
+            if changed_files:
+                (exit_code, command_output) = ssh_session.put_archive(
+                                    [(local_paths[remote_path], remote_path) for remote_path in changed_files],
+                                    executables=[remote_path for remote_path in changed_files
+                                                 if local_manifest[remote_path][1] == 0o755],
+                                    compress=compress)
+                output.append(command_output)
+                if exit_code != 0:
+                    return (exit_code, "".join(output))
+
+            (exit_code, command_output) = self.save_board_manifest(ssh_session, board_name, local_manifest)
+            output.append(command_output)
+            return (exit_code, "".join(output))
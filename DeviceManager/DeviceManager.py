@@ -8,34 +8,51 @@ import pexpect
 import datetime
 import logging
 import re
-import subprocess
 import shlex
 #import urllib.request
 import base64
-import queue
-from git import Repo
-from threading import Thread
+import threading
+import concurrent.futures
+from collections import namedtuple
 from ResourcePool import ResourcePool
 from Constants import Constants
-from BoardObject import BoardObject
+from DeviceObject import DeviceObject
 from ResultParser import ResultParser
+from JobScheduler import JobScheduler
+from BoardInventory import BoardInventory
+from BoardProfile import BoardProfile
+from Exceptions import Exceptions
+from ConsoleManager import ConsoleManager
+from IpDiscovery import IpDiscovery
+from DeltaSync import DeltaSync
+from GitCache import GitCache
+from WarmPool import WarmPool
+from ReservationManager import ReservationManager
+from LabBackend import LabBackend
+
+# Outcome of a test package installation. In batch mode, a single result covers all the
+# packages (package holds their space-separated names).
+PackageInstallResult = namedtuple("PackageInstallResult", ["package", "exit_code", "duration", "output"])
 
 class DeviceManager:
     """Provides methods and features for easily managing boards. 
     Available operations are: image loading, bootloader interaction, board reservation 
     management, board communication and output parsing."""
 
+    # Package installers named like this go through dpkg (see install_test_packages)
+    DPKG_INSTALLER_PATTERN = re.compile(r"(?<![a-z])(deb|dpkg|apt)", re.IGNORECASE)
+
     # Instantiate the Constants object and a logger during the 
     # BoardManager construction phase.
-    def __init__(self, cfg_file, debug=False):
+    def __init__(self, cfg_file, debug=False, daemon=False):
         """The BoardManager constructor, used for declaring, setting and instantiating all
-        the attributes & objects that are going to be used throughout the test flow."""
+        the attributes & objects that are going to be used throughout the test flow.
+        A daemon runs every job of the queue; otherwise, only the jobs submitted through
+        this object are run (the queue may be shared with a daemon)."""
         # Instantiate the Constants class
         self.constants = Constants.Constants()
 
         self.debug_logging = debug
-        # We need to use queues in order to process the jobs submitted to the framework
-        #self.request_queue = queue(maxsize=10)
 
         # A dictionary used to store the boards available for our tests (we parse additional
         # IVLab attributes in order to extract this)
@@ -47,7 +64,7 @@ class DeviceManager:
         # BMTF CONFIG LOADING
         # =================================
         # Load the config
-        config_file_data = yaml.load(open(cfg_file, 'r'))
+        config_file_data = yaml.safe_load(open(cfg_file, 'r'))
 
         # Create workspace folder structure
         self.workspace = "{0}{1}/".format(config_file_data["workspace"]["root_path"],time.strftime("%Y_%m_%d_%H_%M"))
@@ -91,160 +108,449 @@ class DeviceManager:
         self.logger.info("BoardManager and its dependencies are up and running.")
 
         print("BMTF started successfully. Processing your request...")
+        # The tools used for reserving, powering and reaching the boards and for querying the
+        # inventory: the target lab tools, or a local lab simulator (lab section: backend,
+        # plus the backend settings)
+        self.lab = LabBackend.create_backend(config_file_data.get("lab"), self.logger)
+
+        # The lab inventory is shared by the ResourcePool and all the board objects, so that
+        # board details are only looked up once in a while
+        self.inventory = BoardInventory.BoardInventory(
+                                config_file_data["global_settings"].get("inventory_ttl", 300),
+                                self.logger,
+                                self.lab.inventory_command)
+
+        # Board files are compiled once and reused by every job; the compiled profiles can
+        # also be kept on disk between runs
+        self.board_registry = BoardProfile.BoardFileRegistry(
+                                self.board_file_path,
+                                config_file_data["global_settings"].get("board_cache_file"),
+                                self.logger)
+
+        # Board reservations are leased for lease_minutes and renewed while in use; the
+        # leases held are journaled (one journal per process, named after the journal
+        # setting), so that those of a crashed run get released on the next start
+        # (reservations section: lease_minutes, renew_margin, attempts, backoff, journal)
+        reservation_settings = config_file_data.get("reservations") or {}
+        self.reservations = ReservationManager.ReservationManager(
+                                self.lab.reserve_command or self.constants.COMMANDS["reservetarget"],
+                                self.lab.release_command or self.constants.COMMANDS["unreservetarget"],
+                                reservation_settings.get("journal",
+                                        "{0}damf-leases.json".format(config_file_data["workspace"]["root_path"])),
+                                self.logger,
+                                reservation_settings.get("lease_minutes", 30),
+                                reservation_settings.get("renew_margin", 300),
+                                reservation_settings.get("attempts", 3),
+                                reservation_settings.get("backoff", 2))
+
         # Instantiate the ResourcePool class. The object will already have a list of available
         # boards.
-        self.resource_pool = ResourcePool.ResourcePool(self.board_file_path, self.logger)
+        self.resource_pool = ResourcePool.ResourcePool(self.board_file_path, self.logger, self.inventory,
+                                                       self.board_registry)
+        self.resource_pool.find_available_boards()
+
+        # Board consoles can be multiplexed on a single event loop instead of having one
+        # blocking pexpect session per board
+        self.console_manager = None
+        if config_file_data["global_settings"].get("multiplex_consoles", False):
+            self.console_manager = ConsoleManager.ConsoleManager(self.logger)
+
+        # SSH connections to the boards are opened once per job and shared by deployment,
+        # test runs and result fetching
+        ssh_settings = config_file_data.get("ssh") or {}
+        self.ssh_pool = self.lab.create_ssh_pool(self.logger,
+                                                 ssh_settings.get("user", "root"),
+                                                 ssh_settings.get("persist", 600),
+                                                 ssh_settings.get("options"))
+
+        # Board IP addresses are read from the console, or looked up by MAC address in the
+        # ARP table and the DHCP leases (ip_discovery section: lease_files, arp_file)
+        ip_discovery_settings = config_file_data.get("ip_discovery") or {}
+        self.ip_discovery = IpDiscovery.IpDiscovery(self.logger,
+                                                    ip_discovery_settings.get("lease_files"),
+                                                    ip_discovery_settings.get("arp_file", "/proc/net/arp"))
+
+        # How test files are copied to the boards (mode: tar, delta or scp) and how the
+        # test packages are installed (install_mode: serial, batch or parallel)
+        self.deployment_settings = config_file_data.get("deployment") or {}
+
+        # Delta deployments keep a manifest of what each board holds, so that only the files
+        # that changed since the previous job are sent
+        self.delta_sync = None
+        if self.deployment_settings.get("mode") == "delta":
+            self.delta_sync = DeltaSync.DeltaSync(
+                                    self.deployment_settings.get("manifest_dir",
+                                            "{0}manifests/".format(config_file_data["workspace"]["root_path"])),
+                                    self.logger)
+
+        # Test repositories are mirrored once and only fetched incrementally afterwards;
+        # the jobs get shared clones of the mirrors
+        git_cache_settings = config_file_data.get("git_cache") or {}
+        self.git_cache = GitCache.GitCache(
+                                git_cache_settings.get("path",
+                                        "{0}git-cache/".format(config_file_data["workspace"]["root_path"])),
+                                self.logger,
+                                git_cache_settings.get("fetch_interval", 0))
+
+        # Boards may be kept booted after a job, for the next job using the same image and
+        # boot configuration (warm_pool section: enabled, idle_window, health_check_timeout)
+        self.warm_pool_settings = config_file_data.get("warm_pool") or {}
+        self.warm_pool = None
+        if self.warm_pool_settings.get("enabled", False):
+            self.warm_pool = WarmPool.WarmPool(self.release_board_object,
+                                               self.logger,
+                                               self.warm_pool_settings.get("idle_window", 600))
+
+        # Deployment files are shared by all the nodes of a job
+        self.deployment_files_lock = threading.Lock()
+
+        # The host side of a job (test repository checkouts, deployment files, delta
+        # manifest) is prepared by these workers while the boards power on and boot
+        pipeline_settings = config_file_data.get("pipeline") or {}
+        self.preparation_executor = concurrent.futures.ThreadPoolExecutor(
+                                max_workers=pipeline_settings.get("prepare_workers", 4),
+                                thread_name_prefix="damf-prepare")
+
+        # Where the aggregated test reports go (nightly_dir: one report per day, merging
+        # the results of all the jobs once the day is over) and whether the results are kept in the results
+        # database (store_results, results_database: defaults to the web application's)
+        self.report_settings = config_file_data.get("reports") or {}
+
+        # The nightly reports of the days that are over are written outside of the jobs: by
+        # the daemon every nightly_interval seconds, or when a one-shot run shuts down
+        self.nightly_stop_event = threading.Event()
+        self.nightly_thread = None
+        if daemon and self.report_settings.get("nightly_dir"):
+            self.nightly_thread = threading.Thread(target=self._nightly_loop, name="damf-nightly")
+            self.nightly_thread.daemon = True
+            self.nightly_thread.start()
+
+        # Result files are parsed by a pool of worker processes shared by all the jobs
+        # (reports section: parse_workers, defaults to the number of CPUs)
+        self.result_worker_pool = ResultParser.create_worker_pool(self.report_settings.get("parse_workers"))
 
         # Instantiate the ResultParser component
         #self.result_parser = ResultParser(self.workspace + self.test_results_dir, self.workspace + self.test_results_dir)
 
+        # Test requests are stored in a persistent queue and processed by a pool of workers.
+        # The queue file lives outside of the timestamped workspace, so that pending jobs
+        # survive a restart of the framework. Running jobs hold a lease (job_lease seconds,
+        # kept alive while they run), so that the jobs of a process that died are run again.
+        scheduler_settings = config_file_data.get("scheduler") or {}
+        queue_file = scheduler_settings.get("queue_file",
+                                            "{0}damf-queue.db".format(config_file_data["workspace"]["root_path"]))
+        self.job_queue = JobScheduler.JobQueue(queue_file, scheduler_settings.get("job_lease", 120))
+        self.scheduler = JobScheduler.JobScheduler(
+                                self.job_queue,
+                                self.run_job,
+                                self.logger,
+                                workers=scheduler_settings.get("workers", 1),
+                                board_type_limits=scheduler_settings.get("board_type_limits"),
+                                default_limit=scheduler_settings.get("default_board_type_limit"),
+                                claim_all_jobs=daemon
+                                )
+
+        # There may be more workers than free boards: how long a job waits for busy boards
+        # before failing (None: no limit)
+        self.allocation_timeout = scheduler_settings.get("allocation_timeout", 3600)
+        self.scheduler.start()
+
     def get_board_types(self):
         """Returns a list of available board types"""
         return self.resource_pool.board_types
 
-    def submit_test_request(self, request_data):
-        """Receives request data in YAML format, forwarded by the bmtf-run script (for now).
-        Forwards it to process_request() in a distinct thread"""
-
-        # When queues are used, assign IDs to the test requests
+    def submit_test_request(self, request_data, priority=0):
+        """Receives request data in YAML format, forwarded by the run-damf script (for now).
+        The request is stored in the job queue and picked up by one of the scheduler workers.
+        Returns the job ID, which can be used for polling the job status."""
         self.logger.info("Test request submitted")
         self.logger.debug("Raw test request data follows:\n %s \n >>> End of raw data" % request_data)
-        
+
+        # Parse the request right away, so that malformed requests are rejected before
+        # they reach the queue
         new_test_request = TestRequest(request_data)
-        self.process_request(new_test_request)
+        return self.scheduler.submit(request_data, new_test_request.master_board, priority)
+
+    def get_job_status(self, job_id):
+        """Returns the details of a submitted job (state, timestamps and error, if any)"""
+        return self.scheduler.get_job_status(job_id)
+
+    def list_jobs(self, state=None):
+        """Returns the status of all the jobs (or of the jobs in the given state)"""
+        return [self.get_job_status(job_id) for job_id in self.job_queue.list_jobs(state)]
+
+    def wait_for_job(self, job_id, timeout=None, poll_interval=1.0):
+        """Blocks until the given job is done and returns its final status. The job state is
+        checked every poll_interval seconds."""
+        return self.scheduler.wait_for_job(job_id, timeout, poll_interval)
+
+    def finalize_nightly_reports(self):
+        """Writes the nightly reports of the days that are over (see
+        ResultParser.finalize_nightly_reports)"""
+        if not self.report_settings.get("nightly_dir"):
+            return
+        for (day, totals) in sorted(ResultParser.finalize_nightly_reports(self.report_settings["nightly_dir"]).items()):
+            self.logger.info("Nightly report of %s written: %s" % (day, totals))
+
+    def _nightly_loop(self):
+        while True:
+            try:
+                self.finalize_nightly_reports()
+            except Exception:
+                self.logger.exception("Could not write the nightly reports")
+            if self.nightly_stop_event.wait(self.report_settings.get("nightly_interval", 600)):
+                return
+
+    def shutdown(self):
+        """Stop the scheduler workers once they are done with their current jobs"""
+        self.scheduler.stop()
+        self.job_queue.close()
+        if self.nightly_thread is not None:
+            self.nightly_stop_event.set()
+            self.nightly_thread.join()
+        self.finalize_nightly_reports()
+        if self.warm_pool is not None:
+            self.warm_pool.close()
+        self.preparation_executor.shutdown()
+        self.result_worker_pool.shutdown()
+        self.reservations.close()
+        if self.console_manager is not None:
+            self.console_manager.shutdown()
+        self.ssh_pool.close_all()
+        self.lab.close()
+
+    def run_job(self, job_id, request_data):
+        """Called by the scheduler workers for each job taken out of the queue"""
+        test_request = TestRequest(request_data)
+        test_request.job_id = job_id
+
+        # Jobs may run concurrently, so each one gets its own folder structure
+        # inside the workspace
+        test_request.workspace = "{0}job_{1}/".format(self.workspace, job_id)
+        for folder in self.workspace_folders:
+            if not os.path.exists(test_request.workspace + folder):
+                os.makedirs(test_request.workspace + folder)
 
-        #new_test_request = TestRequest(request_data)
-        #worker_thread = Thread(target=self.process_request, args=(new_test_request,))
-        #worker_thread.setDaemon(True)
-        #worker_thread.start()
+        self.process_request(test_request)
 
     def process_request(self, test_request_object):
         """Begin actions based on the request data. Basically, this is where we initiate the 
-        whole flow. For now, we only support single-node flows!"""
+        whole flow. Single-node jobs run on the master board only; multinode jobs run all
+        their nodes in parallel (see process_multinode_request).
+        The job runs as a small pipeline: the host side (see prepare_job) starts right away
+        in the background, while the boards are reserved, powered on and booted. Deployment
+        only waits for it once a board has an IP address."""
         # TODO: implement calls to the rest of the objects
-        # TODO: implement multinode support
 
         self.logger.debug("master board type: %s" % test_request_object.master_board)
-        # NOTE: For the moment, we only treat single node scenarios
+        test_request_object.preparation = self.preparation_executor.submit(self.prepare_job, test_request_object)
+        try:
+            if test_request_object.job_type == "multinode":
+                self.process_multinode_request(test_request_object)
+            else:
+                self.process_single_node_request(test_request_object)
+        finally:
+            # Do not return while the checkout of a failed job is still writing to its workspace
+            try:
+                test_request_object.preparation.result()
+            except Exception:
+                pass
+
+    def prepare_job(self, test_request_object):
+        """Host side of a job, independent of the boards: checks out the Git repositories,
+        writes the deployment files and, for delta deployments, hashes the files to deploy."""
         # First, see if we need to clone any Git repositories
         if len(test_request_object.git_repos) > 0:
             self.logger.debug("Git repositories were specified in the test request. Processing them now...")
             for repo_url in test_request_object.git_repos:
-                self.logger.debug("Cloning %s..." % repo_url)
-                Repo.clone_from(repo_url, os.path.abspath(self.workspace) + "/git/")
+                self.logger.debug("Checking out %s..." % repo_url)
+                self.git_cache.checkout(repo_url,
+                                        os.path.abspath(test_request_object.workspace) + "/git/",
+                                        test_request_object.git_ref)
+
+        self.write_deployment_files(test_request_object)
+
+        if self.delta_sync is not None:
+            test_repo = test_request_object.workspace + "/git/"
+            test_request_object.deployment_manifest = (test_repo, self.delta_sync.build_manifest(
+                                    self.get_deployment_entries(test_repo, test_request_object),
+                                    [self.get_package_installer_path(test_request_object)],
+                                    self.deployment_settings.get("exclude", [".git"])))
+        self.logger.info("Job %s prepared for deployment" % test_request_object.job_id)
+
+    def wait_for_preparation(self, test_request_object):
+        """Blocks until the host side of the job is ready (re-raising its errors)"""
+        if test_request_object.preparation is not None:
+            test_request_object.preparation.result()
+
+    def process_single_node_request(self, test_request_object):
+        """Runs a single-node job on the master board"""
+        # A board still running the same image after a previous job skips power on and boot
+        board_object = self.take_warm_board(test_request_object, "master", test_request_object.master_board)
+        if board_object is not None:
+            board_name = board_object.get_board_name()
+        else:
+            board_name = self.allocate_board(test_request_object.master_board)
 
-        self.perform_board_work(
-                            self.control_board(
-                                        self.resource_pool.get_board_by_type(test_request_object.master_board), 
+        job_done = False
+        try:
+            if board_object is None:
+                board_object = self.control_board(
+                                        board_name, 
                                         test_request_object.master_board,
-                                        "master"), 
-                            test_request_object
-                            )
-
+                                        "master",
+                                        test_request_object.workspace)
+            self.perform_board_work(board_object, test_request_object)
+            job_done = True
+        finally:
+            if board_object is not None:
+                self.finish_board(board_object, test_request_object, job_done)
+            else:
+                self.unreserve_board(board_name)
+                self.resource_pool.release_board(board_name)
+
+    def process_multinode_request(self, test_request_object):
+        """Runs a multinode job. All the nodes are reserved together, then every node goes
+        through the power on, boot, deploy and test phases in its own thread. A barrier
+        keeps the nodes in step, so that the tests only start once every node has its tests
+        deployed (e.g. tests on the master never run against a slave still booting)."""
+        node_list = test_request_object.node_boards
+        self.logger.info("Multinode job with %d nodes: %s" % (len(node_list), node_list))
+
+        # Boards for all the nodes are taken out of the pool in one atomic step
+        board_names = self.allocate_nodes([board_type for (board_role, board_type) in node_list])
+        board_objects = []
+        job_done = False
+        try:
+            board_objects = self.control_boards(board_names, node_list, test_request_object.workspace)
+
+            phase_barrier = threading.Barrier(len(board_objects))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(board_objects)) as executor:
+                node_futures = [executor.submit(self._run_node_phases, board_object, test_request_object, phase_barrier)
+                                for board_object in board_objects]
+                # Re-raise the first error encountered by one of the nodes
+                for node_future in node_futures:
+                    node_future.result()
+            job_done = True
+        finally:
+            for board_object in board_objects:
+                self.finish_board(board_object, test_request_object, job_done)
+            if not board_objects:
+                for board_name in board_names:
+                    self.unreserve_board(board_name)
+                    self.resource_pool.release_board(board_name)
+
+        if any(board_object.has_test_results for board_object in board_objects):
+            self.logger.info("Test results found. Processing...")
+            self.process_test_results2(test_request_object.workspace,
+                                       test_request_object.result_format,
+                                       test_request_object.job_id,
+                                       board_objects)
+
+    def _run_node_phases(self, board_object, test_request_object, phase_barrier):
+        """Runs all the node phases for one board of a multinode job, waiting for the other
+        nodes between phases. If this node fails, the barrier is broken so that the other
+        nodes stop as well instead of waiting forever.
+        A node deploys as soon as it is booted, without waiting for the other nodes to boot:
+        deployment only touches the node itself. The tests start together."""
+        for node_phase in ((self.power_on_node, self.boot_node, self.deploy_node), (self.test_node,)):
+            for node_step in node_phase:
+                try:
+                    node_step(board_object, test_request_object)
+                except Exception:
+                    self.logger.exception("%s failed during %s" % (board_object.get_board_name(), node_step.__name__))
+                    phase_barrier.abort()
+                    raise
+            phase_barrier.wait()
 
-        
     def perform_board_work(self, board_object, test_request_object):
-        # Continue work with the board
+        """Runs all the node phases for a single board, one after the other"""
+        self.power_on_node(board_object, test_request_object)
+        self.boot_node(board_object, test_request_object)
+        self.deploy_node(board_object, test_request_object)
+        self.test_node(board_object, test_request_object)
+
+        if board_object.has_test_results:
+            self.logger.info("Test results found. Processing...")
+
+            # TODO: A temporary workaround in order to test out test result processing
+            # changes; This needs to be fixed!
+            # self.process_test_results(board_object.board_name)
+            self.process_test_results2(test_request_object.workspace,
+                                       test_request_object.result_format,
+                                       test_request_object.job_id,
+                                       [board_object])
+
+    def power_on_node(self, board_object, test_request_object):
+        """Node phase: bring the board power up"""
+        if board_object.booted:
+            self.logger.info("%s is already booted, skipping power on" % board_object.get_board_name())
+            return
         board_object.power_on()
 
-        # TODO: This is TEMPORARY! A bit of hardcoding here, for testing purposes.
-        # Need to clarify how to differentiate between config details of the same 
-        # board type.
-        board_object.submit_config_params(test_request_object.nodes[board_object.get_board_role()])
-        #board_object.boot_board("ramdisk") # extract this from the test request
-        board_object.boot_board(test_request_object.master_boot_method)
+    def boot_node(self, board_object, test_request_object):
+        """Node phase: apply the instance configuration and boot the board"""
+        if board_object.booted:
+            self.logger.info("%s is already booted, skipping boot" % board_object.get_board_name())
+            return
+        board_role = board_object.get_board_role()
+        node_config = dict(test_request_object.get_node_config(board_role))
+        node_config.setdefault("boot_method", test_request_object.get_node_boot_method(board_role))
+
+        # Missing placeholder values are reported before we get anywhere near the bootloader
+        config_errors = board_object.submit_config_params(node_config)
+        if config_errors:
+            raise Exceptions.BootConfigError(board_object.get_board_name(), config_errors)
+        try:
+            board_object.boot_board(test_request_object.get_node_boot_method(board_role))
+        finally:
+            # Everything else goes over SSH
+            board_object.close_console()
+        board_object.booted = bool(board_object.get_board_ip())
+
+    def deploy_node(self, board_object, test_request_object):
+        """Node phase: deploy the test files and packages"""
+        node_tests = test_request_object.get_node_tests(board_object.get_board_role())
 
         # Check to see if there are any tests to run
-        if len(test_request_object.master_tests) > 0:
-            self.logger.debug("Tests found for the master role: %s" % test_request_object.master_tests)
+        if len(node_tests) > 0:
+            self.logger.debug("Tests found for the %s role: %s" % (board_object.get_board_role(), node_tests))
+
+        # The board is up; wait for the host side of the job if it is not ready yet
+        self.wait_for_preparation(test_request_object)
 
-            # TODO: trigger test deployment & execution
-        print("Deploying tests\n")
+        print("Deploying tests to %s\n" % board_object.get_board_name())
         self.logger.info("Deploying tests to %s" % board_object.get_board_name())
         self.deploy_tests(
                 board_object.get_board_ip(),
-                self.workspace + "/git/",
-                test_request_object
+                test_request_object.workspace + "/git/",
+                test_request_object,
+                node_tests,
+                board_object.get_board_name()
                         )
-        
+
+    def test_node(self, board_object, test_request_object):
+        """Node phase: run the tests and fetch the results"""
         # Call the method that triggers the test run. Pass the both the board & the test request
         # objects.
         board_object.run_tests(test_request_object)
 
-        if board_object.has_test_results:
-            self.logger.info("Test results found. Processing...")
-
-            # TODO: A temporary workaround in order to test out test result processing
-            # changes; This needs to be fixed!
-            # self.process_test_results(board_object.board_name)
-            self.process_test_results2()
-
-    #def process_request_queue(self):
-    #    """Goes through the request queue and processes taks"""
-    #    while True:
-    #        self.request_queue.get()
-    #        self.request_queue.task_done()
-
-    def reserve_board(self, board_name, attempts = 3):
-        """Perform the necessary operations for reserving the specified board. Must be moved to the ResourcePool"""
-        # ----------------------------------------------------------------------- #
-        # This method seems to match the desired reservation behavior. It tries   #
-        # to reserve for a given number of tries and, if the operation failes,    #
-        # an exception is raised.                                                 #
-        # It is advisable to work on extending this (already implemented) method  #
-        # and make it perform additional tasks, if needed (for example, to also   #
-        # try logging on to the board in order to confirm its' operational state) #
-        # ----------------------------------------------------------------------- #
-        # Create a "shell" object. We use pexpect and not pxssh, because the command is passed
-        #_shell = pexpect.spawn("bash")
-        #_shell.logfile = logfile
-
+    def reserve_board(self, board_name):
+        """Perform the necessary operations for reserving the specified board. The
+        reservation is renewed in the background until unreserve_board is called (see
+        ReservationManager). Returns the reservation ID."""
         self.logger.info(self.constants.INFO["reservationattempt"] % board_name)
-        reserved = False
-        reservation_id = None
-
-        reserve_cmd = self.constants.COMMANDS["reservetarget"] % (board_name, "5M")
-        self.logger.debug(reserve_cmd)
-        reservation_id = self.run_command(reserve_cmd)
-
-        #for i in range(attempts):
-        #    reserve_cmd = self.constants.COMMANDS["reservetarget"] % ("5M", board_name)
-        #    self.logger.debug(reserve_cmd)
-            #_shell.sendline(reserve_cmd)
-            #found = _shell.expect(["Reservation confirmed","Reservation Exception",pexpect.TIMEOUT])
-        #    reservation_id = self.run_command(reserve_cmd)
-            # This is present in the original version, since commands were executed on remote machines,
-            # via SSH. Omitting this in this context, since we run a local shell
-            #self._shell.prompt(timeout=10)
-            #if found==0:
-            #    self.logger.info(self.constants.INFO["reservationconfirmed"] % board_name)
-            #    reserved=True
-
-            #    reservation_id = _shell.before[5:-2]
-            #    break
-            #elif found==1:
-            #    self.logger.info(self.constants.INFO["targetalreadyreserved"] % board_name)
-
-                # Here we will need to invoke our ExceptionHandler, and error triage will be
-                # done there. So, whenever an exception should be raised, it will be passed
-                # 'blindly' to the ExceptionHandler 
-                # TODO: Use a custom exception instead of plain log errors
-            #    self.logger.error(self.constants.ERRORS["targetreserved"])
-            #else:
-            #    self.logger.info(self.constants.INFO["targetalreadyreserved"] % (board_name, str(i)))
-        #if not reserved:
-        #   self.logger.info(self.constants.ERRORS["unabletoreserve"] % (board_name, attempts))
-
+        reservation_id = self.reservations.reserve([board_name])[board_name]
+        self.logger.info(self.constants.INFO["reservationconfirmed"] % board_name)
         return reservation_id
 
-    def unreserve_board(self, board, reservation_id):
-        """Erase the specified target reservation ID"""
-        cmd_string = self.constants.COMMANDS["unreservetarget"] % (board, reservation_id)
-        unreserve_result = self.run_command(cmd_string)
-
-        print(self.constants.INFO["targetunreserved"] % board)
+    def unreserve_board(self, board, reservation_id=None):
+        """Erase the reservation of the specified target. The reservation manager knows the
+        current ID of the reservation (it changes when the lease is renewed)."""
+        if self.reservations.release(board):
+            self.logger.info(self.constants.INFO["targetunreserved"] % board)
 
-    def control_board(self, board_name, board_type, board_role):
+    def control_board(self, board_name, board_type, board_role, workspace=None):
         """This is used to get an instance of the BoardObject type, which allows one
         to directly perform operations for that board (power management, image loading, etc)"""
 
@@ -262,117 +568,308 @@ class DeviceManager:
         reservation_id = self.reserve_board(board_name)
 
         self.logger.info("Creating a new board object...")
-        new_board_object = BoardObject.DeviceObject(
+        new_board_object = DeviceObject.DeviceObject(
                                 board_name, 
                                 board_type, 
                                 board_role,
                                 reservation_id, 
                                 self.resource_pool.board_file_path, 
-                                "%s/" % self.workspace
+                                "%s/" % (workspace or self.workspace),
+                                inventory=self.inventory,
+                                board_registry=self.board_registry,
+                                console_manager=self.console_manager,
+                                ssh_pool=self.ssh_pool,
+                                ip_discovery=self.ip_discovery,
+                                lab_backend=self.lab
                                 )
        
         return new_board_object
     
-    def run_command(self, command_string):
-        """Runs a command on the current machine/terminal"""
-        #args = shlex.split(command_string)
-        #subprocess.run([] ,stdout=subprocess.PIPE)
-        self.logger.debug("Sending command %s" % command_string)
-        result = subprocess.check_output(command_string, shell=True)
-        return result.split(b'=')[1]
+    def control_boards(self, board_names, node_list, workspace=None):
+        """Reserves all the boards needed by a multinode job in one go and returns a
+        DeviceObject for each board, using the (role, board type) pairs in node_list. If
+        any of the boards cannot be reserved, the reservations already made are released."""
+
+        self.logger.info("Attempting to reserve %s..." % ", ".join(board_names))
+        reservation_ids = self.reservations.reserve(board_names)
+
+        self.logger.info("Creating the board objects...")
+        board_objects = []
+        for board_name, (board_role, board_type) in zip(board_names, node_list):
+            board_objects.append(DeviceObject.DeviceObject(
+                                board_name,
+                                board_type,
+                                board_role,
+                                reservation_ids[board_name],
+                                self.resource_pool.board_file_path,
+                                "%s/" % (workspace or self.workspace),
+                                inventory=self.inventory,
+                                board_registry=self.board_registry,
+                                console_manager=self.console_manager,
+                                ssh_pool=self.ssh_pool,
+                                ip_discovery=self.ip_discovery,
+                                lab_backend=self.lab
+                                ))
+        return board_objects
+
+    def allocate_board(self, board_type):
+        """Takes a free board of the given type out of the resource pool. If there is none,
+        boards of that type idling in the warm pool (booted with another configuration) are
+        released to make room; otherwise, we wait for other jobs to release one."""
+        return self.allocate_nodes([board_type])[0]
+
+    def allocate_nodes(self, board_type_list):
+        """Takes one free board for each board type out of the resource pool, waiting up to
+        allocation_timeout seconds (scheduler section) for busy boards"""
+        # Fail right away if the lab does not have that many boards at all
+        self.resource_pool.check_pool_size(board_type_list)
+        deadline = None
+        if self.allocation_timeout is not None:
+            deadline = time.time() + self.allocation_timeout
+        waiting = False
+        while True:
+            # Boards parked in the warm pool stay allocated, so the wait is cut short from
+            # time to time to try evicting them again
+            wait_time = 0
+            if waiting:
+                wait_time = 5 if deadline is None else max(0, min(5, deadline - time.time()))
+            try:
+                return self.resource_pool.allocate_nodes(board_type_list, wait_time)
+            except Exceptions.NoBoardAvailable as e:
+                if self.warm_pool is not None and self.warm_pool.evict(e.board_type):
+                    continue
+                if deadline is not None and time.time() >= deadline:
+                    raise
+                if not waiting:
+                    self.logger.info("No free %s board right now, waiting for one..." % e.board_type)
+                    waiting = True
+
+    def get_boot_signature(self, test_request_object, board_role, board_type):
+        """Returns the signature of the image and boot configuration of a node"""
+        return WarmPool.WarmPool.get_boot_signature(board_type,
+                                                    test_request_object.get_node_boot_method(board_role),
+                                                    test_request_object.get_node_config(board_role))
+
+    def take_warm_board(self, test_request_object, board_role, board_type):
+        """Returns a DeviceObject for a board of the warm pool already running the image
+        the node needs (and still healthy), or None"""
+        if self.warm_pool is None:
+            return None
+        warm_board = self.warm_pool.acquire(self.get_boot_signature(test_request_object, board_role, board_type))
+        if warm_board is None:
+            return None
+
+        previous_board_object = warm_board.board_object
+        board_object = DeviceObject.DeviceObject(
+                                previous_board_object.get_board_name(),
+                                board_type,
+                                board_role,
+                                self.reservations.get_reservation_id(previous_board_object.get_board_name()),
+                                self.resource_pool.board_file_path,
+                                "%s/" % test_request_object.workspace,
+                                inventory=self.inventory,
+                                board_registry=self.board_registry,
+                                console_manager=self.console_manager,
+                                ssh_pool=self.ssh_pool,
+                                ip_discovery=self.ip_discovery,
+                                lab_backend=self.lab
+                                )
+        board_object.set_board_ip(previous_board_object.get_board_ip())
+        if not board_object.is_alive(self.warm_pool_settings.get("health_check_timeout", 10)):
+            self.logger.warning("%s failed the health check, booting another board" % board_object.get_board_name())
+            self.release_board_object(board_object)
+            return None
+        board_object.booted = True
+        return board_object
+
+    def finish_board(self, board_object, test_request_object, job_done):
+        """Called for every board once its job is over. With the warm pool enabled, boards
+        of successful jobs stay booted for the next compatible job; the others are released."""
+        if self.warm_pool is not None and job_done and board_object.booted:
+            self.warm_pool.park(board_object, self.get_boot_signature(test_request_object,
+                                                                      board_object.get_board_role(),
+                                                                      board_object.get_board_type()))
+        else:
+            self.release_board_object(board_object)
+
+    def release_board_object(self, board_object):
+        """Powers a board off, cancels its reservation and puts it back into the pool"""
+        try:
+            board_object.close_console()
+            if board_object.get_board_ip():
+                self.ssh_pool.close_session(board_object.get_board_ip())
+            board_object.power_off()
+        finally:
+            self.unreserve_board(board_object.get_board_name())
+            self.resource_pool.release_board(board_object.get_board_name())
 
     def run_remote_command(self, host, command_array):
         """Runs a command or a list of commands on a specified remote host"""
         print("This is a stub")
 
-    def deploy_tests(self, board_ip, test_repo, test_request_obj):
-        """Used for deploying test prerequisites & test files on a board. We use SSH for this."""
+    def install_test_packages(self, ssh_session, test_request_obj, tests, remote_board_path="/home/root"):
+        """Installs the test packages on a board and returns a list of PackageInstallResult.
+        The deployment install_mode setting selects how:
+            serial   - one installer run per package, one after the other (default)
+            batch    - a single installer run for the whole package set, so the package
+                       manager is set up once and resolves the dependencies all at once
+            parallel - one installer run per package, install_workers at a time (only for
+                       installers that can run concurrently)
+        Installers going through dpkg (apt, dpkg) cannot run concurrently, as they all take
+        the dpkg lock: for them, parallel mode falls back to batch mode. Whether the
+        installer uses dpkg is guessed from its name, unless the deployment
+        installer_uses_dpkg setting tells."""
+        install_mode = self.deployment_settings.get("install_mode", "serial")
+        if not tests:
+            return []
+
+        if install_mode == "parallel" and self.installer_uses_dpkg(test_request_obj):
+            self.logger.warning("%s uses dpkg, which cannot run concurrently: installing the packages in batch mode" %
+                                test_request_obj.pkg_installer)
+            install_mode = "batch"
+
+        # For the moment, use the hardcoded env_vars profile file
+        # TODO: the "touch el-repos.list" must be added to the install_deb_package.sh script
+        def install(packages):
+            _tmp_cmd = "bash -c \" source {0}/env_vars;touch /etc/apt/sources.list.d/el-repositories.list; {1}/{2} {3}\"".format(
+                                                                        remote_board_path,
+                                                                        remote_board_path,
+                                                                        test_request_obj.pkg_installer,
+                                                                        " ".join(packages))
+            self.logger.debug("PKG installation command: {0}".format(_tmp_cmd))
+            start_time = time.time()
+            (exit_code, output) = ssh_session.run(_tmp_cmd)
+            result = PackageInstallResult(" ".join(packages), exit_code, time.time() - start_time, output)
+            self.logger.info("Installed test package(s) %s: exit code %d, %.1fs" % (result.package,
+                                                                                   result.exit_code,
+                                                                                   result.duration))
+            return result
+
+        self.logger.debug("Installing test packages (%s mode): %s" % (install_mode, tests))
+        if install_mode == "batch":
+            return [install(tests)]
+        if install_mode == "parallel":
+            with concurrent.futures.ThreadPoolExecutor(
+                            max_workers=self.deployment_settings.get("install_workers", 4)) as executor:
+                return list(executor.map(lambda test: install([test]), tests))
+        return [install([test]) for test in tests]
+
+    def installer_uses_dpkg(self, test_request_obj):
+        """Tells if the package installer of a test request goes through dpkg"""
+        uses_dpkg = self.deployment_settings.get("installer_uses_dpkg")
+        if uses_dpkg is not None:
+            return uses_dpkg in ("yes", True)
+        return self.DPKG_INSTALLER_PATTERN.search(os.path.basename(test_request_obj.pkg_installer)) is not None
+
+    def write_deployment_files(self, test_request_obj):
+        """Creates the files that are copied to the boards alongside the tests (the environment
+        profile and the package repository list). They are the same for every node of a job,
+        so they are only written once per test request. Returns their paths."""
+        with self.deployment_files_lock:
+            if test_request_obj.deployment_files is not None:
+                return test_request_obj.deployment_files
+
+            # First, create a BASH profile file with all the environment variables
+            # to be used when remotely running the required commands
+            # TODO: Remove the hardcoded file name once things get a bit sorted out
+            profile_file_path = '{0}tmp/{1}'.format(test_request_obj.workspace, str('env_vars'))
+            with open(profile_file_path, mode='wb') as profile_file:
+                for environment_var in test_request_obj.env_vars.split('\n'):
+                    profile_file.write(bytes(environment_var + "\n", 'UTF-8'))
+
+            repository_file_path = '{0}tmp/{1}'.format(test_request_obj.workspace, str('el-repositories.list'))
+            with open(repository_file_path, mode='wb') as repos_file:
+                for repo_item in test_request_obj.repos_list:
+                    repos_file.write(bytes("deb [trusted=yes] %s/%s/ ./" % (test_request_obj.repos_url, repo_item) + "\n", 'UTF-8'))
+
+            test_request_obj.deployment_files = (profile_file_path, repository_file_path)
+            return test_request_obj.deployment_files
+
+    def get_package_installer_path(self, test_request_obj, remote_board_path="/home/root"):
+        return "%s/%s" % (remote_board_path, test_request_obj.pkg_installer)
+
+    def get_deployment_entries(self, test_repo, test_request_obj, remote_board_path="/home/root"):
+        """Returns the (local path, remote path) pairs copied to a board"""
+        (profile_file_path, repository_file_path) = self.write_deployment_files(test_request_obj)
+        # TODO: Temporary hardcoding a path
+        return [(test_repo, "%s/%s" % (remote_board_path, os.path.basename(os.path.normpath(test_repo)))),
+                (profile_file_path, "%s/env_vars" % remote_board_path),
+                (repository_file_path, "/etc/apt/sources.list.d/el-repositories.list")]
+
+    def deploy_tests(self, board_ip, test_repo, test_request_obj, tests=None, board_name=None):
+        """Used for deploying test prerequisites & test files on a board. We use SSH for this.
+        The test packages to install default to the master tests. board_name identifies the
+        board in delta mode (defaults to its IP). Raises DeploymentFailed if the board cannot
+        be reached over SSH."""
         self.logger.debug("Local path that will be copied to the board: %s" % test_repo)
+        if tests is None:
+            tests = test_request_obj.master_tests
 
         # For now, we hardcode this remote path, but this parameter must be made dynamic
         remote_board_path = "/home/root"
         self.logger.info("Deploying tests found in %s to %s...." % (test_repo, board_ip))
 
-        # First, create a BASH profile file with all the environment variables
-        # to be used when remotely running the required commands
-        # TODO: Remove the hardcoded file name once things get a bit sorted out
-        profile_file_path = '{0}tmp/{1}'.format(self.workspace, str('env_vars'))
-        with open(profile_file_path, mode='wb') as profile_file:
-            for environment_var in test_request_obj.env_vars.split('\n'):
-                profile_file.write(bytes(environment_var + "\n", 'UTF-8'))
+        deployment_entries = self.get_deployment_entries(test_repo, test_request_obj, remote_board_path)
+        package_installer_path = self.get_package_installer_path(test_request_obj, remote_board_path)
+
+        # All the transfers and commands below share a single SSH connection to the board
+        ssh_session = self.ssh_pool.get_session(board_ip)
+        if not ssh_session.connect():
+            # Nothing below can work without it; the job fails instead of running tests
+            # that were never deployed
+            self.logger.error("Could not open an SSH connection to %s" % board_ip)
+            raise Exceptions.DeploymentFailed(board_name or board_ip, "no SSH connection to %s" % board_ip)
+
+        copy_log = []
+        if self.delta_sync is not None:
+            # The files may have been hashed while the board was booting
+            prebuilt_manifest = None
+            if test_request_obj.deployment_manifest is not None and test_request_obj.deployment_manifest[0] == test_repo:
+                prebuilt_manifest = test_request_obj.deployment_manifest[1]
+            # Only the files added or changed since the last deployment to this board are
+            # sent (as a tar stream); stale ones are deleted
+            copy_log.append(self.delta_sync.sync(
+                                    ssh_session,
+                                    board_name or board_ip,
+                                    deployment_entries,
+                                    executables=[package_installer_path],
+                                    exclude_names=self.deployment_settings.get("exclude", [".git"]),
+                                    compress=self.deployment_settings.get("compress", True),
+                                    prebuilt_manifest=prebuilt_manifest))
+        elif self.deployment_settings.get("mode", "tar") == "tar":
+            # Everything goes over the wire as one compressed tar stream, with the file
+            # permissions already set in the archive
+            copy_log.append(ssh_session.put_archive(
+                                    deployment_entries,
+                                    executables=[package_installer_path],
+                                    exclude_names=self.deployment_settings.get("exclude", [".git"]),
+                                    compress=self.deployment_settings.get("compress", True)))
+        else:
+            copy_log.append(ssh_session.scp([test_repo], ":%s" % remote_board_path, recursive=True))
+            for (local_path, remote_path) in deployment_entries[1:]:
+                copy_log.append(ssh_session.put_file(local_path, remote_path))
 
-        repository_file_path = '{0}tmp/{1}'.format(self.workspace, str('el-repositories.list'))
-        with open(repository_file_path, mode='wb') as repos_file:
-            for repo_item in test_request_obj.repos_list:
-                repos_file.write(bytes("deb [trusted=yes] %s/%s/ ./" % (test_request_obj.repos_url, repo_item) + "\n", 'UTF-8'))
+            # Make files readable
+            copy_log.append(ssh_session.run("find %s -type f -exec chmod 644 {} \\;" % remote_board_path))
 
-        # TODO: Temporary hardcoding a path
-        scp_command_template = "ssh-keygen -R {0}; \
-                                ssh -o StrictHostKeyChecking=no root@{1} pwd; \
-                                scp -r {2} root@{3}:{4}; \
-                                scp -r {5} root@{6}:{7}; \
-                                scp -r {8} root@{9}:/etc/apt/sources.list.d/el-repositories.list;".format(
-                                                                    board_ip,
-                                                                    board_ip,
-                                                                    test_repo,
-                                                                    board_ip,
-                                                                    remote_board_path,
-                                                                    profile_file_path,
-                                                                    board_ip,
-                                                                    remote_board_path,
-                                                                    repository_file_path,
-                                                                    board_ip,
-                                                                    remote_board_path
-                                                                    )
-        # Make files readable
-        #scp_command_template = scp_command_template + " chmod -R a+x %s;" % remote_board_path
-        #scp_command_template = scp_command_template + " {0}/{1};".format(remote_board_path, test_request_obj.pkg_installer)
-        #scp_command_template = scp_command_template + " find %s -type d -exec chmod 755 {} \;" % remote_board_path
-        scp_command_template = scp_command_template + " find %s -type f -exec chmod 644 {} \;" % remote_board_path
-
-        result = subprocess.getoutput(
-                               scp_command_template.replace("{board_ip}", board_ip)
-                                )
-        self.logger.debug(result)
+            # Check for env
+            #    self.logger.debug("Env vars:\n {0}".format(
+            #        ssh_session.run("chmod +x ./env_vars; . ./env_vars; set;")))
 
-        # Check for env
-        #    self.logger.debug("Env vars:\n {0}".format(
-        #        subprocess.getoutput(
-        #                'ssh -o StrictHostKeyChecking=no root@%s "chmod +x ./env_vars; . ./env_vars; set;"' 
-         #                % board_ip)))
+            chmod_result = ssh_session.run("chmod +x %s" % package_installer_path)
+            self.logger.debug("chmod log: %s" % (chmod_result,))
 
-        chmod_result = subprocess.getoutput(
-                        'ssh -o StrictHostKeyChecking=no root@%s "chmod +x /home/root/git/lava2-playground/uboot/install_deb_package.sh"' % board_ip)
-        self.logger.debug("chmod log: %s" % chmod_result)
-
-        self.logger.debug(">>> Raw SCP log follows <<<\n %s" % result.split('\n'))
+        self.logger.debug(">>> Raw copy log follows <<<\n %s" % copy_log)
         self.logger.info("Test files copied to %s" % board_ip)
 
 
         # Installing the test packages
         # ---------------------------------
-        command_string = "ssh root@{0} ".format(board_ip)
-
-        self.logger.debug("Preparing to install test packages...")
-        for test in test_request_obj.master_tests:
-            self.logger.info("Installing test package: {0}".format(test))
-
-            # For the moment, use the hardcoded env_vars profile file
-            # TODO: the "touch el-repos.list" must be added to the install_deb_package.sh script
-            _tmp_cmd = command_string + " 'bash -c \" source {0}/env_vars;touch /etc/apt/sources.list.d/el-repositories.list; {1}/{2} {3}\"'".format(
-                                                                        remote_board_path, 
-                                                                        remote_board_path, 
-                                                                        test_request_obj.pkg_installer,
-                                                                        test)
-            
-            self.logger.debug("Package installer: %s" % test_request_obj.pkg_installer)
-            self.logger.debug("Test package: %s" % test)
-            self.logger.debug("PKG installation command: {0}".format(_tmp_cmd))
-            
-            #command = _tmp_cmd.split(' ')
-          
-            output = subprocess.getoutput(_tmp_cmd)
-            self.logger.debug("Command output: {0}".format(output))
+        install_results = self.install_test_packages(ssh_session, test_request_obj, tests, remote_board_path)
+        test_request_obj.install_results[board_name or board_ip] = install_results
+        failed_packages = [result.package for result in install_results if result.exit_code != 0]
+        if failed_packages:
+            self.logger.error("Test package installation failed on %s: %s" % (board_ip, failed_packages))
 
         self.logger.info("Tests deployed to %s" % board_ip)
 
@@ -430,47 +927,42 @@ class DeviceManager:
         #self.result_parser.process_test_results()
 
     # ================== TEMPORARY WORKAROUND FOR RESULT PARSING ======================
-    def process_test_results2(self):
-        """The main method dealing with result files parsing."""
-        # TODO: First parse the test results directory contents, then begin parsing
-        # each individual file
-
-        # Parse all files available at the given path.
-        for result_file in os.listdir(self.workspace + self.test_results_dir):
-            self.logger.debug("Processing result file: %s" % result_file)
-            print("Processing result file: %s" % result_file)
-            # A temporary place to store the test results that were found
-            test_results = {}
-            with open("{0}/{1}".format(self.workspace + self.test_results_dir, result_file), 'r') as f:
-                self.logger.debug("Current file path: %s" % "{0}/{1}".format(self.workspace + self.test_results_dir, result_file))
-                for line in f:
-                    if ":" in line:
-                        (test_suite, test_result) = line.split(":")
-                        test_result = test_result.strip()
-                        if test_result in ["SKIP", "PASS", "FAIL"]:
-                            test_results[test_suite.strip()] = test_result
-            test_suite_name = result_file.replace("_test_result", "")
-            self.write_xml_file(test_results, test_suite_name)
-
-    def write_xml_file(self, test_results, test_suite_name):
+    def process_test_results2(self, workspace=None, result_format=None, job_id=None, board_objects=()):
+        """The main method dealing with result files parsing. The work is done by the
+        ResultParser component: result files are parsed in parallel, in the given format
+        (guessed for each file if not given), and a JUnit XML report is written next to
+        each of them, along with the job report (and the nightly one, if enabled)."""
+        results_path = (workspace or self.workspace) + self.test_results_dir
+
+        # The reports tell which board each suite ran on, and how long it took
+        boards = {}
+        board_types = {}
+        durations = {}
+        for board_object in board_objects:
+            board_role = board_object.get_board_role()
+            boards[board_role] = board_object.get_board_name()
+            board_types[board_role] = board_object.get_board_type()
+            for test_run in board_object.test_runs:
+                suite_name = test_run.test if board_role == "master" else "%s.%s" % (board_role, test_run.test)
+                durations[suite_name] = test_run.duration
+
+        result_parser = ResultParser.ResultParser(results_path, results_path, self.logger, result_format,
+                                                  job_id=job_id,
+                                                  boards=boards,
+                                                  durations=durations,
+                                                  nightly_dir=self.report_settings.get("nightly_dir"),
+                                                  board_types=board_types,
+                                                  store_results=self.report_settings.get("store_results", False),
+                                                  database_uri=self.report_settings.get("results_database"),
+                                                  worker_pool=self.result_worker_pool)
+        for (test_suite_name, counts) in sorted(result_parser.process_test_results().items()):
+            print("Processed results of %s: %s" % (test_suite_name, counts))
+
+    def write_xml_file(self, test_results, test_suite_name, output_path=None):
         """Used to export the test results gathered during the test run, in
         JUnit XML format"""
-        xml_output = ""
-        xml_output += '<?xml version="1.0" encoding="UTF-8"?>'
-        xml_output += '<testsuites>'
-        xml_output += '<testsuite name="{0}">'.format(test_suite_name)
-        for test_name, test_result in test_results.items():
-            xml_output += '<testcase name="{0}">'.format(test_name)
-            if test_result == 'FAIL':
-                xml_output += '<failure/>'
-            elif test_result == 'SKIP':
-                xml_output += '<skipped/>'
-            xml_output += '</testcase>'
-        xml_output += '</testsuite>'
-        xml_output += '</testsuites>'
-        #with open("{0}/{1}.xml".format(self.output_location, test_suite_name), "w") as f:
-        with open("{0}/{1}.xml".format(self.workspace + self.test_results_dir, test_suite_name), "w") as f:
-            f.write(xml_output)
+        result_parser = ResultParser.ResultParser(None, output_path or self.workspace + self.test_results_dir)
+        result_parser.write_junit_xml(test_results, test_suite_name)
 
 
 
@@ -480,8 +972,15 @@ class TestRequest:
     in turn creates a TestRequest object that will be processed by the process_test_request() method,
     in a queue, using a distinct thread."""
 
+    # Numbered role given to each board of a slave role listing several board types
+    NUMBERED_ROLE_PATTERN = re.compile(r"^(.*)_\d+$")
+
     def __init__(self, job_data):
         """Object constructor. We set test request attributes based on the data"""
+        # Set by the DeviceManager once the request is taken out of the job queue
+        self.job_id = None
+        self.workspace = ""
+
         # When evaluating the nodes from the request, we set this to either single-node or multinode
         self.job_type = ""
 
@@ -493,6 +992,27 @@ class TestRequest:
         # An array to keep the names of boards acting as slaves in a multinode scenario
         self.slave_boards = []
 
+        # (role, board type) pairs for every node of the job, master first. When several
+        # slaves are requested under the same role, each one gets a numbered role
+        # (e.g. slave_1, slave_2)
+        self.node_boards = []
+
+        # Tests to be run on each node role
+        self.node_tests = {}
+
+        # Set once the environment profile and the repository list are written to the
+        # workspace (see DeviceManager.write_deployment_files)
+        self.deployment_files = None
+
+        # Future of the host side of the job, running while the boards boot (see
+        # DeviceManager.prepare_job), and the delta manifest it computed: (test repository
+        # path, DeltaSync.build_manifest result)
+        self.preparation = None
+        self.deployment_manifest = None
+
+        # Board name -> list of DeviceManager.PackageInstallResult
+        self.install_results = {}
+
         # Obey thy master board :)
         self.master_board = ""
 
@@ -502,6 +1022,18 @@ class TestRequest:
         # Store the test repos that are specified in the test request
         self.git_repos = []
 
+        # The branch, tag or commit of the test repositories to use (default: remote HEAD)
+        self.git_ref = None
+
+        # Time limits (in seconds) for a single test and for the whole job
+        self.test_timeout = None
+        self.job_timeout = None
+
+        # Format of the test output and result files (colon, tap, ptest, ltp); guessed if
+        # not given
+        self.result_format = None
+        self.start_time = time.time()
+
         # Store the test repositories
         self.repos_list = []
         self.repos_url = ""
@@ -535,10 +1067,18 @@ class TestRequest:
             # REQUEST"
             if board_role == "master":
                 self.master_board = board_type
-
-            # Slaves count (if any)
-            if board_role == "slave":
-                self.slave_boards.append(board_type)
+                self.node_boards.insert(0, (board_role, board_type))
+
+            # Slaves count (if any). A slave role may hold a single board type or a
+            # list of board types
+            if board_role.startswith("slave"):
+                if isinstance(board_type, list):
+                    for slave_index, slave_board_type in enumerate(board_type):
+                        self.slave_boards.append(slave_board_type)
+                        self.node_boards.append(("%s_%d" % (board_role, slave_index + 1), slave_board_type))
+                else:
+                    self.slave_boards.append(board_type)
+                    self.node_boards.append((board_role, board_type))
 
         # If no slaves have been set, then this is a single-node test
         # TODO: This really needs to rely on a JSON sanity check
@@ -547,6 +1087,35 @@ class TestRequest:
         else:
             self.job_type = "multinode"
 
+    def _lookup_role(self, role_dict, board_role):
+        """Numbered slave roles (slave_1, slave_2...) share the settings of their base role"""
+        if board_role in role_dict:
+            return role_dict[board_role]
+        numbered_role = self.NUMBERED_ROLE_PATTERN.match(board_role)
+        if numbered_role is None:
+            return None
+        return role_dict.get(numbered_role.group(1))
+
+    def get_node_config(self, board_role):
+        """Returns the instance configuration of the node with the given role"""
+        return self._lookup_role(self.nodes, board_role) or {}
+
+    def get_node_boot_method(self, board_role):
+        """Returns the boot method of the node with the given role"""
+        if board_role == "master":
+            return self.master_boot_method
+        return self.get_node_config(board_role).get("boot_method", self.master_boot_method)
+
+    def get_node_tests(self, board_role):
+        """Returns the tests that must be run on the node with the given role"""
+        return self._lookup_role(self.node_tests, board_role) or []
+
+    def get_deadline(self):
+        """Returns the time by which the job must be over, or None if it has no time limit"""
+        if not self.job_timeout:
+            return None
+        return self.start_time + self.job_timeout
+
     def extract_node_configuration(self):
         """Extract information regarding the implied nodes"""
         # Add the node to our nodes dictionary, along with "instance_config"
@@ -564,6 +1133,10 @@ class TestRequest:
         for section, section_contents in self.job_data["tests"].items():
             if section == "toolkit":
                 self.git_repos.append(section_contents["git_repos"])
+                self.git_ref = section_contents.get("git_ref")
+                self.test_timeout = section_contents.get("test_timeout")
+                self.job_timeout = section_contents.get("job_timeout")
+                self.result_format = section_contents.get("result_format")
                 self.env_vars = '\n'.join(section_contents["env_vars"])
                 #self.env_vars.append(section_contents["env_vars"])
                 self.pkg_installer = section_contents["package_installer"]
@@ -572,9 +1145,11 @@ class TestRequest:
 
             if section == "master":
                 # Extract the tests to be run on the master board. 
-                # TODO: For now, we only offer single-node testing, but this method
-                # will be extended once we start implementing multinode testing 
-                # support
                 for test_name in section_contents:
                     self.master_tests.append(test_name)
+                self.node_tests[section] = self.master_tests
+
+            elif section != "toolkit":
+                # Tests to be run on the other nodes, listed under their role
+                self.node_tests[section] = list(section_contents)
 
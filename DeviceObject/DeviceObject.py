@@ -1,26 +1,69 @@
+import os
+import re
+import shlex
+import shutil
+import time
 import subprocess
 import logging
 import pexpect
 import sys
 import yaml
+from BoardInventory import BoardInventory
+from BoardProfile import BoardProfile
+from ConsoleManager import ConsoleManager
+from SSHPool import SSHPool
+from IpDiscovery import IpDiscovery
+from LabBackend import LabBackend
+from TestRunner import TestRunner
+from ResultParser import ResultParser
 
 class DeviceObject:
     """Used as a helper for the BoardManager class, in order to provide a way to easily
     manage board-level operations, like flashing, reflashing, power cycle management and
     other tasks. Uses pexpect for bootloader interaction"""
-    def __init__(self, board_id, board_type, board_role, res_id, boardfile_path, workspace_dir, board_info=''):
+    def __init__(self, board_id, board_type, board_role, res_id, boardfile_path, workspace_dir, board_info='', inventory=None,
+                 board_registry=None, console_manager=None, ssh_pool=None, ip_discovery=None,
+                 lab_backend=None):
         self.board_name = board_id
         self.board_type = board_type
         self.board_info = board_info
         self.board_role = board_role
         self.board_ip = ""
+        # Set once the board runs the image of the current job (boot_board, or a board
+        # taken over from the warm pool)
+        self.booted = False
         self.reservation_id = res_id
         self.boardfile_path = boardfile_path
         self.attributes = {} # This MUST be renamed to something else, since it's ambiguous as hell...
         self.ramdisk_commands = []
         self.nfs_commands = []
+        # Rendered boot commands, by boot method (see submit_config_params)
+        self.boot_commands = {}
         self.workspace = workspace_dir
 
+        # The lab inventory used for looking up the IVLab attributes of the board
+        self.inventory = inventory or BoardInventory.get_shared_inventory()
+
+        # Board files are compiled once and shared by all the objects of the same board type
+        self.board_registry = board_registry or BoardProfile.get_shared_registry(boardfile_path)
+        self.board_profile = None
+
+        # When set, the board console is driven by the (shared) asyncio console multiplexer
+        # instead of a dedicated pexpect child
+        self.console_manager = console_manager
+        self.console_log_path = "%s/logs/%s_console.log" % (self.workspace, board_id)
+        # The console opened by open_console, until close_console is called
+        self.console = None
+
+        # SSH connections are shared with the DeviceManager for the duration of the job
+        self.ssh_pool = ssh_pool or SSHPool.get_shared_pool()
+
+        # The lab tools used for power and console access (the target tool, or a simulator)
+        self.lab_backend = lab_backend or LabBackend.get_shared_backend()
+
+        # Finds out the board IP address once booted, and remembers it between boots
+        self.ip_discovery = ip_discovery or IpDiscovery.get_shared_discovery()
+
         # Board attributes
         self.has_ssh = False
         self.ipmi_managed = False
@@ -35,9 +78,38 @@ class DeviceObject:
                 
         self.has_test_results = False
 
-         # We create our logger, including a formatter
-        self.logger = logging.getLogger(__name__)
+        # Console prompts (compiled regular expressions) and boot settings, see
+        # read_device_file()
+        self.prompt_patterns = {}
+        self.login_user = "root"
+        self.pipelined_boot = False
+        self.boot_command_timeout = 30
+        self.boot_timeout = 120
+        self.boot_timings = []
+
+        # How many tests may run on the board at the same time, and the outcome of each
+        # test of the last run (TestRunner.TestRun objects)
+        self.max_parallel_tests = 1
+        self.test_runs = []
+
+        # Result files are gzipped by the board while being fetched (compress_results
+        # attribute; boards with a slow CPU may be better off without)
+        self.compress_results = True
+
+        # The interface the tests reach the board through, and the MAC address of the board
+        # on that interface (mac_addresses attribute: board name -> MAC), for looking the
+        # address up on the host when the console does not show it
+        self.network_interface = "eth0"
+        self.mac_address = None
+
+         # We create our logger, including a formatter. Each board gets its own logger, since
+        # several boards may be handled at the same time (multinode jobs, concurrent jobs)
+        self.logger = logging.getLogger("%s.%s" % (__name__, board_id))
         self.logger.setLevel(logging.DEBUG)
+        # Drop the handlers left behind by a previous object of the same board
+        for old_handler in list(self.logger.handlers):
+            self.logger.removeHandler(old_handler)
+            old_handler.close()
         #logfile_handler = logging.FileHandler(log_dir + board_id + ".log")
         logfile_handler = logging.FileHandler(self.workspace + "/logs/%s.log" % board_id)
         formatter = logging.Formatter('%(asctime)s[%(levelname)s] %(message)s',datefmt='[%m/%d/%Y][%H:%M:%S]')
@@ -64,6 +136,10 @@ class DeviceObject:
         """Returns the IP address of the board, once booted"""
         return self.board_ip
 
+    def set_board_ip(self, new_board_ip):
+        """Sets the IP address of an already booted board (e.g. taken from the warm pool)"""
+        self.board_ip = new_board_ip
+
     def get_board_type(self):
         """Returns the board type"""
         return self.board_type
@@ -106,7 +182,23 @@ class DeviceObject:
         # Must see if it is advisable to also reserve the board when performing power off.
         # Maybe a single reservation should be made, and the ID could be passed to the constructor
         # of the current object. Must decide upon the most efficient and streamlined approach
-        print("Momentarily, this is a stub")
+        self.logger.info("Powering off...")
+        self.lab_backend.power(self.board_name, "off")
+        self.booted = False
+        self.logger.info("Board successfully powered off")
+
+    def is_alive(self, timeout=10, ip_address=None):
+        """Quick health check of a booted board: is it still reachable over SSH (at its
+        current address, or at the given one)?"""
+        ip_address = ip_address or self.board_ip
+        if not ip_address:
+            return False
+        if self.ssh_pool.get_session(ip_address).run("true", timeout=timeout)[0] == 0:
+            return True
+        # Do not keep a connection attempt to an address that may not be the board's
+        if ip_address != self.board_ip:
+            self.ssh_pool.close_session(ip_address)
+        return False
 
     def power_on(self):
         """Bring the board power up"""
@@ -115,31 +207,78 @@ class DeviceObject:
         # with the whole scenario when and if we need/want to.
         #subprocess.call("target %s -r now-+5M" % (self.board_name),shell=True)
         self.logger.info("Powering on...")
-        subprocess.call("target %s -p on" % (self.board_name),shell=True)
+        self.lab_backend.power(self.board_name, "on")
         self.logger.info("Board successfully powered on")
 
+    # Console prompts used when the board file does not define its own
+    DEFAULT_PROMPTS = {"bootloader" : r"U-Boot>", "login" : r"\S+ login:", "shell" : r"root@\S+:~#"}
+
+    # Instance configuration keys that feed the standard boot command placeholders. Any other
+    # key is available to the boot commands as a placeholder named after the upper-cased key
+    # (e.g. server_ip -> {SERVER_IP}).
+    PLACEHOLDER_ALIASES = {"kernel" : "IMAGE", "dtb" : "DTB", "rootfs" : "ROOT_FS"}
+
+    def get_placeholder_values(self, settings):
+        """Maps a section of the instance configuration to boot command placeholder values"""
+        placeholder_values = {}
+        for setting, value in settings.items():
+            if isinstance(value, (dict, list)):
+                continue
+            placeholder_values[self.PLACEHOLDER_ALIASES.get(setting, setting.upper())] = value
+        return placeholder_values
+
     def submit_config_params(self, params_dict):
         """Receive instance configuration details in the form of a dictionary and applies
-        the data to the configuration of the current object"""
-        for config_section, settings in params_dict.items():
-            # We use list comprehension to perform placeholder replacements more efficiently
-            if config_section == "ramdisk":
-                self.ramdisk_commands = [cmd.replace('{IMAGE}', settings["kernel"]) for cmd in self.ramdisk_commands]
-                self.ramdisk_commands = [cmd.replace('{DTB}', settings["dtb"]) for cmd in self.ramdisk_commands]
-                self.ramdisk_commands = [cmd.replace('{ROOT_FS}', settings["rootfs"]) for cmd in self.ramdisk_commands]
-
-            if config_section == "nfs":
-                self.nfs_commands = [cmd.replace('{IMAGE}', settings["kernel"]) for cmd in self.nfs_commands]
-                self.nfs_commands = [cmd.replace('{DTB}', settings["dtb"]) for cmd in self.nfs_commands]
-                self.nfs_commands = [cmd.replace('{ROOT_FS}', settings["rootfs"]) for cmd in self.nfs_commands]
+        the data to the configuration of the current object. Only the commands of the
+        selected boot method (boot_method key) are rendered and validated; the board file
+        templates are left untouched, so the board can be configured again for a different
+        image. Returns a list of validation errors (empty if everything can be rendered)."""
+        errors = []
+        self.boot_commands = {}
+        boot_method = params_dict.get("boot_method")
+
+        # Top level settings (e.g. boot_method) are available to every boot method, along
+        # with the settings of the selected boot method
+        placeholder_values = self.get_placeholder_values(params_dict)
+        if isinstance(params_dict.get(boot_method), dict):
+            placeholder_values.update(self.get_placeholder_values(params_dict[boot_method]))
+
+        if self.ipmi_managed:
+            # IPMI tools may take placeholders as well
+            for tool, tool_template in self.board_profile.get_ipmi_templates().items():
+                missing = tool_template.missing_placeholders(placeholder_values)
+                if missing:
+                    errors.append("IPMI %s: no value for %s" % (tool, ", ".join(missing)))
+                else:
+                    self.ipmi_tools[tool] = tool_template.render(placeholder_values)[0]
+        elif boot_method:
+            boot_template = self.board_profile.get_boot_template(boot_method)
+            if boot_template is None:
+                errors.append("%s boot: no commands for this boot method in the %s board file" % (boot_method,
+                                                                                                self.board_type))
+            else:
+                missing = boot_template.missing_placeholders(placeholder_values)
+                if missing:
+                    errors.append("%s boot: no value for %s" % (boot_method, ", ".join(missing)))
+                else:
+                    self.boot_commands[boot_method] = boot_template.render(placeholder_values)
+
+        self.ramdisk_commands = self.boot_commands.get("ramdisk", [])
+        self.nfs_commands = self.boot_commands.get("nfs", [])
+
+        for error in errors:
+            self.logger.error(error)
+        return errors
+
     def get_ivlab_board_info(self):
-        """Obtain details about the board in question by interogating IVLab."""
-        
-        self.arch = subprocess.getoutput("targetadmin --display --name %s | awk '{print $7}'" % self.board_name).split('\n')[2]
-        self.nb_of_eth_ports = subprocess.getoutput("targetadmin --display --name %s | awk '{print $5}'" % self.board_name).split('\n')[2]
-        self.bootloader = subprocess.getoutput("targetadmin --display --name %s | awk '{print $8}'" % self.board_name).split('\n')[2]
-        self.cpu = subprocess.getoutput("targetadmin --display --name %s | awk '{print $9}'" % self.board_name).split('\n')[2]
-        self.ivlab_id = subprocess.getoutput("targetadmin --display --name %s | awk '{print $2}'" % self.board_name).split('\n')[2]
+        """Obtain details about the board in question by interogating IVLab. The inventory
+        caches the details, so boards used by recent jobs are not looked up again."""
+        board_record = self.inventory.get_board_record(self.board_name)
+        self.arch = board_record.arch
+        self.nb_of_eth_ports = board_record.nb_of_eth_ports
+        self.bootloader = board_record.bootloader
+        self.cpu = board_record.cpu
+        self.ivlab_id = board_record.ivlab_id
 
         self.logger.debug("IVLab board attributes:")
         self.logger.debug("Arch: {0}\n \
@@ -153,58 +292,125 @@ class DeviceObject:
         """Used for loading and reading the contents of the board's device file, which
         contains info such as boot parameters, addresses and specific commands.
         Appends the info extracted from the devfiles to the object attributes, alongside
-        information fetched from IVLab"""
-        self.logger.debug("Parsing board file for %s" % board_type)
-        file_stream = open(r"%s%s.yml" % (self.boardfile_path, board_type))
-        board_file = yaml.load_all(file_stream)
-
-        # TODO: Design a better and more optimal algorithm for processing board_file
-        # entries
-        for entry in board_file:
-            for section, section_contents in entry.items():
-                if section == "commands":
-                    for command_type, commands in section_contents.items():
-                        if command_type == "ramdisk_boot":
-                            for cmd in commands:
-                                self.ramdisk_commands.append(cmd)
-
-                        if command_type == "nfs_boot":
-                            for cmd in commands:
-                                self.nfs_commands.append(cmd)
-                                self.logger.debug("NFS command: %s" % cmd)
-                
-                if section == "attributes":
-                    for setting, value in section_contents.items():
-                        if setting == "root_prompt":
-                            self.root_prompt = value
-                        
-                        if (setting == "has_ssh" and value == "yes"):
-                            self.has_ssh = True
-
-                        if (setting == "ipmi_managed" and value == "yes"):
-                            self.ipmi_managed = True
-
-                # If dealing with an IPMI-managed board that does not provide direct access
-                # to the bootloader, we must take a different approach
-                if (section == "commands" and self.ipmi_managed == True):
-                    _tmp_dict = {}
-                    for ipmi_block, settings in section_contents.items():
-                        if ipmi_block == "ipmi_managed":
-                            for key, value in settings.items():
-                                _tmp_dict.update({key : value})
-                    self.ipmi_tools.update(_tmp_dict)
-
-    def write_ifconfig_to_file(self, expect_object, file_path):
+        information fetched from IVLab. The board file is only parsed when it changed since
+        the last time a board of this type was used."""
+        self.board_profile = self.board_registry.get_profile(board_type)
+
+        self.ramdisk_commands = self.board_profile.get_boot_commands("ramdisk")
+        self.nfs_commands = self.board_profile.get_boot_commands("nfs")
+        self.logger.debug("NFS commands: %s" % self.nfs_commands)
+
+        self.attributes = self.board_profile.get_attributes()
+        if self.board_profile.root_prompt is not None:
+            self.root_prompt = self.board_profile.root_prompt
+        self.has_ssh = self.board_profile.has_ssh
+        self.ipmi_managed = self.board_profile.ipmi_managed
+        self.ipmi_tools = self.board_profile.get_ipmi_tools()
+
+        # Console prompts can be set in the "prompts" section of the board file; the root
+        # prompt may also come from the root_prompt attribute
+        prompts = dict(self.DEFAULT_PROMPTS)
+        if self.board_profile.root_prompt:
+            prompts["shell"] = self.board_profile.root_prompt
+        prompts.update(self.board_profile.get_prompts())
+        self.login_user = prompts.pop("login_user", self.login_user)
+        self.prompt_patterns = dict((prompt_name, re.compile(prompt)) for prompt_name, prompt in prompts.items())
+
+        self.pipelined_boot = self.attributes.get("pipelined_boot") in ("yes", True)
+        # Numeric attributes may be quoted in the board file
+        self.boot_command_timeout = int(self.attributes.get("boot_command_timeout", self.boot_command_timeout))
+        self.boot_timeout = int(self.attributes.get("boot_timeout", self.boot_timeout))
+        self.max_parallel_tests = int(self.attributes.get("max_parallel_tests", self.max_parallel_tests))
+        self.compress_results = self.attributes.get("compress_results", "yes") in ("yes", True)
+        self.network_interface = self.attributes.get("network_interface", self.network_interface)
+        self.mac_address = (self.attributes.get("mac_addresses") or {}).get(self.board_name)
+
+    def discover_board_ip(self, expect_object):
         """If the deployed OS has SSH support, we obtain the IP address of that device
-        and pass it on to the pxssh handle. For this to work, we write the IP to a 
-        file."""
-        # TODO: Check the need to keep this method, considering the current approach
-        with open(file_path, 'w') as f:
-            expect_object.logfile = f
-            expect_object.sendline("ifconfig eth0")  # try to get IP
-            expect_object.expect("root@raspberrypi3-64:~#")
-            # close connection to u-boot
-            expect_object.sendcontrol("]")
+        and pass it on to the SSH sessions. The interface configuration is parsed straight
+        from the console output; see IpDiscovery for the fallbacks."""
+        console_output = None
+        try:
+            expect_object.sendline(IpDiscovery.IpDiscovery.get_interface_command(self.network_interface))
+            expect_object.expect(self.prompt_patterns["shell"])
+            console_output = expect_object.before
+        except pexpect.TIMEOUT:
+            self.logger.warning("No shell prompt after querying %s" % self.network_interface)
+        # close connection to u-boot
+        expect_object.sendcontrol("]")
+
+        # The address of the previous boot is only used if the board answers there
+        self.board_ip = self.ip_discovery.discover(self.board_name, console_output, self.mac_address,
+                                                   lambda ip_address: self.is_alive(ip_address=ip_address)) or ""
+        if self.board_ip:
+            self.logger.debug("IP address for %s: %s" % (self.board_name, self.board_ip))
+        else:
+            self.logger.error("Could not find out the IP address of %s" % self.board_name)
+        return self.board_ip
+
+    def open_console(self):
+        """Connects to the board console. The console output goes to a per-board log file.
+        The console stays open until close_console is called (or another one is opened)."""
+        self.close_console()
+        console_command = self.lab_backend.console_command(self.board_name)
+        if self.console_manager is not None:
+            self.console = self.console_manager.open_console(self.board_name, console_command, self.console_log_path)
+            return self.console
+
+        child = pexpect.spawnu(console_command)
+        # pexpect waits 50ms before every write by default, which adds up over a long list
+        # of boot commands; the bootloader prompt is waited for anyway
+        child.delaybeforesend = None
+        child.logfile_read = open(self.console_log_path, "a")
+        self.console = child
+        return child
+
+    def close_console(self):
+        """Disconnects from the board console and closes its log file"""
+        console = self.console
+        self.console = None
+        if console is None:
+            return
+        if self.console_manager is not None:
+            self.console_manager.close_console(self.board_name)
+            return
+        try:
+            console.close(force=True)
+        except Exception as e:
+            self.logger.warning("Could not stop the console command of %s: %s" % (self.board_name, e))
+        finally:
+            console.logfile_read.close()
+
+    def get_console_state_machine(self):
+        """The expect state machine used for finding out where the board console is at when
+        we connect to it: bootloader prompt, login prompt or OS shell"""
+        console_machine = ConsoleManager.ExpectStateMachine("connecting", timeout=self.boot_timeout)
+        console_machine.add_transition("connecting", "Connection to .* closed.", "unavailable")
+        # The console server asks for a key press before showing the board output
+        console_machine.add_transition("connecting", "Quit: Ctrl", "connecting", response="")
+        for console_state in ("bootloader", "login", "shell"):
+            console_machine.add_transition("connecting", self.prompt_patterns[console_state], console_state)
+        return console_machine
+
+    def detect_console_state(self, child):
+        """Runs the console state machine on a console and returns the final state"""
+        console_machine = self.get_console_state_machine()
+        try:
+            if self.console_manager is not None:
+                return child.run_state_machine(console_machine)
+
+            state = console_machine.initial_state
+            while state in console_machine.transitions:
+                transitions = console_machine.transitions[state]
+                transition_index = child.expect([pattern for (pattern, response, next_state) in transitions],
+                                                timeout=console_machine.timeout)
+                (pattern, response, next_state) = transitions[transition_index]
+                if response is not None:
+                    child.sendline(response)
+                state = next_state
+            return state
+        except pexpect.EOF:
+            return "unavailable"
 
     def boot_board(self, boot_method):
         """Since this is specific to the ENEA Lab environment, we will use the target tool"""
@@ -217,73 +423,34 @@ class DeviceObject:
             setup_result = subprocess.getoutput(self.ipmi_tools["setup_script"])
             # TODO: parse result for errors
         else:
-            child = pexpect.spawnu("target %s" % self.board_name)
-            child.logfile = sys.stdout
-            uboot_login = False
-            root_login = False
-            os_console = False
-            while True:
-                try:
-                    i = child.expect(["Connection to .* closed.", "Quit: Ctrl", "U-Boot>", "raspberrypi3-64 login:", "root@raspberrypi3-64:~#"])
-                    if i == 0:
-                        self.logger.error("Board unavailable")
-                        break
-                    if i == 1:
-                        child.sendline("")
-                    if i == 2:
-                        uboot_login = True
-                        break
-                    if i == 3:
-                        root_login = True
-                        break
-                    if i == 4:
-                        os_console = True
-                        break
-                except pexpect.EOF:
-                    break
+            child = self.open_console()
+            console_state = self.detect_console_state(child)
+            uboot_login = (console_state == "bootloader")
+            root_login = (console_state == "login")
+            os_console = (console_state == "shell")
+            if console_state == "unavailable":
+                self.logger.error("Board unavailable")
 
             if uboot_login:
-                if boot_method == "ramdisk":
-                    self.logger.info("Booting board using ramdisk...")
-                    self.logger.debug("Raw boot commands: \n %s \n >>> END" % self.ramdisk_commands)
-                    self._boot_command_sender(child, self.ramdisk_commands)
-                if boot_method == "nfs":
-                    self.logger.info("Booting board using NFS...")
-                    self.logger.debug("Raw boot commands: \n %s \n >>> END" % self.nfs_commands)
-                    self._boot_command_sender(child, self.nfs_commands)
+                self.logger.info("Booting board using %s..." % boot_method)
+                self.logger.debug("Raw boot commands: \n %s \n >>> END" % self.boot_commands.get(boot_method))
+                self._boot_command_sender(child, self.boot_commands.get(boot_method, []))
 
                 # login to board OS
-                child.expect("raspberrypi3-64 login: ", timeout=120)
-                child.sendline("root")
-                child.expect("root@raspberrypi3-64:~#")
-                #self.write_ifconfig_to_file(child, "target_ifconfig")
-                self.write_ifconfig_to_file(child, "%s/%s_ifconfig" % (self.workspace, self.board_name))
-
-                # Extract the IP address from the file
-                #_temp_board_ip = subprocess.check_output(
-                #                                        "cat %s/%s_ifconfig | grep \"inet addr:\" | awk {'print $2'}" 
-                #                                            % (self.workspace, self.board_name), 
-                #                                        shell=True
-                #                                        )
-                                                        #.split(b':')[1]
-                #_temp_board_ip = str(_temp_board_ip.replace("addr:", "")).rstrip('\n')
-            # _temp_board_ip = str(_temp_board_ip.rstrip('\n'))
-                #self.board_ip = _temp_board_ip.replace("addr:", "").replace("\n", "")
-                self.board_ip = subprocess.getoutput("cat %s/%s_ifconfig | grep \"inet addr:\" | awk {'print $2'}" 
-                                                            % (self.workspace, self.board_name)).split()[0].replace("addr:", "")
-                self.logger.debug("IP address for %s: %s" % (self.board_name, self.board_ip))
+                child.expect(self.prompt_patterns["login"], timeout=self.boot_timeout)
+                child.sendline(self.login_user)
+                child.expect(self.prompt_patterns["shell"])
+                self.discover_board_ip(child)
 
             if root_login:
                 # login to board OS
                 print("debug: got to root login")
-                child.sendline("root")
-                child.expect("root@raspberrypi3-64:~#")
-                #self.write_ifconfig_to_file(child, "%s/%s_ifconfig" % (self.workspace, self.board_name))
-                self.write_ifconfig_to_file(child, "%s/%s_ifconfig" % (self.workspace, self.board_name))
+                child.sendline(self.login_user)
+                child.expect(self.prompt_patterns["shell"])
+                self.discover_board_ip(child)
 
             if os_console:
-                #self.write_ifconfig_to_file(child, "target_ifconfig")
-                self.write_ifconfig_to_file(child, "%s/%s_ifconfig" % (self.workspace, self.board_name))
+                self.discover_board_ip(child)
 
                 if self.has_ssh:
                     print("test")
@@ -296,51 +463,126 @@ class DeviceObject:
             # big of a difference
             return child
 
+    def get_ssh_session(self):
+        """Returns the shared SSH session of the board (available once the board IP is known)"""
+        return self.ssh_pool.get_session(self.board_ip)
+
     def run_tests(self, test_request_obj):
         """Used for invoking the available tests. Receives the test request object and, based 
-        on the contents, passes the suitable directives"""
+        on the contents, passes the suitable directives. Independent tests may run
+        concurrently (max_parallel_tests attribute of the board file); the output of each
+        test is streamed to logs/<board>_tests/<test>.log while it runs, and the test request
+        timeouts (per test and per job) are enforced."""
+        node_tests = test_request_obj.get_node_tests(self.board_role)
+        test_runner = TestRunner.TestRunner(self.logger,
+                                            max_parallel=self.max_parallel_tests,
+                                            test_timeout=test_request_obj.test_timeout,
+                                            deadline=test_request_obj.get_deadline(),
+                                            line_parser=ResultParser.get_line_parser(test_request_obj.result_format))
+
         if self.ipmi_managed == True:
-            for test in test_request_obj.master_tests:
-                self.logger.info("Running test %s..." % test)
-                self.logger.info("Currently running: %s" % test)
-                test_run_result = subprocess.getoutput("{0} -c {1}".format(self.ipmi_tools["remote_command_runner"],
-                                                                             test))
+            def test_command(test, timeout):
+                # The remote command runner is a local tool; the runner enforces the timeout
+                return ["/bin/sh", "-c", "{0} -c {1}".format(self.ipmi_tools["remote_command_runner"], test)]
         else:
-            command_string_template = "ssh root@{board_ip} \"bash -c 'source ./env_vars; %s | tee %s_test_result'\""
-            command_string_template = command_string_template.replace("{board_ip}", self.board_ip)
-
-            for test in test_request_obj.master_tests:
-                self.logger.debug(command_string_template % (test, test))
-                test_run_result = subprocess.getoutput(command_string_template % (test, test))
+            command_string_template = "bash -o pipefail -c 'source ./env_vars; %s | tee %s_test_result'"
+            ssh_session = self.get_ssh_session()
+
+            def test_command(test, timeout):
+                remote_command = command_string_template % (test, test)
+                # Have the board stop the test itself, so that it does not outlive the
+                # SSH connection
+                if timeout is not None:
+                    remote_command = "timeout %d %s" % (timeout, remote_command)
+                return ssh_session.ssh_command(remote_command)
+
+        log_dir = "%s/logs/%s_tests/" % (self.workspace, self.board_name)
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        # Each result file is fetched as soon as its test is over, while the other tests
+        # keep running
+        self.test_runs = test_runner.run(node_tests, test_command, log_dir, on_complete=self.fetch_test_result)
+
+        failed_tests = [test_run.test for test_run in self.test_runs if test_run.exit_code != 0]
+        if failed_tests:
+            self.logger.error("Tests that failed or did not complete on %s: %s" % (self.board_name, failed_tests))
+
+        if not self.has_test_results:
+            self.logger.error("No test results found!")
 
-        # Once the tests have been run, call the test result extraction procedure
-        self.extract_test_results()                
-        
-    def extract_test_results(self):
-        """Used for copying test result files back to the BMTF host, for further processing."""
-        status = False
-        cmd_string = "scp root@{board_ip}:/home/root/*_test_result %s" % self.workspace + "test_results/"
-        cmd_string = cmd_string.replace("{board_ip}", self.board_ip)
+    def get_results_path(self):
+        """Results of the master board go straight into the test results folder; the other
+        nodes of a multinode job use a sub-folder named after their role."""
+        results_path = self.workspace + "test_results/"
+        if self.board_role != "master":
+            results_path += "%s/" % self.board_role
+        if not os.path.exists(results_path):
+            os.makedirs(results_path, exist_ok=True)
+        return results_path
+
+    def fetch_test_result(self, test_run):
+        """Used for copying the result file of a test back to the BMTF host, for further
+        processing. Called as soon as the test is over; the file shows up in the results
+        folder in one go (it is written under a temporary name, then renamed), so it can be
+        parsed while the other tests are still running. Returns True on success."""
+        if test_run.exit_code is None:
+            # The test never ran
+            return False
+        result_file_path = "%s%s_test_result" % (self.get_results_path(), test_run.test)
 
-        self.logger.debug("Test result copying command: {0}".format(cmd_string))
-        test_fetch_result = subprocess.getstatusoutput(cmd_string)
-        
-        if test_fetch_result[0] == 0:
-            self.has_test_results = True
-            status = True
+        if self.ipmi_managed == True:
+            # The output of the remote command runner is the result file
+            temp_path = result_file_path + ".part"
+            shutil.copyfile(test_run.log_file, temp_path)
+            os.replace(temp_path, result_file_path)
+            fetch_result = (0, "")
         else:
-            self.logger.error("No test results found!")
-        return status
+            self.logger.debug("Copying /home/root/%s_test_result to %s" % (test_run.test, result_file_path))
+            fetch_result = self.get_ssh_session().get_file("/home/root/%s_test_result" % test_run.test,
+                                                           result_file_path,
+                                                           compress=self.compress_results)
+
+        if fetch_result[0] != 0:
+            self.logger.error("Could not fetch the results of %s: %s" % (test_run.test, fetch_result[1]))
+            return False
+        self.has_test_results = True
+        return True
+
+    def extract_test_results(self):
+        """Fetches the result files of all the tests of the last run again (e.g. after a
+        failed transfer). Returns True if all of them were copied."""
+        return all([self.fetch_test_result(test_run) for test_run in self.test_runs])
 
     def _boot_command_sender(self, child, command_list):
-        """Helper method for parsing the available commands, splitting them in chunks
-        and forwarding them to the pexpect session object"""
+        """Helper method for forwarding the boot commands to the pexpect session object.
+        Each command goes out as a single write, followed by a wait for the bootloader
+        prompt. Bootloaders that tolerate type-ahead can be driven in pipelined mode
+        (pipelined_boot attribute), where all the commands are written at once and the
+        prompts are collected afterwards. Per-command timings are kept in boot_timings."""
+        bootloader_prompt = self.prompt_patterns["bootloader"]
         number_of_commands = len(command_list)
-        for command in command_list:
-            command_index = command_list.index(command)
-            for command_chunk in command.split(" "):
-                child.send("%s " % command_chunk)
-            child.sendline("")
-            if (command_index < number_of_commands - 1):
-                child.expect("U-Boot>")
-        return child
\ No newline at end of file
+        self.boot_timings = []
+
+        if self.pipelined_boot:
+            start_time = time.time()
+            child.send("".join("%s\n" % command for command in command_list))
+            for command_index, command in enumerate(command_list):
+                # The last command (usually a boot command) never gives the prompt back
+                if command_index < number_of_commands - 1:
+                    child.expect(bootloader_prompt, timeout=self.boot_command_timeout)
+                end_time = time.time()
+                self.boot_timings.append((command, end_time - start_time))
+                start_time = end_time
+        else:
+            for command_index, command in enumerate(command_list):
+                start_time = time.time()
+                child.sendline(command)
+                if command_index < number_of_commands - 1:
+                    child.expect(bootloader_prompt, timeout=self.boot_command_timeout)
+                self.boot_timings.append((command, time.time() - start_time))
+
+        self.logger.debug("Boot command timings (%d commands, %.2fs): %s" % (
+                                number_of_commands,
+                                sum(duration for (command, duration) in self.boot_timings),
+                                ", ".join("%s: %.3fs" % (command, duration) for (command, duration) in self.boot_timings)))
+        return child
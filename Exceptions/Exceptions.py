@@ -5,3 +5,53 @@ class ImageLoadFailed(Exception):
             msg = "An error occured when loading the image"
         super(ImageLoadFailed, self).__init__(msg)
         self.imageName = imageName
+
+
+class InventoryLookupFailed(Exception):
+    """Raised when the lab inventory has no usable details for a board"""
+    def __init__(self, board_name, output, msg=None):
+        if msg is None:
+            msg = "Could not obtain the inventory details of %s" % board_name
+        super(InventoryLookupFailed, self).__init__(msg)
+        self.board_name = board_name
+        self.output = output
+
+
+class NoBoardAvailable(Exception):
+    """Raised when the resource pool cannot serve a board allocation request"""
+    def __init__(self, board_type, count=1, msg=None):
+        if msg is None:
+            msg = "Not enough free boards of type %s (%s requested)" % (board_type, count)
+        super(NoBoardAvailable, self).__init__(msg)
+        self.board_type = board_type
+        self.count = count
+
+
+class BootConfigError(Exception):
+    """Raised when the instance configuration of a board cannot be applied to its boot commands"""
+    def __init__(self, board_name, errors, msg=None):
+        if msg is None:
+            msg = "Invalid boot configuration for %s: %s" % (board_name, "; ".join(errors))
+        super(BootConfigError, self).__init__(msg)
+        self.board_name = board_name
+        self.errors = errors
+
+
+class ReservationFailed(Exception):
+    """Raised when the lab reservation tool does not give us a board"""
+    def __init__(self, board_name, output, msg=None):
+        if msg is None:
+            msg = "Could not reserve %s: %s" % (board_name, output)
+        super(ReservationFailed, self).__init__(msg)
+        self.board_name = board_name
+        self.output = output
+
+
+class DeploymentFailed(Exception):
+    """Raised when the tests cannot be deployed to a board"""
+    def __init__(self, board_name, reason, msg=None):
+        if msg is None:
+            msg = "Could not deploy the tests to %s: %s" % (board_name, reason)
+        super(DeploymentFailed, self).__init__(msg)
+        self.board_name = board_name
+        self.reason = reason
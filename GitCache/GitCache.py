@@ -0,0 +1,87 @@
+import os
+import time
+import fcntl
+import hashlib
+import threading
+from git import Repo
+
+class GitCache:
+    """Keeps a bare mirror of every test repository we have cloned, keyed by the repository
+    URL. Mirrors are only updated incrementally (git fetch), and the per-job checkouts are
+    created from them as shared clones: they borrow the mirror objects instead of copying
+    them, so a checkout costs little more than writing the work tree.
+    Concurrent jobs never clone or fetch the same mirror twice at once: a thread lock guards
+    each URL within the framework, and a lock file guards it across processes."""
+
+    def __init__(self, cache_dir, logger_handle=None, fetch_interval=0):
+        """Object constructor. A mirror fetched less than fetch_interval seconds ago is
+        considered fresh (e.g. when several jobs of a batch use the same repository)."""
+        self.cache_dir = cache_dir
+        self.logger = logger_handle
+        self.fetch_interval = fetch_interval
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        # repository URL -> threading.Lock
+        self.url_locks = {}
+        # repository URL -> time of the last fetch
+        self.last_fetch = {}
+        self.lock = threading.Lock()
+
+    def _log_info(self, message):
+        if self.logger:
+            self.logger.info(message)
+
+    def get_mirror_path(self, repo_url):
+        """Returns the folder holding the mirror of the given repository"""
+        repo_name = os.path.basename(repo_url.rstrip("/"))
+        if not repo_name.endswith(".git"):
+            repo_name += ".git"
+        url_hash = hashlib.sha1(repo_url.encode("utf-8")).hexdigest()[:12]
+        return os.path.join(self.cache_dir, "%s_%s" % (url_hash, repo_name))
+
+    def update_mirror(self, repo_url):
+        """Creates the mirror of the given repository, or fetches what changed since the
+        last update. Returns the mirror path."""
+        mirror_path = self.get_mirror_path(repo_url)
+        with self.lock:
+            url_lock = self.url_locks.setdefault(repo_url, threading.Lock())
+
+        with url_lock:
+            if time.time() - self.last_fetch.get(repo_url, 0) < self.fetch_interval:
+                return mirror_path
+
+            with open(mirror_path + ".lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    if os.path.exists(mirror_path):
+                        self._log_info("Updating the mirror of %s" % repo_url)
+                        Repo(mirror_path).git.remote("update", "--prune")
+                    else:
+                        self._log_info("Creating a mirror of %s" % repo_url)
+                        # Clone next to the final location, so that an interrupted clone
+                        # never leaves a broken mirror behind
+                        temp_path = "%s.%d.tmp" % (mirror_path, os.getpid())
+                        Repo.clone_from(repo_url, temp_path, mirror=True)
+                        os.rename(temp_path, mirror_path)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+            self.last_fetch[repo_url] = time.time()
+        return mirror_path
+
+    def checkout(self, repo_url, destination, ref=None):
+        """Creates a work tree of the given repository in destination, at the given ref
+        (branch, tag or commit; defaults to the remote HEAD). Returns the commit checked out.
+        The checkout depends on the mirror objects, so it must not outlive the cache."""
+        mirror_path = self.update_mirror(repo_url)
+
+        # Refs are resolved in the mirror, where every branch and tag of the remote exists
+        commit = Repo(mirror_path).git.rev_parse("%s^{commit}" % (ref or "HEAD"))
+
+        repo = Repo(mirror_path).clone(destination, shared=True, no_checkout=True)
+        repo.git.checkout("--detach", commit)
+        # Point the checkout to the real repository, as a regular clone would
+        repo.remote().set_url(repo_url)
+        self._log_info("Checked out %s at %s in %s" % (repo_url, commit, destination))
+        return commit
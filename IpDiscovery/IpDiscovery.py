@@ -0,0 +1,164 @@
+import os
+import re
+import threading
+
+class IpDiscovery:
+    """Finds out the IP address of a booted board, without temporary files or helper
+    processes. The address is first looked for in the console output of the network
+    configuration command (both the ifconfig and the iproute2 "ip addr" formats are
+    understood). If the console does not show it, the board MAC address is looked up in the
+    ARP/neighbour table and in the DHCP server leases. The last address found for each board
+    is kept, as boards usually get the same lease back when they reboot; it is only trusted
+    when the board can be checked to answer there, or when the console could not be
+    queried at all."""
+
+    # Command sent to the board console; iproute2 first, ifconfig for older images
+    INTERFACE_COMMAND = "ip -4 addr show %(interface)s 2>/dev/null || ifconfig %(interface)s"
+
+    # "inet addr:10.0.0.5" (old ifconfig), "inet 10.0.0.5  netmask" (new ifconfig) and
+    # "inet 10.0.0.5/24" (ip addr)
+    INET_PATTERN = re.compile(r"\binet (?:addr:)?(\d{1,3}(?:\.\d{1,3}){3})\b")
+
+    # /proc/net/arp: IP address, HW type, Flags, HW address, Mask, Device. Flags 0x0 are
+    # incomplete entries.
+    ARP_PATTERN = re.compile(r"^(\d{1,3}(?:\.\d{1,3}){3})\s+\S+\s+(0x[0-9a-fA-F]+)\s+([0-9a-fA-F:]{17})\s", re.MULTILINE)
+
+    # dnsmasq leases: expiry time, MAC address, IP address, host name, client ID
+    DNSMASQ_LEASE_PATTERN = re.compile(r"^\d+\s+([0-9a-fA-F:]{17})\s+(\d{1,3}(?:\.\d{1,3}){3})\s", re.MULTILINE)
+
+    # ISC dhcpd leases: lease <IP> { ... hardware ethernet <MAC>; ... }
+    ISC_LEASE_PATTERN = re.compile(r"^lease\s+(\d{1,3}(?:\.\d{1,3}){3})\s*\{([^}]*)\}", re.MULTILINE)
+    ISC_HARDWARE_PATTERN = re.compile(r"hardware ethernet\s+([0-9a-fA-F:]{17});")
+
+    DEFAULT_LEASE_FILES = ("/var/lib/misc/dnsmasq.leases",
+                           "/var/lib/dhcp/dhcpd.leases",
+                           "/var/lib/dhcpd/dhcpd.leases")
+
+    def __init__(self, logger_handle=None, lease_files=None, arp_file="/proc/net/arp"):
+        """Object constructor"""
+        self.logger = logger_handle
+        self.lease_files = self.DEFAULT_LEASE_FILES if lease_files is None else tuple(lease_files)
+        self.arp_file = arp_file
+
+        # board name -> last known IP address
+        self.known_addresses = {}
+        self.lock = threading.Lock()
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(message)
+
+    @classmethod
+    def get_interface_command(cls, interface="eth0"):
+        """Returns the console command printing the configuration of the given interface"""
+        return cls.INTERFACE_COMMAND % {"interface": interface}
+
+    @classmethod
+    def parse_console_output(cls, console_output):
+        """Returns the first non-loopback IPv4 address in the given command output, or None"""
+        for match in cls.INET_PATTERN.finditer(console_output or ""):
+            if not match.group(1).startswith("127."):
+                return match.group(1)
+        return None
+
+    @staticmethod
+    def _read_file(file_path):
+        try:
+            with open(file_path) as input_file:
+                return input_file.read()
+        except (IOError, OSError):
+            return ""
+
+    def lookup_arp(self, mac_address):
+        """Returns the address the ARP/neighbour table has for the given MAC, or None"""
+        mac_address = mac_address.lower()
+        for match in self.ARP_PATTERN.finditer(self._read_file(self.arp_file)):
+            if match.group(3).lower() == mac_address and int(match.group(2), 16) != 0:
+                return match.group(1)
+        return None
+
+    def lookup_leases(self, mac_address):
+        """Returns the most recent DHCP lease address of the given MAC, or None"""
+        mac_address = mac_address.lower()
+        for lease_file in self.lease_files:
+            if not os.path.exists(lease_file):
+                continue
+            lease_data = self._read_file(lease_file)
+            ip_address = None
+            for match in self.DNSMASQ_LEASE_PATTERN.finditer(lease_data):
+                if match.group(1).lower() == mac_address:
+                    ip_address = match.group(2)
+            # dhcpd appends the lease updates, so the last matching entry wins
+            for match in self.ISC_LEASE_PATTERN.finditer(lease_data):
+                hardware_match = self.ISC_HARDWARE_PATTERN.search(match.group(2))
+                if hardware_match and hardware_match.group(1).lower() == mac_address:
+                    ip_address = match.group(1)
+            if ip_address:
+                return ip_address
+        return None
+
+    def lookup_mac(self, mac_address):
+        """Looks the given MAC address up in the ARP table, then in the DHCP leases"""
+        if not mac_address:
+            return None
+        return self.lookup_arp(mac_address) or self.lookup_leases(mac_address)
+
+    def get_known_address(self, board_name):
+        with self.lock:
+            return self.known_addresses.get(board_name)
+
+    def remember(self, board_name, ip_address):
+        with self.lock:
+            self.known_addresses[board_name] = ip_address
+
+    def forget(self, board_name):
+        """Drops the address kept for a board (e.g. once it turned out to be wrong)"""
+        with self.lock:
+            self.known_addresses.pop(board_name, None)
+
+    def discover(self, board_name, console_output=None, mac_address=None, check_address=None):
+        """Returns the IP address of a board: from the console output if it shows one, then
+        from a MAC address lookup, then the last address known for the board. Returns None
+        if none of them gives an answer.
+        console_output is None when the console could not be queried. If the console
+        answered without an address (interface down, no DHCP lease), the address of the
+        previous boot may belong to another host by now: it is only used if check_address
+        (a function taking an address and telling if the board answers there) confirms it."""
+        ip_address = self.parse_console_output(console_output)
+        source = "console"
+        if ip_address is None:
+            ip_address = self.lookup_mac(mac_address)
+            source = "MAC lookup"
+        if ip_address is None:
+            ip_address = self.get_known_address(board_name)
+            source = "previous boot"
+            if ip_address is not None:
+                if check_address is not None:
+                    usable = check_address(ip_address)
+                else:
+                    usable = console_output is None
+                if usable:
+                    self._log("warning", "No address for %s on the console, using the one of its previous boot: %s" % (
+                                            board_name, ip_address))
+                else:
+                    self._log("warning", "No address for %s on the console; %s, the one of its previous boot, "
+                                         "is not used" % (board_name, ip_address))
+                    self.forget(board_name)
+                    ip_address = None
+
+        if ip_address is not None:
+            self._log("debug", "IP address of %s (from the %s): %s" % (board_name, source, ip_address))
+            self.remember(board_name, ip_address)
+        return ip_address
+
+
+_shared_discovery = None
+_shared_discovery_lock = threading.Lock()
+
+def get_shared_discovery():
+    """Returns the process-wide IpDiscovery instance, creating it if needed"""
+    global _shared_discovery
+    with _shared_discovery_lock:
+        if _shared_discovery is None:
+            _shared_discovery = IpDiscovery()
+        return _shared_discovery
@@ -0,0 +1,310 @@
+import json
+import time
+import sqlite3
+import threading
+from ProcessOwner import ProcessOwner
+
+class JobQueue:
+    """A durable, SQLite-backed queue used for holding test requests until a worker is free
+    to process them. Jobs survive a restart of the framework.
+    Several framework processes may share the queue file (e.g. a daemon and one-shot runs).
+    Each running job records its owner (see ProcessOwner) and a heartbeat, renewed by the
+    owner while the job runs. A running job is only put back into the pending state once its
+    owner is gone or its heartbeat is older than lease_time seconds."""
+
+    JOB_PENDING = "pending"
+    JOB_RUNNING = "running"
+    JOB_FINISHED = "finished"
+    JOB_FAILED = "failed"
+
+    def __init__(self, queue_file, lease_time=120, owner=None):
+        """Object constructor. Opens (or creates) the queue database"""
+        self.queue_file = queue_file
+        self.lease_time = lease_time
+        self.owner = owner or ProcessOwner.get_owner_id()
+
+        # A single connection is shared by all the worker threads, so every access
+        # goes through this lock. Other processes are kept out by the database locks; a
+        # busy database is waited for.
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(queue_file, timeout=30, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                        priority INTEGER NOT NULL DEFAULT 0,
+                                        board_type TEXT NOT NULL,
+                                        state TEXT NOT NULL,
+                                        request_data TEXT NOT NULL,
+                                        submitted REAL,
+                                        started REAL,
+                                        finished REAL,
+                                        error TEXT,
+                                        owner TEXT,
+                                        heartbeat REAL)""")
+        # Queue files created before jobs had owners
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(jobs)")]
+        for column in ("owner TEXT", "heartbeat REAL"):
+            if column.split()[0] not in columns:
+                self.connection.execute("ALTER TABLE jobs ADD COLUMN %s" % column)
+        # Dequeueing always looks for the oldest pending job with the highest priority
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (state, priority DESC, id)")
+
+        self.requeue_interrupted_jobs()
+
+    def requeue_interrupted_jobs(self):
+        """Put the jobs interrupted by a crash back in the queue: running jobs whose owner
+        is no longer running, or whose heartbeat expired. Returns their IDs."""
+        interrupted_jobs = []
+        with self.lock:
+            rows = self.connection.execute("SELECT id, owner, heartbeat FROM jobs WHERE state=?",
+                                           (self.JOB_RUNNING,)).fetchall()
+            for (job_id, owner, heartbeat) in rows:
+                if owner == self.owner:
+                    continue
+                if (owner is None or heartbeat is None or heartbeat < time.time() - self.lease_time
+                        or not ProcessOwner.is_owner_running(owner)):
+                    # The owner check is repeated in the update, in case another process
+                    # took the job back in the meantime
+                    self.connection.execute(
+                        "UPDATE jobs SET state=?, started=NULL, owner=NULL, heartbeat=NULL WHERE id=? AND state=? AND owner IS ?",
+                        (self.JOB_PENDING, job_id, self.JOB_RUNNING, owner))
+                    interrupted_jobs.append(job_id)
+        return interrupted_jobs
+
+    def renew_leases(self):
+        """Refresh the heartbeat of the jobs run by this process"""
+        with self.lock:
+            self.connection.execute("UPDATE jobs SET heartbeat=? WHERE state=? AND owner=?",
+                                    (time.time(), self.JOB_RUNNING, self.owner))
+
+    def put(self, request_data, board_type, priority=0):
+        """Store a new job and return its ID. Higher priority values are served first"""
+        with self.lock:
+            cursor = self.connection.execute(
+                        "INSERT INTO jobs (priority, board_type, state, request_data, submitted) VALUES (?, ?, ?, ?, ?)",
+                        (priority, board_type, self.JOB_PENDING, json.dumps(request_data, default=str), time.time()))
+            return cursor.lastrowid
+
+    def count_running_jobs(self):
+        """Returns the number of running jobs (of all the processes) for each board type"""
+        return dict(self.connection.execute("SELECT board_type, COUNT(*) FROM jobs WHERE state=? GROUP BY board_type",
+                                            (self.JOB_RUNNING,)).fetchall())
+
+    def get(self, board_type_limits=None, default_limit=None, job_ids=None):
+        """Atomically take the next pending job out of the queue and mark it as running.
+        Board types already running as many jobs as their limit allows (board_type_limits,
+        falling back to default_limit; None means no limit) are skipped. The running jobs of
+        every process sharing the queue count. If job_ids is given, only these jobs are
+        considered. Returns a (job ID, board type, request data) tuple or None if nothing
+        can be scheduled right now"""
+        if job_ids is not None and not job_ids:
+            return None
+        board_type_limits = board_type_limits or {}
+
+        with self.lock:
+            # The queue may be shared with other processes: the job is looked up and taken
+            # in a single write transaction
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                excluded_board_types = []
+                for (board_type, running_count) in self.count_running_jobs().items():
+                    limit = board_type_limits.get(board_type, default_limit)
+                    if limit is not None and running_count >= limit:
+                        excluded_board_types.append(board_type)
+
+                query = "SELECT id, board_type, request_data FROM jobs WHERE state=?"
+                query_args = [self.JOB_PENDING]
+                if excluded_board_types:
+                    query += " AND board_type NOT IN (%s)" % ",".join("?" * len(excluded_board_types))
+                    query_args.extend(excluded_board_types)
+                if job_ids is not None:
+                    query += " AND id IN (%s)" % ",".join("?" * len(job_ids))
+                    query_args.extend(job_ids)
+                query += " ORDER BY priority DESC, id LIMIT 1"
+
+                row = self.connection.execute(query, query_args).fetchone()
+                if row is not None:
+                    self.connection.execute("UPDATE jobs SET state=?, started=?, owner=?, heartbeat=? WHERE id=?",
+                                            (self.JOB_RUNNING, time.time(), self.owner, time.time(), row[0]))
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return (row[0], row[1], json.loads(row[2]))
+
+    def mark_done(self, job_id, error=None):
+        """Record the outcome of a job. Only the owner of the job can do so: if the job was
+        given to another process in the meantime (heartbeat expired), nothing changes.
+        Returns True if the job was updated"""
+        state = self.JOB_FAILED if error else self.JOB_FINISHED
+        with self.lock:
+            cursor = self.connection.execute("UPDATE jobs SET state=?, finished=?, error=? WHERE id=? AND owner=?",
+                                             (state, time.time(), error, job_id, self.owner))
+        return cursor.rowcount > 0
+
+    def get_job(self, job_id):
+        """Return a dictionary describing the given job, or None if the ID is unknown"""
+        with self.lock:
+            row = self.connection.execute(
+                        "SELECT id, priority, board_type, state, submitted, started, finished, error, owner FROM jobs WHERE id=?",
+                        (job_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("id", "priority", "board_type", "state", "submitted", "started", "finished", "error", "owner"),
+                        row))
+
+    def list_jobs(self, state=None):
+        """Return the IDs of all the jobs, optionally filtered by state"""
+        with self.lock:
+            if state is None:
+                rows = self.connection.execute("SELECT id FROM jobs ORDER BY id").fetchall()
+            else:
+                rows = self.connection.execute("SELECT id FROM jobs WHERE state=? ORDER BY id", (state,)).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class JobScheduler:
+    """Runs the jobs stored in a JobQueue on a pool of worker threads. The amount of jobs
+    running at the same time on a given board type can be limited, so that a long queue of
+    jobs for one board type never starves the rest of the lab. The limits cover the jobs of
+    all the processes sharing the queue."""
+
+    def __init__(self, job_queue, job_handler, logger_handle, workers=1, board_type_limits=None, default_limit=None,
+                 claim_all_jobs=True):
+        """Object constructor. The job handler is called as job_handler(job_id, request_data)
+        from a worker thread; any exception it raises marks the job as failed.
+        With claim_all_jobs set to False, the workers only take the jobs submitted through
+        this scheduler (one-shot runs), leaving the others to the daemon."""
+        self.job_queue = job_queue
+        self.job_handler = job_handler
+        self.logger = logger_handle
+        self.number_of_workers = workers
+
+        # Maximum number of concurrent jobs per board type. Board types that are not listed
+        # fall back to default_limit (None means no limit).
+        self.board_type_limits = board_type_limits or {}
+        self.default_limit = default_limit
+
+        # IDs of the jobs submitted through this scheduler, or None if any job can be taken
+        self.own_jobs = None if claim_all_jobs else set()
+
+        # Used to wake up idle workers whenever a job is submitted or a running one is done
+        self.condition = threading.Condition()
+        self.workers = []
+        self.running = False
+
+        # Keeps the heartbeat of the running jobs fresh and requeues the jobs of processes
+        # that died
+        self.stop_event = threading.Event()
+        self.heartbeat_thread = None
+
+    def start(self):
+        """Start the worker threads"""
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+
+        for worker_index in range(self.number_of_workers):
+            worker_thread = threading.Thread(target=self._worker_loop, name="damf-worker-%d" % worker_index)
+            worker_thread.daemon = True
+            worker_thread.start()
+            self.workers.append(worker_thread)
+
+        self.stop_event.clear()
+        self.heartbeat_thread = threading.Thread(target=self._heartbeat_loop, name="damf-job-heartbeat")
+        self.heartbeat_thread.daemon = True
+        self.heartbeat_thread.start()
+        self.logger.info("Job scheduler started with %d worker(s)" % self.number_of_workers)
+
+    def stop(self, wait=True):
+        """Ask the workers to exit once their current job is done"""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if wait:
+            for worker_thread in self.workers:
+                worker_thread.join()
+        self.workers = []
+        self.stop_event.set()
+        if wait and self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+
+    def submit(self, request_data, board_type, priority=0):
+        """Queue a new job and return its ID"""
+        job_id = self.job_queue.put(request_data, board_type, priority)
+        self.logger.info("Job %s queued for %s (priority %s)" % (job_id, board_type, priority))
+        with self.condition:
+            if self.own_jobs is not None:
+                self.own_jobs.add(job_id)
+            self.condition.notify()
+        return job_id
+
+    def get_job_status(self, job_id):
+        """Returns the job details (state, timestamps, error), as stored in the queue"""
+        return self.job_queue.get_job(job_id)
+
+    def wait_for_job(self, job_id, timeout=None, poll_interval=1.0):
+        """Block until the given job is done. Returns the final job details, or None if the
+        timeout expired first"""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            job = self.job_queue.get_job(job_id)
+            if job is None or job["state"] in (JobQueue.JOB_FINISHED, JobQueue.JOB_FAILED):
+                return job
+            if deadline is not None and time.time() >= deadline:
+                return None
+            time.sleep(poll_interval)
+
+    def _heartbeat_loop(self):
+        while not self.stop_event.wait(max(1, self.job_queue.lease_time / 4)):
+            try:
+                self.job_queue.renew_leases()
+                interrupted_jobs = self.job_queue.requeue_interrupted_jobs()
+            except Exception:
+                self.logger.exception("Could not refresh the job heartbeats")
+                continue
+            if interrupted_jobs:
+                self.logger.warning("Jobs %s were interrupted (their owner is gone), queued again" % interrupted_jobs)
+                with self.condition:
+                    self.condition.notify_all()
+
+    def _worker_loop(self):
+        """Pulls jobs out of the queue and hands them over to the job handler"""
+        while True:
+            with self.condition:
+                job = None
+                while self.running:
+                    job = self.job_queue.get(self.board_type_limits, self.default_limit,
+                                             None if self.own_jobs is None else list(self.own_jobs))
+                    if job is not None:
+                        break
+                    # Nothing we can run right now; also poll from time to time, in case
+                    # jobs are added to the queue file (or board types freed) by another
+                    # process
+                    self.condition.wait(timeout=5)
+                if not self.running:
+                    return
+                (job_id, board_type, request_data) = job
+
+            self.logger.info("Job %s started" % job_id)
+            error = None
+            try:
+                self.job_handler(job_id, request_data)
+            except Exception as e:
+                error = "%s: %s" % (type(e).__name__, e)
+                self.logger.exception("Job %s failed" % job_id)
+            if not self.job_queue.mark_done(job_id, error):
+                self.logger.warning("Job %s was taken over by another process while running" % job_id)
+            self.logger.info("Job %s done" % job_id)
+
+            with self.condition:
+                if self.own_jobs is not None:
+                    self.own_jobs.discard(job_id)
+                self.condition.notify_all()
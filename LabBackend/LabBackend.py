@@ -0,0 +1,201 @@
+import os
+import re
+import sys
+import shlex
+import shutil
+import threading
+import subprocess
+from SSHPool import SSHPool
+
+class TargetBackend:
+    """The lab the framework was written for: boards are reserved, powered and reached
+    through their console with the target tool, the inventory comes from targetadmin and
+    the boards are accessed over SSH. Other backends provide the same attributes and
+    methods."""
+
+    name = "target"
+
+    def __init__(self, settings=None, logger_handle=None):
+        """Object constructor"""
+        self.settings = settings or {}
+        self.logger = logger_handle
+
+        # Command templates: (board name, duration), (board name, reservation ID) and
+        # board name. None means the defaults of the component using them (see Constants
+        # and BoardInventory).
+        self.reserve_command = None
+        self.release_command = None
+        self.inventory_command = None
+
+    def console_command(self, board_name):
+        """Returns the command connecting to the board console"""
+        return "target %s" % board_name
+
+    def power_command(self, board_name, state):
+        return "target %s -p %s" % (board_name, state)
+
+    def power(self, board_name, state):
+        """Switches the board power on or off. Returns the exit code of the power command"""
+        # The output of the power tool goes to the log, not to the framework's own output
+        result = subprocess.run(shlex.split(self.power_command(board_name, state)),
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        if self.logger is not None:
+            self.logger.debug("[%s] power %s: %s" % (board_name, state,
+                              result.stdout.decode("utf-8", "replace").strip()))
+        return result.returncode
+
+    def create_ssh_pool(self, logger_handle=None, user="root", persist=600, ssh_options=None):
+        """Returns the pool of sessions used for reaching the booted boards"""
+        return SSHPool.SSHPool(logger_handle, user, persist, ssh_options)
+
+    def close(self):
+        pass
+
+
+class LocalBoardSession(SSHPool.SSHSession):
+    """Stands in for the SSH session of a simulated board. Commands run on this host, in a
+    local folder holding the board filesystem: the absolute board paths the framework uses
+    (/home, /etc and the root of tar archives) are mapped into that folder."""
+
+    BOARD_PATH_PATTERN = re.compile(r"(?<![\w./-])/(?=(?:home|etc)/)")
+    ARCHIVE_ROOT_PATTERN = re.compile(r"-C /(?=\s|$)")
+
+    def __init__(self, host, board_root, logger_handle=None):
+        """Object constructor"""
+        SSHPool.SSHSession.__init__(self, host, board_root, logger_handle=logger_handle)
+        self.board_root = board_root
+        self.home = os.path.join(board_root, "home", "root")
+        for folder in (self.home, os.path.join(board_root, "etc", "apt", "sources.list.d")):
+            if not os.path.exists(folder):
+                os.makedirs(folder, exist_ok=True)
+
+    def map_paths(self, remote_command):
+        remote_command = self.ARCHIVE_ROOT_PATTERN.sub("-C %s/" % self.board_root, remote_command)
+        return self.BOARD_PATH_PATTERN.sub(self.board_root + "/", remote_command)
+
+    def ssh_command(self, remote_command):
+        return ["/bin/sh", "-c", "cd %s && HOME=%s && %s" % (shlex.quote(self.home),
+                                                           shlex.quote(self.home),
+                                                           self.map_paths(remote_command))]
+
+    def run(self, remote_command, timeout=None, input_data=None):
+        # Paths fed to a command (e.g. the stale files DeltaSync deletes) are board paths too
+        if input_data is not None:
+            input_data = self.BOARD_PATH_PATTERN.sub(self.board_root + "/", input_data.decode("utf-8")).encode("utf-8")
+        return SSHPool.SSHSession.run(self, remote_command, timeout, input_data)
+
+    def is_connected(self):
+        return True
+
+    def scp(self, sources, destination, recursive=False):
+        def local_path(path):
+            return self.board_root + path[1:] if path.startswith(":") else path
+        copy_command = ["cp"] + (["-r"] if recursive else []) + [local_path(path) for path in sources]
+        copy_command.append(local_path(destination))
+        result = subprocess.run(copy_command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        return (result.returncode, result.stdout.decode("utf-8", "replace"))
+
+    def close(self):
+        pass
+
+
+class LocalBoardPool(SSHPool.SSHPool):
+    """SSHPool of the simulated boards: the sessions are LocalBoardSession objects, found
+    by the simulated board address"""
+
+    def __init__(self, boards_dir, address_map, logger_handle=None):
+        SSHPool.SSHPool.__init__(self, logger_handle)
+        self.boards_dir = boards_dir
+        # IP address -> board name
+        self.address_map = address_map
+
+    def get_session(self, host):
+        with self.lock:
+            if host not in self.sessions:
+                board_name = self.address_map(host) or host
+                self.sessions[host] = LocalBoardSession(host, os.path.join(self.boards_dir, board_name), self.logger)
+            return self.sessions[host]
+
+
+class SimulatorBackend(TargetBackend):
+    """A lab simulated on this host, for exercising and timing the whole flow without
+    boards: the lab tools are replaced by simlab.py (fake reservations, power, inventory and
+    consoles printing U-Boot and login prompts with configurable latencies) and every board
+    filesystem is a local folder. Settings (lab section of the config file): state_dir,
+    command_latency, boot_time and power_time (seconds)."""
+
+    name = "simulator"
+
+    def __init__(self, settings=None, logger_handle=None):
+        TargetBackend.__init__(self, settings, logger_handle)
+        self.state_dir = os.path.abspath(self.settings.get("state_dir", "simlab"))
+        self.boards_dir = os.path.join(self.state_dir, "boards")
+        if not os.path.exists(self.boards_dir):
+            os.makedirs(self.boards_dir, exist_ok=True)
+
+        self.tool_prefix = " ".join(shlex.quote(argument) for argument in [
+                                sys.executable,
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), "simlab.py"),
+                                "--state-dir", self.state_dir,
+                                "--command-latency", str(self.settings.get("command_latency", 0.0)),
+                                "--boot-time", str(self.settings.get("boot_time", 1.0)),
+                                "--power-time", str(self.settings.get("power_time", 0.0))])
+        self.reserve_command = self.tool_prefix + " target %s -r now-+%s"
+        self.release_command = self.tool_prefix + " target %s --unreserve_id=%s"
+        self.inventory_command = self.tool_prefix + " targetadmin --display --name %s"
+
+        # simulated address -> board name, for the boards seen so far
+        self.addresses = {}
+        self.lock = threading.Lock()
+
+    def get_board_address(self, board_name):
+        """The address the console of a simulated board reports"""
+        # Imported here, since simlab.py is meant to be run as a script
+        from LabBackend import simlab
+        board_address = simlab.board_address(board_name)
+        with self.lock:
+            self.addresses[board_address] = board_name
+        return board_address
+
+    def console_command(self, board_name):
+        self.get_board_address(board_name)
+        return "%s target %s" % (self.tool_prefix, board_name)
+
+    def power_command(self, board_name, state):
+        return "%s target %s -p %s" % (self.tool_prefix, board_name, state)
+
+    def create_ssh_pool(self, logger_handle=None, user="root", persist=600, ssh_options=None):
+        def address_map(host):
+            with self.lock:
+                return self.addresses.get(host)
+        return LocalBoardPool(self.boards_dir, address_map, logger_handle)
+
+    def reset(self):
+        """Forgets all the simulated boards (state and filesystems)"""
+        shutil.rmtree(self.state_dir, ignore_errors=True)
+        os.makedirs(self.boards_dir)
+
+
+# Backends by name (the backend setting of the lab config section)
+BACKENDS = {TargetBackend.name: TargetBackend,
+            SimulatorBackend.name: SimulatorBackend}
+
+def create_backend(settings=None, logger_handle=None):
+    """Returns the lab backend selected in the given settings (default: target)"""
+    settings = settings or {}
+    backend_name = settings.get("backend", TargetBackend.name)
+    if backend_name not in BACKENDS:
+        raise ValueError("Unknown lab backend: %s (known backends: %s)" % (backend_name, ", ".join(sorted(BACKENDS))))
+    return BACKENDS[backend_name](settings, logger_handle)
+
+
+_shared_backend = None
+_shared_backend_lock = threading.Lock()
+
+def get_shared_backend():
+    """Returns the process-wide default lab backend, creating it if needed"""
+    global _shared_backend
+    with _shared_backend_lock:
+        if _shared_backend is None:
+            _shared_backend = TargetBackend()
+        return _shared_backend
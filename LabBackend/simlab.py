@@ -0,0 +1,191 @@
+"""Simulated lab tools, used by the simulator lab backend (see LabBackend.SimulatorBackend).
+Mimics the command line of the real tools:
+
+    simlab.py --state-dir DIR target BOARD -r now-+30M          reserve
+    simlab.py --state-dir DIR target BOARD --unreserve_id=ID    release a reservation
+    simlab.py --state-dir DIR target BOARD -p on|off            power
+    simlab.py --state-dir DIR target BOARD                      console
+    simlab.py --state-dir DIR targetadmin --display --name BOARD
+
+The state of every board (power, boot state, reservations) is kept in a JSON file in the
+state folder. The console prints U-Boot, kernel and login output with configurable
+latencies and answers the network configuration query with the simulated board address.
+This script is standalone on purpose: it runs as a separate process for every call, like
+the real tools do."""
+import os
+import re
+import sys
+import json
+import time
+import fcntl
+import zlib
+import argparse
+import contextlib
+
+BOOT_COMMAND_PATTERN = re.compile(r"^\s*(boot|bootm|bootz|booti|run\s+\S*boot\S*)\b")
+
+def board_address(board_name):
+    """The (stable) IP address of a simulated board"""
+    board_hash = zlib.crc32(board_name.encode("utf-8"))
+    return "10.%d.%d.%d" % (100 + (board_hash >> 16) % 100, (board_hash >> 8) % 256, 1 + board_hash % 254)
+
+@contextlib.contextmanager
+def board_state(state_dir, board_name):
+    """Locks the state file of a board and yields its contents, saved back afterwards"""
+    if not os.path.exists(state_dir):
+        os.makedirs(state_dir, exist_ok=True)
+    state_path = os.path.join(state_dir, "%s.json" % board_name)
+    with open(state_path, "a+") as state_file:
+        fcntl.flock(state_file, fcntl.LOCK_EX)
+        state_file.seek(0)
+        contents = state_file.read()
+        state = json.loads(contents) if contents else {"power": "off", "booted": False, "reservations": {}}
+        yield state
+        state_file.seek(0)
+        state_file.truncate()
+        json.dump(state, state_file)
+
+def reserve(options):
+    with board_state(options.state_dir, options.board) as state:
+        now = time.time()
+        state["reservations"] = dict((reservation_id, expiry) for reservation_id, expiry
+                                     in state["reservations"].items() if expiry > now)
+        minutes = int(re.match(r"now-\+(\d+)M", options.reserve).group(1))
+        state["last_id"] = state.get("last_id", 0) + 1
+        reservation_id = "%s-%d" % (options.board, state["last_id"])
+        state["reservations"][reservation_id] = now + minutes * 60
+    print("Reservation confirmed, id=%s" % reservation_id)
+    return 0
+
+def unreserve(options):
+    with board_state(options.state_dir, options.board) as state:
+        if state["reservations"].pop(options.unreserve_id, None) is None:
+            print("No such reservation: %s" % options.unreserve_id)
+            return 1
+    print("Reservation %s removed" % options.unreserve_id)
+    return 0
+
+def power(options):
+    time.sleep(options.power_time)
+    with board_state(options.state_dir, options.board) as state:
+        state["power"] = options.power
+        state["booted"] = False
+    print("%s powered %s" % (options.board, options.power))
+    return 0
+
+def inventory(options):
+    board_hash = zlib.crc32(options.name.encode("utf-8"))
+    print("name ivlab_id site rack eth_ports pdu arch bootloader cpu")
+    print("-" * 60)
+    print("%s sim-%d simlab 0 1 - sim u-boot simcpu" % (options.name, board_hash % 100000))
+    return 0
+
+
+class Console:
+    """A simulated serial console, reading from the pseudo-terminal the caller gave us"""
+
+    def __init__(self, options):
+        self.options = options
+        self.board = options.board
+        self.output = sys.stdout
+
+    def write(self, text):
+        self.output.write(text)
+        self.output.flush()
+
+    def set_booted(self, booted):
+        with board_state(self.options.state_dir, self.board) as state:
+            state["booted"] = booted
+
+    def read_lines(self):
+        """Yields the input lines. Returns on Ctrl-] (or end of input)"""
+        line = ""
+        while True:
+            data = os.read(sys.stdin.fileno(), 4096)
+            if not data:
+                return
+            for char in data.decode("utf-8", "replace"):
+                if char == "\x1d":
+                    return
+                if char in "\r\n":
+                    self.write("\r\n")
+                    yield line
+                    line = ""
+                else:
+                    self.write(char)
+                    line += char
+
+    def run(self):
+        with board_state(self.options.state_dir, self.board) as state:
+            (powered, booted) = (state["power"] == "on", state["booted"])
+        self.write("Connected to %s. Quit: Ctrl-]\r\n" % self.board)
+        if not powered:
+            self.write("Connection to %s closed.\r\n" % self.board)
+            return 0
+
+        mode = "login" if booted else "bootloader"
+        for line in self.read_lines():
+            time.sleep(self.options.command_latency)
+            if mode == "bootloader":
+                if BOOT_COMMAND_PATTERN.match(line):
+                    self.write("Starting kernel ...\r\n")
+                    time.sleep(self.options.boot_time)
+                    self.set_booted(True)
+                    mode = "login"
+                    self.write("\r\n%s login: " % self.board)
+                else:
+                    self.write("U-Boot> ")
+            elif mode == "login":
+                if line.strip():
+                    mode = "shell"
+                    self.write("root@%s:~# " % self.board)
+                else:
+                    self.write("%s login: " % self.board)
+            else:
+                if re.search(r"\b(ip|ifconfig)\b", line):
+                    self.write("2: eth0: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500\r\n"
+                               "    inet %s/16 brd 10.255.255.255 scope global eth0\r\n" % board_address(self.board))
+                self.write("root@%s:~# " % self.board)
+        return 0
+
+def console(options):
+    if os.isatty(sys.stdin.fileno()):
+        import tty
+        tty.setraw(sys.stdin.fileno())
+    return Console(options).run()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Simulated lab tools")
+    parser.add_argument("--state-dir", default="simlab")
+    parser.add_argument("--command-latency", type=float, default=0.0,
+                        help="Seconds before the console answers a command")
+    parser.add_argument("--boot-time", type=float, default=1.0, help="Seconds from the boot command to the login prompt")
+    parser.add_argument("--power-time", type=float, default=0.0, help="Seconds a power command takes")
+    tools = parser.add_subparsers(dest="tool")
+
+    target_parser = tools.add_parser("target")
+    target_parser.add_argument("board")
+    target_parser.add_argument("-r", dest="reserve")
+    target_parser.add_argument("--unreserve_id")
+    target_parser.add_argument("-p", dest="power", choices=["on", "off"])
+
+    targetadmin_parser = tools.add_parser("targetadmin")
+    targetadmin_parser.add_argument("--display", action="store_true")
+    targetadmin_parser.add_argument("--name", required=True)
+
+    options = parser.parse_args(argv)
+    if options.tool == "targetadmin":
+        return inventory(options)
+    if options.tool != "target":
+        parser.error("Unknown tool")
+    if options.reserve:
+        return reserve(options)
+    if options.unreserve_id:
+        return unreserve(options)
+    if options.power:
+        return power(options)
+    return console(options)
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
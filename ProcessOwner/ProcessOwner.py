@@ -0,0 +1,61 @@
+import os
+import socket
+
+# Files shared by several framework processes (the job queue, the lease journals) record
+# which process owns what. A process is identified by its host name, its PID and its start
+# time, so that a PID reused by an unrelated process is not mistaken for the owner.
+
+def get_process_start_time(pid):
+    """Returns the start time of a process (in clock ticks since boot, from /proc), or None
+    if it is not known"""
+    try:
+        with open("/proc/%d/stat" % pid) as stat_file:
+            stat_line = stat_file.read()
+    except (IOError, OSError):
+        return None
+    # The command name (second field) may contain spaces; the fields after it are plain
+    # numbers. The start time is the 22nd field.
+    try:
+        return int(stat_line[stat_line.rindex(")") + 2:].split()[19])
+    except (ValueError, IndexError):
+        return None
+
+def get_owner_id(pid=None):
+    """Returns the owner ID of the given process (default: the current one), as
+    <host name>:<pid>:<start time>"""
+    pid = pid or os.getpid()
+    return "%s:%d:%s" % (socket.gethostname(), pid, get_process_start_time(pid) or "")
+
+def parse_owner_id(owner_id):
+    """Returns the (host name, pid, start time) of an owner ID. The start time is None if
+    it was not known; None is returned for malformed IDs"""
+    try:
+        (host_name, pid, start_time) = owner_id.rsplit(":", 2)
+        return (host_name, int(pid), int(start_time) if start_time else None)
+    except (AttributeError, ValueError):
+        return None
+
+def is_local_owner(owner_id):
+    """True if the owner ID belongs to a process of this host"""
+    owner = parse_owner_id(owner_id)
+    return owner is not None and owner[0] == socket.gethostname()
+
+def is_owner_running(owner_id):
+    """Tells if the process behind an owner ID of this host is still running. The processes
+    of other hosts cannot be checked; they are reported as running."""
+    owner = parse_owner_id(owner_id)
+    if owner is None:
+        return False
+    (host_name, pid, start_time) = owner
+    if host_name != socket.gethostname():
+        return True
+    if pid == os.getpid():
+        return start_time is None or start_time == get_process_start_time(pid)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    # The PID may have been given to another process since
+    return start_time is None or start_time == get_process_start_time(pid)
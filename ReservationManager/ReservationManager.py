@@ -0,0 +1,294 @@
+import os
+import re
+import glob
+import json
+import time
+import atexit
+import shlex
+import threading
+import subprocess
+import concurrent.futures
+from Exceptions import Exceptions
+from ProcessOwner import ProcessOwner
+
+class Lease:
+    """A board reservation held by the framework"""
+
+    def __init__(self, board_name, reservation_id, expires_at):
+        self.board_name = board_name
+        self.reservation_id = reservation_id
+        self.expires_at = expires_at
+
+    def to_dict(self):
+        return {"reservation_id": self.reservation_id, "expires_at": self.expires_at}
+
+
+class ReservationManager:
+    """Reserves boards with the lab reservation tool and makes sure the reservations do not
+    outlive their use. Reservations are made for lease_minutes and renewed in the background
+    while they are held, so that a long job (or a board idling in the warm pool) never loses
+    its board. Failed reservation attempts are retried with an exponential backoff.
+    Every lease held is written to a journal file of the process (several framework
+    processes may run side by side, e.g. a daemon and one-shot runs). Leases are released
+    when the framework exits (atexit, which also covers sys.exit from a signal handler); the
+    journals of framework processes that crashed are found and their leases released by
+    the next start."""
+
+    # The reservation tool reports the new reservation as "...<id>=<reservation id>"
+    RESERVATION_ID_PATTERN = re.compile(r"=\s*([\w.-]+)")
+    # Replies that are not worth retrying
+    RESERVED_BY_OTHER_PATTERN = re.compile(r"reserved by (?:a )?different user", re.IGNORECASE)
+
+    def __init__(self, reserve_command, release_command, journal_path, logger_handle=None,
+                 lease_minutes=30, renew_margin=300, attempts=3, backoff=2):
+        """Object constructor. reserve_command is formatted with (board name, duration) and
+        release_command with (board name, reservation ID), see the Constants commands.
+        Leases are renewed once they have less than renew_margin seconds left.
+        journal_path names the journals: each process writes its own, with its PID added
+        before the extension (damf-leases.json -> damf-leases.<pid>.json)."""
+        self.reserve_command = reserve_command
+        self.release_command = release_command
+        (journal_base, journal_extension) = os.path.splitext(journal_path)
+        self.journal_pattern = "%s.*%s" % (journal_base, journal_extension)
+        self.journal_path = "%s.%d%s" % (journal_base, os.getpid(), journal_extension)
+        self.owner = ProcessOwner.get_owner_id()
+        self.logger = logger_handle
+        self.lease_minutes = lease_minutes
+        self.renew_margin = min(renew_margin, lease_minutes * 30)
+        self.attempts = max(1, attempts)
+        self.backoff = backoff
+
+        # board name -> Lease
+        self.leases = {}
+        self.lock = threading.Lock()
+        self.journal_lock = threading.Lock()
+
+        # Leftovers of the runs that did not get to clean up after themselves
+        self.release_stale_journals()
+
+        self.stop_event = threading.Event()
+        self.renewal_thread = threading.Thread(target=self._renewal_loop, name="damf-lease-renewal")
+        self.renewal_thread.daemon = True
+        self.renewal_thread.start()
+        atexit.register(self.close)
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(message)
+
+    def run_command(self, command_string):
+        """Runs a reservation tool command and returns its (exit code, output)"""
+        self._log("debug", "Sending command %s" % command_string)
+        result = subprocess.run(shlex.split(command_string), stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+        return (result.returncode, result.stdout.decode("utf-8", "replace"))
+
+    def parse_reservation_id(self, output):
+        """Returns the reservation ID in the reservation tool output, or None"""
+        match = self.RESERVATION_ID_PATTERN.search(output)
+        return match.group(1) if match else None
+
+    def _reserve_once(self, board_name):
+        (exit_code, output) = self.run_command(self.reserve_command % (board_name, "%dM" % self.lease_minutes))
+        reservation_id = self.parse_reservation_id(output) if exit_code == 0 else None
+        if reservation_id is None:
+            raise Exceptions.ReservationFailed(board_name, output.strip())
+        return Lease(board_name, reservation_id, time.time() + self.lease_minutes * 60)
+
+    def _reserve_with_retries(self, board_name):
+        delay = 1
+        for attempt in range(1, self.attempts + 1):
+            try:
+                return self._reserve_once(board_name)
+            except Exceptions.ReservationFailed as e:
+                if attempt == self.attempts or self.RESERVED_BY_OTHER_PATTERN.search(e.output):
+                    raise
+                self._log("warning", "Could not reserve %s (attempt %d of %d): %s" % (board_name, attempt,
+                                                                                      self.attempts, e.output))
+            time.sleep(delay)
+            delay *= self.backoff
+
+    def reserve(self, board_names):
+        """Reserves all the given boards, in parallel. Either all of them are reserved or
+        none is (the reservations already made are released and the error is raised).
+        Returns a dictionary: board name -> reservation ID."""
+        board_names = list(board_names)
+        leases = []
+        reservation_error = None
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(board_names))) as executor:
+            for reservation_future in concurrent.futures.as_completed(
+                                        [executor.submit(self._reserve_with_retries, board_name)
+                                         for board_name in board_names]):
+                try:
+                    leases.append(reservation_future.result())
+                except Exception as e:
+                    reservation_error = e
+
+        with self.lock:
+            for lease in leases:
+                self.leases[lease.board_name] = lease
+        self.write_journal()
+
+        if reservation_error is not None:
+            for lease in leases:
+                self.release(lease.board_name)
+            raise reservation_error
+
+        self._log("info", "Reserved %s for %d minutes" % (", ".join(board_names), self.lease_minutes))
+        return dict((lease.board_name, lease.reservation_id) for lease in leases)
+
+    def get_reservation_id(self, board_name):
+        with self.lock:
+            lease = self.leases.get(board_name)
+        return lease.reservation_id if lease else None
+
+    def _release_reservation(self, board_name, reservation_id):
+        (exit_code, output) = self.run_command(self.release_command % (board_name, reservation_id))
+        if exit_code != 0:
+            self._log("error", "Could not release the reservation %s of %s: %s" % (reservation_id, board_name,
+                                                                                  output.strip()))
+        return exit_code == 0
+
+    def release(self, board_name):
+        """Cancels the reservation of a board. Returns False if the board was not reserved
+        or if the reservation tool failed."""
+        with self.lock:
+            lease = self.leases.pop(board_name, None)
+        if lease is None:
+            return False
+        self.write_journal()
+        released = self._release_reservation(board_name, lease.reservation_id)
+        if released:
+            self._log("info", "Released the reservation of %s" % board_name)
+        return released
+
+    def release_all(self):
+        with self.lock:
+            board_names = list(self.leases)
+        for board_name in board_names:
+            self.release(board_name)
+
+    def renew(self, board_name):
+        """Extends the reservation of a board by taking a new lease before releasing the
+        old one, so that the board is never left unreserved in between"""
+        with self.lock:
+            old_lease = self.leases.get(board_name)
+        if old_lease is None:
+            return False
+        try:
+            new_lease = self._reserve_with_retries(board_name)
+        except Exception as e:
+            self._log("error", "Could not renew the reservation of %s: %s" % (board_name, e))
+            return False
+
+        with self.lock:
+            if self.leases.get(board_name) is not old_lease:
+                # Released in the meantime
+                renewed = False
+            else:
+                self.leases[board_name] = new_lease
+                renewed = True
+        self.write_journal()
+        self._release_reservation(board_name, old_lease.reservation_id if renewed else new_lease.reservation_id)
+        if renewed:
+            self._log("debug", "Renewed the reservation of %s (%s)" % (board_name, new_lease.reservation_id))
+        return renewed
+
+    def renew_expiring(self):
+        """Renews the leases that expire within the renewal margin"""
+        renew_before = time.time() + self.renew_margin
+        with self.lock:
+            board_names = [lease.board_name for lease in self.leases.values() if lease.expires_at <= renew_before]
+        for board_name in board_names:
+            self.renew(board_name)
+
+    def _renewal_loop(self):
+        while not self.stop_event.wait(min(60, max(1, self.renew_margin / 2))):
+            self.renew_expiring()
+
+    def write_journal(self):
+        """Stores the current leases in the journal of this process; the file is replaced
+        atomically"""
+        with self.journal_lock:
+            with self.lock:
+                journal = {"owner": self.owner,
+                           "leases": dict((lease.board_name, lease.to_dict()) for lease in self.leases.values())}
+            temp_path = "%s.tmp" % self.journal_path
+            with open(temp_path, "w") as journal_file:
+                json.dump(journal, journal_file)
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+            os.replace(temp_path, self.journal_path)
+
+    def remove_journal(self):
+        with self.journal_lock:
+            try:
+                os.remove(self.journal_path)
+            except OSError:
+                pass
+
+    def get_stale_journals(self):
+        """Returns the journals of the framework processes that are gone. A journal under
+        the name of this process was left by an earlier process with the same PID."""
+        stale_journals = []
+        for journal_path in sorted(glob.glob(self.journal_pattern)):
+            if not os.path.isfile(journal_path):
+                continue
+            try:
+                with open(journal_path) as journal_file:
+                    journal = json.load(journal_file)
+            except (IOError, OSError, ValueError):
+                continue
+
+            owner = journal.get("owner")
+            if owner is not None and not ProcessOwner.is_local_owner(owner):
+                # A process of another host sharing the folder: there is no telling if it
+                # is still running, so its journal is left alone until its leases expired
+                if any(lease["expires_at"] > time.time() for lease in journal.get("leases", {}).values()):
+                    continue
+            elif owner is not None and ProcessOwner.is_owner_running(owner):
+                continue
+            stale_journals.append(journal_path)
+        return stale_journals
+
+    def release_journal_leases(self, journal_path):
+        """Releases the still valid leases found in the journal of a process that is gone,
+        then deletes the journal. Returns the number of leases released."""
+        # Several processes may start at the same time: the one that manages to take the
+        # journal out of the way releases its leases
+        claimed_path = "%s.%d.claimed" % (journal_path, os.getpid())
+        try:
+            os.rename(journal_path, claimed_path)
+        except OSError:
+            return 0
+        try:
+            with open(claimed_path) as journal_file:
+                journal = json.load(journal_file)
+        except (IOError, OSError, ValueError):
+            journal = {}
+
+        released = 0
+        for board_name, lease in journal.get("leases", {}).items():
+            if lease["expires_at"] > time.time():
+                self._log("warning", "Releasing the reservation %s of %s, left over by a previous run (%s)" % (
+                                        lease["reservation_id"], board_name, journal_path))
+                self._release_reservation(board_name, lease["reservation_id"])
+                released += 1
+        os.remove(claimed_path)
+        return released
+
+    def release_stale_journals(self):
+        """Releases the leases left over by the framework processes that are gone"""
+        for journal_path in self.get_stale_journals():
+            self.release_journal_leases(journal_path)
+
+    def close(self):
+        """Stops the renewals and releases all the reservations still held"""
+        if self.stop_event.is_set():
+            return
+        self.stop_event.set()
+        if self.renewal_thread is not threading.current_thread():
+            self.renewal_thread.join()
+        self.release_all()
+        self.remove_journal()
+        atexit.unregister(self.close)
@@ -1,16 +1,36 @@
+import time
 import subprocess
+import threading
+import concurrent.futures
 import yaml
 import os
 import sys
+from BoardInventory import BoardInventory
+from BoardProfile import BoardProfile
+from Exceptions import Exceptions
 
 class ResourcePool:
     """Used for managing the boards currently available within the test laboratory. Makes sure that
-    all resource requests are served from one specific source."""
-    def __init__(self, board_files_path, logger_handle):
+    all resource requests are served from one specific source.
+    The pool is kept in memory and indexed by board type, architecture, CPU, bootloader and
+    capability flags, so that lookups and allocations never need to shell out. All the
+    operations are thread-safe; allocations are atomic, so concurrent workers never get the
+    same board. A worker asking for boards that are all busy can wait for them to be
+    released."""
+
+    # Board attributes the pool is indexed by
+    INDEXED_ATTRIBUTES = ["board_type", "arch", "cpu", "bootloader", "has_ssh", "ipmi_managed"]
+
+    def __init__(self, board_files_path, logger_handle, inventory=None, board_registry=None):
         """Object constructor"""
         self.logger = logger_handle
 
-        # A dictionary used to store the boards available for our tests
+        # The lab inventory and the compiled board files, shared with the board objects
+        self.inventory = inventory or BoardInventory.get_shared_inventory()
+        self.board_registry = board_registry or BoardProfile.get_shared_registry(board_files_path)
+
+        # A dictionary used to store the boards available for our tests. Each board name maps
+        # to a dictionary holding the indexed attributes and the allocation state.
         self.available_boards = {}
 
         # The absolute path to the folder containing all our board files.
@@ -19,12 +39,183 @@ class ResourcePool:
         # A vector to hold the board types we can work with
         self.board_types = []
 
-    def get_board_by_type(self, board_type):
-        print("Stub")
+        # attribute -> attribute value -> set of board names
+        self.indexes = dict((attribute, {}) for attribute in self.INDEXED_ATTRIBUTES)
 
-    def find_available_boards(self):
-        print("Stub")
+        # board type -> set of names of the boards that are not allocated
+        self.free_boards = {}
+
+        self.lock = threading.RLock()
+        # Notified whenever a board is put back into the pool
+        self.board_released = threading.Condition(self.lock)
 
     def find_board_types(self):
-        print("Stub")
+        """Reads the board files folder and returns the board types we can work with"""
+        board_types = self.board_registry.get_board_types()
+        with self.lock:
+            self.board_types = board_types
         self.logger.info("Done reading available board files")
+        return board_types
+
+    def find_available_boards(self):
+        """(Re)loads the pool. Board instances are listed in the "boards" section of each
+        board file, while their architecture, CPU and bootloader come from the inventory."""
+        board_list = []
+        for board_type, board_profile in self.board_registry.load_all().items():
+            for board_name in board_profile.boards:
+                board_list.append((board_name, board_type, board_profile))
+        self.find_board_types()
+
+        # Query the inventory for all the boards at once, instead of one after the other
+        board_records = {}
+        if board_list:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(16, len(board_list))) as executor:
+                record_futures = dict((executor.submit(self.inventory.get_board_record, board_name), board_name)
+                                      for (board_name, board_type, board_profile) in board_list)
+                for record_future in concurrent.futures.as_completed(record_futures):
+                    try:
+                        board_records[record_futures[record_future]] = record_future.result()
+                    except Exception as e:
+                        self.logger.warning("No inventory details for %s: %s" % (record_futures[record_future], e))
+
+        for (board_name, board_type, board_profile) in board_list:
+            self.add_board(board_name,
+                           board_type,
+                           has_ssh=board_profile.has_ssh,
+                           ipmi_managed=board_profile.ipmi_managed,
+                           board_record=board_records.get(board_name))
+
+        self.logger.info("%d boards available in the resource pool" % len(self.available_boards))
+        return self.available_boards
+
+    def add_board(self, board_name, board_type, has_ssh=False, ipmi_managed=False, board_record=None):
+        """Adds a board to the pool (or refreshes its attributes if it is already there)"""
+        board_entry = {
+            "board_type" : board_type,
+            "arch" : board_record.arch if board_record else None,
+            "cpu" : board_record.cpu if board_record else None,
+            "bootloader" : board_record.bootloader if board_record else None,
+            "has_ssh" : has_ssh,
+            "ipmi_managed" : ipmi_managed,
+            "allocated" : False
+            }
+
+        with self.lock:
+            if board_name in self.available_boards:
+                board_entry["allocated"] = self.available_boards[board_name]["allocated"]
+                self.remove_board(board_name)
+
+            self.available_boards[board_name] = board_entry
+            for attribute in self.INDEXED_ATTRIBUTES:
+                self.indexes[attribute].setdefault(board_entry[attribute], set()).add(board_name)
+            if board_type not in self.board_types:
+                self.board_types.append(board_type)
+            free_set = self.free_boards.setdefault(board_type, set())
+            if not board_entry["allocated"]:
+                free_set.add(board_name)
+
+    def remove_board(self, board_name):
+        """Takes a board out of the pool"""
+        with self.lock:
+            board_entry = self.available_boards.pop(board_name, None)
+            if board_entry is None:
+                return
+            for attribute in self.INDEXED_ATTRIBUTES:
+                self.indexes[attribute][board_entry[attribute]].discard(board_name)
+            self.free_boards[board_entry["board_type"]].discard(board_name)
+
+    def find_boards(self, free_only=False, **criteria):
+        """Returns the names of the boards matching all the given attribute values
+        (e.g. find_boards(arch="arm64", has_ssh=True))"""
+        with self.lock:
+            candidate_sets = [self.indexes[attribute].get(value, set()) for attribute, value in criteria.items()]
+            if free_only:
+                board_type = criteria.get("board_type")
+                if board_type is not None:
+                    candidate_sets.append(self.free_boards.get(board_type, set()))
+                else:
+                    candidate_sets.append(set().union(*self.free_boards.values()))
+            if not candidate_sets:
+                return set(self.available_boards)
+            # Start from the smallest set to keep the intersection cheap
+            candidate_sets.sort(key=len)
+            return candidate_sets[0].intersection(*candidate_sets[1:])
+
+    def allocate_boards(self, board_type, count=1, timeout=0, **criteria):
+        """Atomically allocates count free boards of the given type, optionally matching
+        additional attribute values. Either all the boards are allocated or none is, in
+        which case NoBoardAvailable is raised. Returns the list of board names."""
+        return self.allocate_nodes([board_type] * count, timeout, **criteria)
+
+    def _pick_free_boards(self, board_type_list, criteria):
+        """Returns one free board for each entry of board_type_list, or raises
+        NoBoardAvailable. Must be called with the lock held."""
+        allocated = []
+        for board_type in board_type_list:
+            if criteria:
+                candidates = self.find_boards(free_only=True, board_type=board_type, **criteria)
+            else:
+                candidates = self.free_boards.get(board_type, set())
+            candidates = candidates - set(allocated)
+            if not candidates:
+                raise Exceptions.NoBoardAvailable(board_type, board_type_list.count(board_type))
+            allocated.append(next(iter(candidates)))
+        return allocated
+
+    def check_pool_size(self, board_type_list, **criteria):
+        """Raises NoBoardAvailable if the pool does not hold enough boards (free or not) for
+        the request, which no amount of waiting would fix"""
+        with self.lock:
+            for board_type in set(board_type_list):
+                count = board_type_list.count(board_type)
+                if len(self.find_boards(board_type=board_type, **criteria)) < count:
+                    raise Exceptions.NoBoardAvailable(board_type, count,
+                                                      "The pool holds less than %d boards of type %s" % (count,
+                                                                                                         board_type))
+
+    def allocate_nodes(self, board_type_list, timeout=0, **criteria):
+        """Atomically allocates one free board for each entry of board_type_list (as used by
+        multinode jobs, where node types may differ). Returns the board names in the same
+        order as the requested types.
+        If the boards are busy, waits up to timeout seconds (None: no limit) for other jobs
+        to release them before raising NoBoardAvailable. Requests that the pool could never
+        serve fail right away."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.lock:
+            self.check_pool_size(board_type_list, **criteria)
+            while True:
+                try:
+                    allocated = self._pick_free_boards(board_type_list, criteria)
+                    break
+                except Exceptions.NoBoardAvailable:
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        raise
+                    self.board_released.wait(remaining)
+
+            for board_name in allocated:
+                board_entry = self.available_boards[board_name]
+                board_entry["allocated"] = True
+                self.free_boards[board_entry["board_type"]].discard(board_name)
+
+        self.logger.debug("Allocated boards: %s" % allocated)
+        return allocated
+
+    def release_board(self, board_name):
+        """Puts an allocated board back into the pool"""
+        with self.lock:
+            board_entry = self.available_boards.get(board_name)
+            if board_entry is None or not board_entry["allocated"]:
+                return
+            board_entry["allocated"] = False
+            self.free_boards[board_entry["board_type"]].add(board_name)
+            self.board_released.notify_all()
+        self.logger.debug("Released board %s" % board_name)
+
+    def get_board_info(self, board_name):
+        """Returns the (cached) inventory record of the given board"""
+        return self.inventory.get_board_record(board_name)
+
+    def get_board_by_type(self, board_type):
+        """Allocates a free board of the given type and returns its name"""
+        return self.allocate_boards(board_type)[0]
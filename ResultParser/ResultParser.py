@@ -1,35 +1,554 @@
 import sys
 import os
+import re
+import json
+import glob
+import time
+import fcntl
+import shutil
+import tempfile
+import itertools
+import collections
+import multiprocessing
+import concurrent.futures
+from xml.sax.saxutils import escape, quoteattr
+
+# A single test case result. status is one of PASS, FAIL or SKIP; duration (seconds) is
+# None when the format does not report it; output holds the lines printed before a
+# failure (or None).
+TestRecord = collections.namedtuple("TestRecord", ["suite", "name", "status", "duration", "output", "source", "line_number"])
+
+class ResultFormat:
+    """Describes a result file format: a precompiled pattern matching result lines, the
+    regex groups holding the test name and the status, and how the statuses of the format
+    map to PASS, FAIL and SKIP. Lines the pattern does not match are test output."""
+
+    def __init__(self, name, pattern, name_group, status_group, status_map=None, duration_group=None):
+        self.name = name
+        self.pattern = re.compile(pattern)
+        self.name_group = name_group
+        self.status_group = status_group
+        self.status_map = status_map or {}
+        self.duration_group = duration_group
+
+    def parse_line(self, line):
+        """Returns a (name, status, duration) tuple if the line holds a result, None otherwise"""
+        match = self.pattern.match(line)
+        if match is None:
+            return None
+        status = match.group(self.status_group)
+        status = self.status_map.get(status.upper(), status.upper())
+        if status not in ("PASS", "FAIL", "SKIP"):
+            return None
+        duration = None
+        if self.duration_group is not None and match.group(self.duration_group):
+            duration = float(match.group(self.duration_group))
+        return (match.group(self.name_group).strip(), status, duration)
+
+
+# Known formats, by name. Use register_format() to add more.
+FORMATS = collections.OrderedDict()
+
+def register_format(result_format):
+    FORMATS[result_format.name] = result_format
+
+# <test name>: <PASS|FAIL|SKIP> (the test name may contain colons)
+register_format(ResultFormat("colon", r"^\s*(.*\S)\s*:\s*(PASS|FAIL|SKIP)\s*$", 1, 2))
+
+class TapFormat(ResultFormat):
+    """Test Anything Protocol: "ok 1 - name", "not ok 2 name # SKIP reason". TODO tests
+    are known not to work yet: "not ok ... # TODO" is not a failure (reported as skipped)
+    and "ok ... # TODO" is a pass. Directives are case insensitive; anything else after the
+    hash is a comment."""
+
+    def __init__(self):
+        ResultFormat.__init__(self, "tap", r"^\s*(ok|not ok)\b\s*\d*\s*(?:-\s*)?([^#]*?)\s*(?:#\s*((?i:SKIP|TODO)\b)?.*)?$", 2, 1)
+
+    def parse_line(self, line):
+        match = self.pattern.match(line)
+        if match is None:
+            return None
+        (result, name, directive) = match.groups()
+        directive = (directive or "").upper()
+        if directive == "SKIP":
+            status = "SKIP"
+        elif directive == "TODO":
+            status = "PASS" if result == "ok" else "SKIP"
+        else:
+            status = "PASS" if result == "ok" else "FAIL"
+        return (name, status, None)
+
+register_format(TapFormat())
+
+# Yocto ptest (automake): "PASS: name", "XFAIL: name"...
+register_format(ResultFormat("ptest", r"^\s*(PASS|FAIL|SKIP|XFAIL|XPASS|ERROR|UNRESOLVED|UNTESTED|UNSUPPORTED):\s*(.+?)\s*$", 2, 1,
+                             {"XFAIL": "PASS", "XPASS": "FAIL", "ERROR": "FAIL",
+                              "UNRESOLVED": "SKIP", "UNTESTED": "SKIP", "UNSUPPORTED": "SKIP"}))
+
+# LTP result log (runltp -l): "<tag>   <PASS|FAIL|CONF>   <exit value>"
+register_format(ResultFormat("ltp", r"^\s*(\S+)\s+(PASS|FAIL|CONF|BROK|WARN)\s+-?\d+\s*$", 1, 2,
+                             {"CONF": "SKIP", "BROK": "FAIL", "WARN": "FAIL"}))
+
+# Number of lines looked at when guessing the format of a file
+DETECTION_LINES = 500
+
+# Number of output lines kept for a failed test case
+MAX_OUTPUT_LINES = 50
+
+# Jobs with fewer result files than this are parsed in the calling process; handing the
+# files to the worker processes would take longer than parsing them
+MIN_PARALLEL_FILES = 4
+
+def detect_format(lines):
+    """Returns the format matching the most of the given lines (None if none matches)"""
+    best_format, best_count = None, 0
+    for result_format in FORMATS.values():
+        count = sum(1 for line in lines if result_format.parse_line(line) is not None)
+        if count > best_count:
+            best_format, best_count = result_format, count
+    return best_format
+
+def get_format(format_name):
+    """Returns the format with the given name; None (automatic detection) if no name is given"""
+    if not format_name:
+        return None
+    if format_name not in FORMATS:
+        raise ValueError("Unknown result format: %s" % format_name)
+    return FORMATS[format_name]
+
+def parse_lines(lines, result_format=None, suite="", source=None):
+    """Generator turning lines of test output (a file, or the live output of a test) into
+    TestRecord objects, as the lines arrive. If no format is given, it is guessed from the
+    first lines. Only the output of the current test case is kept in memory."""
+    lines = iter(lines)
+    if result_format is None:
+        first_lines = list(itertools.islice(lines, DETECTION_LINES))
+        result_format = detect_format(first_lines)
+        if result_format is None:
+            return
+        lines = itertools.chain(first_lines, lines)
+
+    output = collections.deque(maxlen=MAX_OUTPUT_LINES)
+    for line_number, line in enumerate(lines, 1):
+        parsed = result_format.parse_line(line)
+        if parsed is None:
+            output.append(line)
+            continue
+        (name, status, duration) = parsed
+        yield TestRecord(suite, name, status, duration,
+                         "".join(output) if status == "FAIL" and output else None,
+                         source, line_number)
+        output.clear()
+
+def parse_file(file_path, result_format=None, suite=None):
+    """Generator returning the TestRecord objects of a result file"""
+    if suite is None:
+        suite = os.path.basename(file_path).replace("_test_result", "")
+    with open(file_path, "r", errors="replace") as result_file:
+        for test_record in parse_lines(result_file, result_format, suite, file_path):
+            yield test_record
+
+def get_line_parser(format_name=None):
+    """Returns a function parsing single lines of live test output into TestRecord objects
+    (or None). Without a format name, every known format is tried."""
+    result_formats = [get_format(format_name)] if format_name else list(FORMATS.values())
+    def parse_line(line):
+        for result_format in result_formats:
+            parsed = result_format.parse_line(line)
+            if parsed is not None:
+                return TestRecord("", parsed[0], parsed[1], parsed[2], None, None, None)
+        return None
+    return parse_line
+
+# Characters that are not allowed in XML 1.0 documents (test output may contain them)
+INVALID_XML_CHARACTERS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+# The report totals, as found on the second line of the reports written by JUnitWriter
+REPORT_TOTALS_PATTERN = re.compile(r'\b(tests|failures|skipped|time)="([0-9.]+)"')
+
+def xml_text(text):
+    return escape(INVALID_XML_CHARACTERS.sub("?", str(text)))
+
+def xml_attribute(text):
+    return quoteattr(INVALID_XML_CHARACTERS.sub("?", str(text)))
+
+def write_report(output_file, suites_name, totals, body_file):
+    """Writes a JUnit XML report: the header, a <testsuites> element holding the totals,
+    then the <testsuite> elements found in body_file. The report is written under a
+    temporary name and renamed into place."""
+    temp_file = "%s.%d.tmp" % (output_file, os.getpid())
+    with open(temp_file, "w") as report:
+        report.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        report.write('<testsuites name=%s tests="%d" failures="%d" skipped="%d" time="%.3f">\n' % (
+                            xml_attribute(suites_name), totals["tests"], totals["failures"],
+                            totals["skipped"], totals["time"]))
+        body_file.seek(0)
+        shutil.copyfileobj(body_file, report)
+        report.write('</testsuites>\n')
+    os.replace(temp_file, output_file)
+
+
+class JUnitWriter:
+    """Writes the JUnit XML report of a test suite as its records arrive. Test cases go to
+    a temporary spool file straight away; the counts (which must appear before the test
+    cases in the report) are kept as we go and the report is assembled when the writer is
+    closed. Memory use does not depend on the size of the suite."""
+
+    def __init__(self, output_file, suite_name, board=None, job_id=None):
+        """Object constructor"""
+        self.output_file = output_file
+        self.suite_name = suite_name
+        self.board = board
+        self.job_id = job_id
+        self.counts = collections.Counter()
+        self.time = 0.0
+        self.spool = tempfile.TemporaryFile(mode="w+", dir=os.path.dirname(os.path.abspath(output_file)))
+
+    def add_record(self, test_record):
+        """Writes the test case of a ResultParser.TestRecord"""
+        self.counts[test_record.status] += 1
+        duration = ""
+        if test_record.duration is not None:
+            self.time += test_record.duration
+            duration = ' time="%.3f"' % test_record.duration
+        self.spool.write('    <testcase classname=%s name=%s%s' % (xml_attribute(self.suite_name),
+                                                                   xml_attribute(test_record.name),
+                                                                   duration))
+        if test_record.status == "FAIL":
+            if test_record.output:
+                self.spool.write('>\n      <failure message="failed">%s</failure>\n    </testcase>\n'
+                                 % xml_text(test_record.output))
+            else:
+                self.spool.write('>\n      <failure message="failed"/>\n    </testcase>\n')
+        elif test_record.status == "SKIP":
+            self.spool.write('>\n      <skipped/>\n    </testcase>\n')
+        else:
+            self.spool.write('/>\n')
+
+    def close(self, duration=None):
+        """Writes the report and returns the totals. duration (seconds) is the run time of
+        the whole suite; by default, the sum of the test case durations."""
+        totals = {"tests": sum(self.counts.values()),
+                  "failures": self.counts["FAIL"],
+                  "skipped": self.counts["SKIP"],
+                  "time": self.time if duration is None else duration}
+
+        # The <testsuite> element goes to a second spool, so that the report is assembled
+        # the same way aggregated reports are
+        with tempfile.TemporaryFile(mode="w+", dir=os.path.dirname(os.path.abspath(self.output_file))) as body:
+            body.write('  <testsuite name=%s tests="%d" failures="%d" skipped="%d" time="%.3f" timestamp=%s' % (
+                            xml_attribute(self.suite_name), totals["tests"], totals["failures"],
+                            totals["skipped"], totals["time"],
+                            xml_attribute(time.strftime("%Y-%m-%dT%H:%M:%S"))))
+            if self.board:
+                body.write(' hostname=%s' % xml_attribute(self.board))
+            body.write('>\n')
+            properties = [("board", self.board), ("job_id", self.job_id)]
+            if any(value is not None for (name, value) in properties):
+                body.write('    <properties>\n')
+                for (name, value) in properties:
+                    if value is not None:
+                        body.write('      <property name="%s" value=%s/>\n' % (name, xml_attribute(value)))
+                body.write('    </properties>\n')
+            self.spool.seek(0)
+            shutil.copyfileobj(self.spool, body)
+            body.write('  </testsuite>\n')
+            write_report(self.output_file, self.suite_name, totals, body)
+        self.spool.close()
+        return totals
+
+
+def merge_reports(report_files, output_file, suites_name, totals=None):
+    """Merges reports written by JUnitWriter (or by an earlier merge) into a single report,
+    reading each of them once. The test suites are copied as they are. The totals of the
+    merged report are given by the caller when known; otherwise, the totals of each report
+    (on its second line) are parsed."""
+    parse_totals = totals is None
+    if parse_totals:
+        totals = {"tests": 0, "failures": 0, "skipped": 0, "time": 0.0}
+    with tempfile.TemporaryFile(mode="w+", dir=os.path.dirname(os.path.abspath(output_file))) as body:
+        for report_file in report_files:
+            with open(report_file) as report:
+                # Skip the XML header
+                report.readline()
+                totals_line = report.readline()
+                if parse_totals:
+                    for (name, value) in REPORT_TOTALS_PATTERN.findall(totals_line):
+                        totals[name] += float(value)
+                # Everything up to the closing </testsuites> line
+                previous_line = None
+                for line in report:
+                    if previous_line is not None:
+                        body.write(previous_line)
+                    previous_line = line
+        write_report(output_file, suites_name, totals, body)
+    return totals
+
+def add_totals(totals, more_totals):
+    """Adds report totals (as returned by JUnitWriter.close) to another set of totals"""
+    for name in ("tests", "failures", "skipped", "time"):
+        totals[name] = totals.get(name, 0) + more_totals.get(name, 0)
+    return totals
+
+def get_nightly_paths(nightly_dir, day):
+    """Returns the paths of the nightly report of a day (YYYY_MM_DD): the report, the
+    folder holding the reports of the jobs of the day, the totals file and the lock file"""
+    nightly_name = "nightly_%s" % day
+    base_path = os.path.join(nightly_dir, nightly_name)
+    return (base_path + ".xml", base_path, base_path + ".json", base_path + ".lock")
+
+def merge_nightly_report(nightly_dir, day):
+    """Writes the nightly report of a day out of the job reports added to it (see
+    ResultParser.add_to_nightly_report), reading each of them once. The totals come from the
+    totals file kept next to the job reports. Nothing is written if the report is up to
+    date. Returns the totals."""
+    (nightly_file, parts_dir, totals_file, lock_path) = get_nightly_paths(nightly_dir, day)
+    with open(lock_path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            with open(totals_file) as totals_stream:
+                nightly_state = json.load(totals_stream)
+            if nightly_state.get("merged") and os.path.exists(nightly_file):
+                return nightly_state["totals"]
+            totals = merge_reports([os.path.join(parts_dir, part) for part in nightly_state["parts"]],
+                                   nightly_file, "nightly_%s" % day, dict(nightly_state["totals"]))
+            nightly_state["merged"] = True
+            write_json(totals_file, nightly_state)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return totals
+
+def get_unmerged_days(nightly_dir):
+    """Returns the days of the nightly reports having job reports that are not merged
+    yet"""
+    unmerged_days = []
+    for totals_file in sorted(glob.glob(os.path.join(nightly_dir, "nightly_*.json"))):
+        try:
+            with open(totals_file) as totals_stream:
+                nightly_state = json.load(totals_stream)
+        except (IOError, OSError, ValueError):
+            continue
+        if not nightly_state.get("merged"):
+            unmerged_days.append(os.path.basename(totals_file)[len("nightly_"):-len(".json")])
+    return unmerged_days
+
+def finalize_nightly_reports(nightly_dir, today=None):
+    """Writes the nightly reports of the days that are over (before today, YYYY_MM_DD) and
+    not merged yet. Meant to run once in a while outside of the jobs: the daemon does it
+    periodically, and run-damf.py --finalize-nightly does it on demand (e.g. from cron).
+    Returns a dictionary mapping each day written to its totals."""
+    today = today or time.strftime("%Y_%m_%d")
+    return dict((day, merge_nightly_report(nightly_dir, day))
+                for day in get_unmerged_days(nightly_dir) if day < today)
+
+def write_json(file_path, data):
+    """Writes a JSON file under a temporary name, then renames it into place"""
+    temp_file = "%s.%d.tmp" % (file_path, os.getpid())
+    with open(temp_file, "w") as json_file:
+        json.dump(data, json_file)
+    os.replace(temp_file, file_path)
+
+def process_result_file(result_file, suite_name, output_path, format_name=None, board=None, job_id=None, duration=None,
+                        board_type=None, store_results=False, database_uri=None):
+    """Parses one result file and writes its JUnit XML report, record by record. With
+    store_results, the records are also bulk-inserted into the results database (the one of
+    the web application unless database_uri is given). Runs in the worker processes of
+    ResultParser.process_test_results. Returns a (suite name, counts per status, report
+    file, report totals) tuple."""
+    report_file = os.path.join(output_path, "%s.xml" % suite_name)
+    junit_writer = JUnitWriter(report_file, suite_name, board, job_id)
+
+    def write_records():
+        for test_record in parse_file(result_file, get_format(format_name), suite_name):
+            junit_writer.add_record(test_record)
+            yield test_record
+
+    if store_results:
+        # The results database is part of the web application, which the framework does not
+        # need otherwise
+        from app import results
+        result_store = results.ResultStore(database_uri)
+        try:
+            result_store.add_records(write_records(), job_id, board, board_type)
+        finally:
+            result_store.close()
+    else:
+        for test_record in write_records():
+            pass
+    totals = junit_writer.close(duration)
+    return (suite_name, dict(junit_writer.counts), report_file, totals)
+
+def get_worker_context():
+    """Returns the multiprocessing context the parsing worker processes are started with:
+    a fork server (with this module already imported), or spawn where there is none"""
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    worker_context = multiprocessing.get_context("forkserver")
+    worker_context.set_forkserver_preload([__name__])
+    return worker_context
+
+def create_worker_pool(workers=None):
+    """Returns a pool of result parsing processes. Starting the workers costs more than
+    parsing a few files, so the pool is meant to be created once and shared by all the jobs
+    (see ResultParser); the workers only start when the pool is first used.
+    The framework runs jobs on several threads: forking one of them could leave the worker
+    processes with locks (logging, sqlite) held by the other threads, so the workers are
+    started from a fork server instead."""
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=get_worker_context())
+
 
 class ResultParser:
     """Used for processing and exporting test results into various formats"""
-    def __init__(self, result_file_path, report_output_path):
-        """Object constructor"""
+    def __init__(self, result_file_path, report_output_path, logger_handle=None, result_format=None, workers=None,
+                 job_id=None, boards=None, durations=None, nightly_dir=None, board_types=None, store_results=False,
+                 database_uri=None, worker_pool=None):
+        """Object constructor. result_format is the name of the result file format (guessed
+        for each file if not given). The result files are parsed by worker_pool (see
+        create_worker_pool); without one, a pool of workers processes is started for the
+        job.
+        The reports mention the job ID and the board each suite ran on (boards maps the node
+        roles to board names) along with the suite durations (by suite name). If nightly_dir
+        is given, the suites are also added to the aggregate report of the day there.
+        With store_results, every test case result is also stored in the results database
+        (see app/results.py), along with the board type (board_types maps the node roles to
+        board types)."""
         self.result_file_path = result_file_path
         self.output_location = report_output_path
-        #self.logger = logger_handle
+        self.logger = logger_handle
+        self.result_format = result_format
+        self.workers = workers
+        self.job_id = job_id
+        self.boards = boards or {}
+        self.durations = durations or {}
+        self.nightly_dir = nightly_dir
+        self.board_types = board_types or {}
+        self.store_results = store_results
+        self.database_uri = database_uri
+        self.worker_pool = worker_pool
+
+    def find_result_files(self):
+        """Returns the (result file path, suite name, role) tuples found in the results folder.
+        Result files of the master board are stored directly in the results folder, while
+        other nodes of a multinode job get a sub-folder named after their role (which
+        becomes the suite name prefix)."""
+        result_files = []
+        for entry in sorted(os.listdir(self.result_file_path)):
+            entry_path = os.path.join(self.result_file_path, entry)
+            if os.path.isdir(entry_path):
+                for result_file in sorted(os.listdir(entry_path)):
+                    if result_file.endswith("_test_result"):
+                        result_files.append((os.path.join(entry_path, result_file),
+                                             "%s.%s" % (entry, result_file.replace("_test_result", "")),
+                                             entry))
+            elif entry.endswith("_test_result"):
+                result_files.append((entry_path, entry.replace("_test_result", ""), "master"))
+        return result_files
 
     def process_test_results(self):
-        """The main method dealing with result files parsing."""
-        # TODO: First parse the test results directory contents, then begin parsing
-        # each individual file
-        print("Stub")
+        """The main method dealing with result files parsing. The result files are parsed in
+        parallel by the worker processes (or right here, if there are only a few of them),
+        each file writing its own report. The suite reports are then merged into the job
+        report (and into the nightly report, if enabled). Returns a dictionary mapping each
+        suite name to its counts per status."""
+        result_files = self.find_result_files()
+        suite_counts = {}
+        report_files = {}
+        job_totals = {"tests": 0, "failures": 0, "skipped": 0, "time": 0.0}
+        if not result_files:
+            return suite_counts
+
+        file_arguments = [(result_file, (result_file, suite_name, self.output_location, self.result_format,
+                                         self.boards.get(role), self.job_id, self.durations.get(suite_name),
+                                         self.board_types.get(role), self.store_results, self.database_uri))
+                          for (result_file, suite_name, role) in result_files]
+
+        def add_suite(result_file, get_result):
+            try:
+                (suite_name, counts, report_file, suite_totals) = get_result()
+            except Exception as e:
+                if self.logger:
+                    self.logger.error("Could not process %s: %s" % (result_file, e))
+                return
+            suite_counts[suite_name] = counts
+            report_files[suite_name] = report_file
+            add_totals(job_totals, suite_totals)
+            if self.logger:
+                self.logger.info("Processed result file %s: %s" % (result_file, counts))
+
+        if len(file_arguments) < MIN_PARALLEL_FILES:
+            for (result_file, arguments) in file_arguments:
+                add_suite(result_file, lambda: process_result_file(*arguments))
+        else:
+            worker_pool = self.worker_pool or create_worker_pool(self.workers)
+            try:
+                result_futures = dict((worker_pool.submit(process_result_file, *arguments), result_file)
+                                      for (result_file, arguments) in file_arguments)
+                for result_future in concurrent.futures.as_completed(result_futures):
+                    add_suite(result_futures[result_future], result_future.result)
+            finally:
+                if worker_pool is not self.worker_pool:
+                    worker_pool.shutdown()
+
+        suite_reports = [report_files[suite_name] for suite_name in sorted(report_files)]
+        self.write_job_report(suite_reports, job_totals)
+        if self.nightly_dir:
+            self.add_to_nightly_report(job_totals)
+        return suite_counts
+
+    def get_job_report_file(self):
+        return os.path.join(self.output_location, "job_%s.xml" % (self.job_id if self.job_id is not None else "results"))
+
+    def write_job_report(self, suite_reports, totals=None):
+        """Merges the suite reports of the job into a single report. totals is the sum of
+        the suite totals (parsed from the suite reports if not given)."""
+        job_name = "job_%s" % self.job_id if self.job_id is not None else "results"
+        totals = merge_reports(suite_reports, self.get_job_report_file(), job_name, totals)
+        if self.logger:
+            self.logger.info("Job report written to %s: %s" % (self.get_job_report_file(), totals))
+        return totals
+
+    def add_to_nightly_report(self, job_totals, day=None):
+        """Adds the job report to the aggregate report of the day. The job report is copied
+        next to those of the other jobs of the day and the totals of the day are updated in
+        a small JSON file, so adding a job does not depend on how many jobs ran before it.
+        The nightly report itself is written once the day is over, outside of the jobs (see
+        finalize_nightly_reports); merge_nightly_report writes it any time on demand.
+        Several jobs may finish at the same time, so the totals file is locked while it is
+        updated."""
+        day = day or time.strftime("%Y_%m_%d")
+        (nightly_file, parts_dir, totals_file, lock_path) = get_nightly_paths(self.nightly_dir, day)
+        if not os.path.exists(parts_dir):
+            os.makedirs(parts_dir, exist_ok=True)
+
+        # Several jobs may share the same ID (e.g. queue files of different hosts)
+        part_name = "%s_%d_%d.xml" % (os.path.splitext(os.path.basename(self.get_job_report_file()))[0],
+                                      os.getpid(), int(time.time() * 1000000))
+        temp_file = os.path.join(parts_dir, part_name + ".tmp")
+        shutil.copyfile(self.get_job_report_file(), temp_file)
+        os.replace(temp_file, os.path.join(parts_dir, part_name))
+
+        with open(lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                nightly_state = {"totals": {"tests": 0, "failures": 0, "skipped": 0, "time": 0.0}, "parts": []}
+                if os.path.exists(totals_file):
+                    with open(totals_file) as totals_stream:
+                        nightly_state = json.load(totals_stream)
+                add_totals(nightly_state["totals"], job_totals)
+                nightly_state["parts"].append(part_name)
+                nightly_state["merged"] = False
+                write_json(totals_file, nightly_state)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        if self.logger:
+            self.logger.info("Job report added to the nightly report of %s: %s" % (day, nightly_state["totals"]))
+        return nightly_state["totals"]
 
     def write_junit_xml(self, test_results, test_suite_name):
         """Used to export the test results gathered during the test run, in
-        JUnit XML format"""
-        xml_output = ""
-        xml_output += '<?xml version="  1.0" encoding="UTF-8"?>'
-        xml_output += '<testsuites>'
-        xml_output += '<testsuite name="{0}">'.format(test_suite_name)
+        JUnit XML format. test_results maps the test names to their status."""
+        junit_writer = JUnitWriter("{0}/{1}.xml".format(self.output_location, test_suite_name), test_suite_name,
+                                   job_id=self.job_id)
         for test_name, test_result in test_results.items():
-            xml_output += '<testcase name="{0}">'.format(test_name)
-            if test_result == 'FAIL':
-                xml_output += '<failure/>'
-            elif test_result == 'SKIP':
-                xml_output += '<skipped/>'
-            xml_output += '</testcase>'
-        xml_output += '</testsuite>'
-        xml_output += '</testsuites>'
-        with open("{0}/{1}.xml".format(self.output_location, test_suite_name), "w") as f:
-            f.write(xml_output)
\ No newline at end of file
+            junit_writer.add_record(TestRecord(test_suite_name, test_name, test_result, None, None, None, None))
+        return junit_writer.close()
@@ -0,0 +1,239 @@
+import os
+import gzip
+import shutil
+import tarfile
+import tempfile
+import threading
+import subprocess
+
+class SSHSession:
+    """A persistent SSH connection to a board. The system ssh client opens a single master
+    connection (ControlMaster) and every command or file transfer of the job goes through
+    it, so the handshake is only paid once per board. Multiplexing is done entirely on the
+    client side, which is why this also works with boards running Dropbear (the Paramiko
+    library does not, see DeviceManager.deploy_tests)."""
+
+    def __init__(self, host, control_dir, user="root", persist=600, ssh_options=None, logger_handle=None):
+        """Object constructor. Nothing is opened until the first command"""
+        self.host = host
+        self.user = user
+        self.logger = logger_handle
+        self.target = "%s@%s" % (user, host)
+
+        # Boards get reflashed all the time, so their host keys are never checked or stored
+        self.ssh_options = ["-o", "StrictHostKeyChecking=no",
+                            "-o", "UserKnownHostsFile=/dev/null",
+                            "-o", "LogLevel=ERROR",
+                            "-o", "ControlMaster=auto",
+                            "-o", "ControlPath=%s/%%r@%%h:%%p" % control_dir,
+                            "-o", "ControlPersist=%d" % persist]
+        for ssh_option in (ssh_options or []):
+            self.ssh_options.extend(["-o", ssh_option])
+
+    def _log_debug(self, message):
+        if self.logger:
+            self.logger.debug(message)
+
+    def ssh_command(self, remote_command):
+        """Returns the argument list running remote_command on the board"""
+        return ["ssh"] + self.ssh_options + [self.target, remote_command]
+
+    def connect(self, timeout=60):
+        """Opens the master connection (if not already open). Returns True on success"""
+        return self.run("true", timeout=timeout)[0] == 0
+
+    def is_connected(self):
+        """Checks whether the master connection is up"""
+        check_command = ["ssh"] + self.ssh_options + ["-O", "check", self.target]
+        return subprocess.run(check_command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+
+    def run(self, remote_command, timeout=None, input_data=None):
+        """Runs a command on the board and returns an (exit code, output) tuple. stderr
+        is merged into the output."""
+        self._log_debug("[%s] %s" % (self.host, remote_command))
+        try:
+            result = subprocess.run(self.ssh_command(remote_command),
+                                    input=input_data,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT,
+                                    stdin=None if input_data is not None else subprocess.DEVNULL,
+                                    timeout=timeout)
+        except subprocess.TimeoutExpired as e:
+            return (-1, (e.output or b"").decode("utf-8", "replace"))
+        return (result.returncode, result.stdout.decode("utf-8", "replace"))
+
+    def popen(self, remote_command, **popen_args):
+        """Starts a command on the board and returns the Popen object (for streaming)"""
+        self._log_debug("[%s] %s" % (self.host, remote_command))
+        return subprocess.Popen(self.ssh_command(remote_command), **popen_args)
+
+    @staticmethod
+    def drain(stream):
+        """Reads a stream of a running command to the end in a background thread, so that the
+        command never blocks on a full pipe while we are busy with its other streams.
+        Returns the thread; its output attribute holds the data once it is joined."""
+        def read_all():
+            drain_thread.output = stream.read()
+            stream.close()
+        drain_thread = threading.Thread(target=read_all, name="damf-ssh-drain")
+        drain_thread.daemon = True
+        drain_thread.output = b""
+        drain_thread.start()
+        return drain_thread
+
+    def put_file(self, local_path, remote_path, mode=None):
+        """Copies a single file to the board, over the shared connection"""
+        remote_command = "cat > '%s'" % remote_path
+        if mode is not None:
+            remote_command += " && chmod %o '%s'" % (mode, remote_path)
+        with open(local_path, "rb") as local_file:
+            self._log_debug("[%s] upload %s -> %s" % (self.host, local_path, remote_path))
+            result = subprocess.run(self.ssh_command(remote_command), stdin=local_file,
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        return (result.returncode, result.stdout.decode("utf-8", "replace"))
+
+    def get_file(self, remote_path, local_path, compress=False):
+        """Copies a single file from the board, over the shared connection. The file is
+        downloaded next to local_path and only renamed into place once complete, so readers
+        never see a partial file. With compress, the board gzips the file on the fly."""
+        self._log_debug("[%s] download %s -> %s" % (self.host, remote_path, local_path))
+        temp_path = "%s.%d.part" % (local_path, threading.get_ident())
+        remote_command = ("gzip -1 -c '%s'" if compress else "cat '%s'") % remote_path
+        download = self.popen(remote_command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE)
+        error_reader = self.drain(download.stderr)
+        exit_code = None
+        try:
+            with open(temp_path, "wb") as local_file:
+                stream = gzip.GzipFile(fileobj=download.stdout, mode="rb") if compress else download.stdout
+                shutil.copyfileobj(stream, local_file)
+        except (OSError, EOFError) as e:
+            # Truncated or invalid gzip stream
+            self._log_debug("[%s] download of %s failed: %s" % (self.host, remote_path, e))
+            download.stdout.read()
+            exit_code = -1
+        download.wait()
+        error_reader.join()
+        error_output = error_reader.output
+        if exit_code is None:
+            exit_code = download.returncode
+        if exit_code == 0:
+            os.replace(temp_path, local_path)
+        else:
+            os.remove(temp_path)
+        return (exit_code, error_output.decode("utf-8", "replace"))
+
+    def scp(self, sources, destination, recursive=False):
+        """Runs scp over the shared connection. Remote paths are given as :<path>"""
+        scp_command = ["scp"] + self.ssh_options
+        if recursive:
+            scp_command.append("-r")
+        scp_command.extend(self.target + path if path.startswith(":") else path for path in sources)
+        scp_command.append(self.target + destination if destination.startswith(":") else destination)
+        self._log_debug("[%s] %s" % (self.host, " ".join(scp_command)))
+        result = subprocess.run(scp_command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        return (result.returncode, result.stdout.decode("utf-8", "replace"))
+
+    def put_archive(self, entries, executables=(), exclude_names=(), compress=True, file_mode=0o644, dir_mode=0o755):
+        """Copies files and folders to the board as a single tar stream, unpacked on the fly
+        by the board's tar. entries is a list of (local path, absolute remote path) pairs.
+        Ownership and permissions are set inside the archive (files get file_mode, folders
+        dir_mode, the remote paths listed in executables get 0755), so no chmod is needed
+        afterwards. Files or folders named as in exclude_names (e.g. .git) are skipped.
+        Returns an (exit code, output) tuple."""
+        executables = set(remote_path.lstrip("/") for remote_path in executables)
+        exclude_names = set(exclude_names)
+
+        def set_attributes(tarinfo):
+            if os.path.basename(tarinfo.name) in exclude_names:
+                return None
+            tarinfo.uid = tarinfo.gid = 0
+            tarinfo.uname = tarinfo.gname = "root"
+            if tarinfo.isdir():
+                tarinfo.mode = dir_mode
+            elif tarinfo.name in executables:
+                tarinfo.mode = 0o755
+            else:
+                tarinfo.mode = file_mode
+            return tarinfo
+
+        tar_process = self.popen("tar -x%sf - -C /" % ("z" if compress else ""),
+                                 stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        # The remote tar may complain about every entry; its output is collected while the
+        # archive is being written
+        output_reader = self.drain(tar_process.stdout)
+        self._log_debug("[%s] upload archive: %s" % (self.host, entries))
+        try:
+            # Fast compression: the point is to cut the transfer time, not the archive size
+            stream = gzip.GzipFile(fileobj=tar_process.stdin, mode="wb", compresslevel=1) if compress else tar_process.stdin
+            with tarfile.open(fileobj=stream, mode="w|") as archive:
+                for (local_path, remote_path) in entries:
+                    archive.add(local_path, arcname=remote_path.strip("/"), filter=set_attributes)
+            if compress:
+                stream.close()
+            tar_process.stdin.close()
+        except BrokenPipeError:
+            # The remote tar went away; its output tells why
+            pass
+        tar_process.wait()
+        output_reader.join()
+        return (tar_process.returncode, output_reader.output.decode("utf-8", "replace"))
+
+    def close(self):
+        """Closes the master connection"""
+        exit_command = ["ssh"] + self.ssh_options + ["-O", "exit", self.target]
+        subprocess.run(exit_command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class SSHPool:
+    """Keeps one SSHSession per board for the whole duration of a job, so that deployment,
+    test runs and result fetching all share the same connection."""
+
+    def __init__(self, logger_handle=None, user="root", persist=600, ssh_options=None):
+        """Object constructor"""
+        self.logger = logger_handle
+        self.user = user
+        self.persist = persist
+        self.ssh_options = ssh_options
+
+        # Unix socket paths are limited in length, so keep the control sockets in a short,
+        # private temporary folder
+        self.control_dir = tempfile.mkdtemp(prefix="damf-ssh-")
+
+        # host -> SSHSession
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get_session(self, host):
+        """Returns the session of the given board, creating it if needed"""
+        with self.lock:
+            if host not in self.sessions:
+                self.sessions[host] = SSHSession(host, self.control_dir, self.user, self.persist,
+                                                 self.ssh_options, self.logger)
+            return self.sessions[host]
+
+    def close_session(self, host):
+        with self.lock:
+            ssh_session = self.sessions.pop(host, None)
+        if ssh_session is not None:
+            ssh_session.close()
+
+    def close_all(self):
+        with self.lock:
+            hosts = list(self.sessions)
+        for host in hosts:
+            self.close_session(host)
+        shutil.rmtree(self.control_dir, ignore_errors=True)
+
+
+# The pool shared by all the components of this process
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+def get_shared_pool():
+    """Returns the process-wide SSHPool instance, creating it if needed"""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = SSHPool()
+        return _shared_pool
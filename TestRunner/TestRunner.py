@@ -0,0 +1,115 @@
+import os
+import time
+import signal
+import threading
+import subprocess
+import concurrent.futures
+from collections import namedtuple
+from ResultParser import ResultParser
+
+# Outcome of a single test. exit_code is None if the test never started (job deadline
+# reached); results maps the test cases reported in the output to their status.
+TestRun = namedtuple("TestRun", ["test", "exit_code", "duration", "timed_out", "log_file", "results"])
+
+
+class TestRunner:
+    """Runs the tests of a board, up to max_parallel at a time. The output of each test is
+    streamed line by line into its own log file (nothing is kept in memory) and parsed as it
+    arrives. A test is killed once it runs for longer than test_timeout seconds or once the
+    job deadline (an absolute time) is reached; tests that did not start before the
+    deadline are not started at all. line_parser turns an output line into a
+    ResultParser.TestRecord (or None); by default, all the known result formats are tried."""
+
+    # Extra time given to a command that enforces its own timeout (e.g. with the timeout
+    # utility on the board) before the local process is killed
+    KILL_GRACE = 10
+
+    def __init__(self, logger_handle=None, max_parallel=1, test_timeout=None, deadline=None, line_parser=None):
+        """Object constructor"""
+        self.logger = logger_handle
+        self.max_parallel = max(1, max_parallel)
+        self.test_timeout = test_timeout
+        self.deadline = deadline
+        self.line_parser = line_parser or ResultParser.get_line_parser()
+
+    def _log(self, level, message):
+        if self.logger:
+            getattr(self.logger, level)(message)
+
+    def get_timeout(self):
+        """Returns the time a test starting now is allowed to run (None means no limit)"""
+        timeouts = []
+        if self.test_timeout:
+            timeouts.append(self.test_timeout)
+        if self.deadline is not None:
+            timeouts.append(max(0, self.deadline - time.time()))
+        return min(timeouts) if timeouts else None
+
+    def run(self, tests, command_factory, log_dir, on_complete=None):
+        """Runs all the tests and returns their TestRun results, in the order of tests.
+        command_factory(test, timeout) returns the argument list running a test; timeout is
+        the number of seconds the test may take (or None), for commands able to enforce it
+        themselves. on_complete(test_run) is called as soon as each test is over."""
+        def run_and_report(test):
+            test_run = self.run_test(test, command_factory, log_dir)
+            if on_complete is not None:
+                on_complete(test_run)
+            return test_run
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_parallel) as executor:
+            return list(executor.map(run_and_report, tests))
+
+    def run_test(self, test, command_factory, log_dir):
+        log_file_path = os.path.join(log_dir, "%s.log" % test)
+        timeout = self.get_timeout()
+        if timeout is not None and timeout <= 0:
+            self._log("error", "Job deadline reached, not running %s" % test)
+            return TestRun(test, None, 0, True, None, {})
+
+        command = command_factory(test, None if timeout is None else int(timeout) + 1)
+        self._log("info", "Running test %s..." % test)
+        self._log("debug", "Test command: %s" % command)
+
+        results = {}
+        timed_out = threading.Event()
+        start_time = time.time()
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, start_new_session=True)
+
+        def kill_test():
+            timed_out.set()
+            self._log("error", "Test %s timed out after %ds, killing it" % (test, timeout))
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+        watchdog = None
+        if timeout is not None:
+            watchdog = threading.Timer(timeout + self.KILL_GRACE, kill_test)
+            watchdog.daemon = True
+            watchdog.start()
+
+        try:
+            with open(log_file_path, "w") as log_file:
+                for raw_line in process.stdout:
+                    line = raw_line.decode("utf-8", "replace")
+                    log_file.write(line)
+                    log_file.flush()
+                    test_record = self.line_parser(line)
+                    if test_record is not None:
+                        results[test_record.name] = test_record.status
+            exit_code = process.wait()
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+
+        # A command enforcing the timeout itself stops the test before the watchdog does
+        duration = time.time() - start_time
+        test_run = TestRun(test, exit_code, duration,
+                           timed_out.is_set() or (timeout is not None and duration >= timeout),
+                           log_file_path, results)
+        self._log("info", "Test %s finished: exit code %d, %.1fs, %d test cases%s" % (
+                                test, exit_code, test_run.duration, len(results),
+                                " (timed out)" if test_run.timed_out else ""))
+        return test_run
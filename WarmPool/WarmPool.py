@@ -0,0 +1,113 @@
+import time
+import json
+import threading
+
+class WarmBoard:
+    """A board that is still booted (and reserved) after its last job"""
+
+    def __init__(self, board_object, boot_signature):
+        self.board_object = board_object
+        self.boot_signature = boot_signature
+        self.idle_since = time.time()
+
+    def get_board_name(self):
+        return self.board_object.get_board_name()
+
+    def get_board_type(self):
+        return self.board_object.get_board_type()
+
+
+class WarmPool:
+    """Keeps boards booted between jobs. Once a job is done, its boards can be parked here
+    along with the signature of their boot configuration (board type, boot method, kernel,
+    dtb, rootfs...). A later job with the same signature takes a parked board over and goes
+    straight to deployment, skipping power on and boot. Boards that stay idle for longer
+    than idle_window seconds are handed to release_handler (which powers them off and
+    gives them back to the resource pool)."""
+
+    def __init__(self, release_handler, logger_handle=None, idle_window=600):
+        """Object constructor. Starts the thread releasing the idle boards"""
+        self.release_handler = release_handler
+        self.logger = logger_handle
+        self.idle_window = idle_window
+
+        # board name -> WarmBoard
+        self.boards = {}
+        self.lock = threading.Lock()
+
+        self.stop_event = threading.Event()
+        self.reaper_thread = threading.Thread(target=self._reaper_loop, name="damf-warm-pool")
+        self.reaper_thread.daemon = True
+        self.reaper_thread.start()
+
+    def _log_info(self, message):
+        if self.logger:
+            self.logger.info(message)
+
+    @staticmethod
+    def get_boot_signature(board_type, boot_method, node_config):
+        """Returns the signature of a boot configuration. Boards booted with the same
+        signature run the same image the same way."""
+        return (board_type, boot_method, json.dumps(node_config, sort_keys=True, default=str))
+
+    def park(self, board_object, boot_signature):
+        """Keeps a booted board for a later compatible job"""
+        with self.lock:
+            self.boards[board_object.get_board_name()] = WarmBoard(board_object, boot_signature)
+        self._log_info("%s parked in the warm pool" % board_object.get_board_name())
+
+    def acquire(self, boot_signature):
+        """Takes a parked board booted with the given signature out of the pool. Returns the
+        WarmBoard, or None if there is no such board."""
+        with self.lock:
+            for board_name, warm_board in self.boards.items():
+                if warm_board.boot_signature == boot_signature:
+                    del self.boards[board_name]
+                    self._log_info("Reusing %s from the warm pool" % board_name)
+                    return warm_board
+        return None
+
+    def evict(self, board_type):
+        """Releases the board of the given type that has been idle the longest, to make
+        room for a job that needs a different boot configuration. Returns True if a board
+        was released."""
+        with self.lock:
+            candidates = [warm_board for warm_board in self.boards.values() if warm_board.get_board_type() == board_type]
+            if not candidates:
+                return False
+            warm_board = min(candidates, key=lambda candidate: candidate.idle_since)
+            del self.boards[warm_board.get_board_name()]
+        self._release(warm_board)
+        return True
+
+    def _release(self, warm_board):
+        self._log_info("Releasing %s from the warm pool" % warm_board.get_board_name())
+        try:
+            self.release_handler(warm_board.board_object)
+        except Exception as e:
+            if self.logger:
+                self.logger.error("Could not release %s: %s" % (warm_board.get_board_name(), e))
+
+    def release_idle(self):
+        """Releases the boards that have been idle for longer than the idle window"""
+        deadline = time.time() - self.idle_window
+        with self.lock:
+            idle_boards = [warm_board for warm_board in self.boards.values() if warm_board.idle_since < deadline]
+            for warm_board in idle_boards:
+                del self.boards[warm_board.get_board_name()]
+        for warm_board in idle_boards:
+            self._release(warm_board)
+
+    def _reaper_loop(self):
+        while not self.stop_event.wait(min(30, self.idle_window)):
+            self.release_idle()
+
+    def close(self):
+        """Stops the reaper thread and releases all the parked boards"""
+        self.stop_event.set()
+        self.reaper_thread.join()
+        with self.lock:
+            warm_boards = list(self.boards.values())
+            self.boards.clear()
+        for warm_board in warm_boards:
+            self._release(warm_board)
@@ -0,0 +1,48 @@
+import yaml
+from flask import jsonify, request, abort, current_app
+from app import app
+
+# The JSON API used for submitting jobs to a DAMF daemon (run-damf.py --daemon). The daemon
+# keeps a single DeviceManager around (resource pool, board files, inventory, job queue)
+# and hands it to the application as app.config['DEVICE_MANAGER'].
+
+def get_device_manager():
+    device_manager = current_app.config.get('DEVICE_MANAGER')
+    if device_manager is None:
+        abort(503, description="No DAMF daemon is attached to this application")
+    return device_manager
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Queues a test request, given as JSON or YAML, and returns the ID of the new job"""
+    if request.is_json:
+        request_data = request.get_json()
+    else:
+        request_data = yaml.safe_load(request.get_data(as_text=True))
+    if not isinstance(request_data, dict):
+        abort(400, description="The test request must be a mapping")
+
+    device_manager = get_device_manager()
+    try:
+        job_id = device_manager.submit_test_request(request_data, request.args.get('priority', 0, type=int))
+    except (KeyError, TypeError, ValueError) as e:
+        abort(400, description="Malformed test request: %s" % e)
+    return jsonify(device_manager.get_job_status(job_id)), 202
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify(get_device_manager().list_jobs(request.args.get('state')))
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+def job_status(job_id):
+    job_status = get_device_manager().get_job_status(job_id)
+    if job_status is None:
+        abort(404, description="Unknown job %d" % job_id)
+    return jsonify(job_status)
+
+@app.route('/api/boards', methods=['GET'])
+def list_boards():
+    resource_pool = get_device_manager().resource_pool
+    with resource_pool.lock:
+        boards = dict((board_name, dict(board_entry)) for board_name, board_entry in resource_pool.available_boards.items())
+    return jsonify(boards)
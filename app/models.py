@@ -17,3 +17,27 @@ class User(db.Model):
 
     def __repr__(self):
         return '<User {}'.format(self.username)
+
+class TestResult(db.Model):
+    """A single test case result. Written in bulk by the ResultParser component (see
+    app/results.py) and indexed for the usual history queries: by job, board, board type,
+    test, result and time."""
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, index=True)
+    board = db.Column(db.String(64), index=True)
+    board_type = db.Column(db.String(64), index=True)
+    suite = db.Column(db.String(128), index=True)
+    test_name = db.Column(db.String(256), index=True)
+    result = db.Column(db.String(8), index=True)
+    duration = db.Column(db.Float)
+    timestamp = db.Column(db.DateTime, index=True)
+
+    __table_args__ = (
+            # "Last N results of test X" and "when did X start failing"
+            db.Index('ix_test_result_test_time', 'test_name', 'timestamp'),
+            # Flaky tests and trends, per board type
+            db.Index('ix_test_result_type_test_time', 'board_type', 'test_name', 'timestamp'),
+            )
+
+    def __repr__(self):
+        return '<TestResult {0}/{1}: {2}>'.format(self.suite, self.test_name, self.result)
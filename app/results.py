@@ -0,0 +1,103 @@
+import datetime
+from sqlalchemy import create_engine, func, case
+from app import app, db
+from app.models import TestResult
+
+class ResultStore:
+    """Bulk loading of test results into the results database. It uses its own engine
+    rather than the Flask session, so that the framework (including the ResultParser worker
+    processes) can write results without running the web application."""
+
+    # Number of rows per INSERT statement batch
+    BATCH_SIZE = 5000
+
+    def __init__(self, database_uri=None):
+        """Object constructor. The database of the web application is used by default"""
+        database_uri = database_uri or app.config['SQLALCHEMY_DATABASE_URI']
+        # Several worker processes may write at the same time; let SQLite wait for the lock
+        connect_args = {'timeout': 60} if database_uri.startswith('sqlite') else {}
+        self.engine = create_engine(database_uri, connect_args=connect_args)
+        TestResult.__table__.create(self.engine, checkfirst=True)
+
+    def add_records(self, test_records, job_id=None, board=None, board_type=None, timestamp=None):
+        """Inserts ResultParser.TestRecord objects (any iterable, consumed in batches).
+        Returns the number of results stored."""
+        timestamp = timestamp or datetime.datetime.now()
+        stored = 0
+        batch = []
+        for test_record in test_records:
+            batch.append({'job_id': job_id,
+                          'board': board,
+                          'board_type': board_type,
+                          'suite': test_record.suite,
+                          'test_name': test_record.name,
+                          'result': test_record.status,
+                          'duration': test_record.duration,
+                          'timestamp': timestamp})
+            if len(batch) == self.BATCH_SIZE:
+                stored += self._insert(batch)
+                batch = []
+        if batch:
+            stored += self._insert(batch)
+        return stored
+
+    def _insert(self, batch):
+        # A single transaction per batch
+        with self.engine.begin() as connection:
+            connection.execute(TestResult.__table__.insert(), batch)
+        return len(batch)
+
+    def close(self):
+        self.engine.dispose()
+
+
+# Query API. These run within the Flask application context (e.g. from the routes).
+
+def get_last_results(test_name, count=10, board_type=None):
+    """Returns the last count results of the given test, newest first"""
+    query = TestResult.query.filter(TestResult.test_name == test_name)
+    if board_type:
+        query = query.filter(TestResult.board_type == board_type)
+    return query.order_by(TestResult.timestamp.desc()).limit(count).all()
+
+def get_first_failure(test_name, board_type=None):
+    """Answers "when did this start failing?": returns the first failure following the
+    last pass of the given test (None if the last result is not a failure)"""
+    query = TestResult.query.filter(TestResult.test_name == test_name)
+    if board_type:
+        query = query.filter(TestResult.board_type == board_type)
+    last_pass = query.filter(TestResult.result == 'PASS').order_by(TestResult.timestamp.desc()).first()
+    failures = query.filter(TestResult.result == 'FAIL')
+    if last_pass is not None:
+        failures = failures.filter(TestResult.timestamp > last_pass.timestamp)
+    return failures.order_by(TestResult.timestamp.asc()).first()
+
+def get_flaky_tests(days=7, board_type=None, limit=50):
+    """Returns the tests that both passed and failed on the same board type during the last
+    days, as (suite, test name, board type, passes, failures) tuples, the most unstable
+    first"""
+    passes = func.sum(case((TestResult.result == 'PASS', 1), else_=0))
+    failures = func.sum(case((TestResult.result == 'FAIL', 1), else_=0))
+    query = db.session.query(TestResult.suite, TestResult.test_name, TestResult.board_type, passes, failures) \
+            .filter(TestResult.timestamp >= datetime.datetime.now() - datetime.timedelta(days=days))
+    if board_type:
+        query = query.filter(TestResult.board_type == board_type)
+    return query.group_by(TestResult.suite, TestResult.test_name, TestResult.board_type) \
+            .having(passes > 0).having(failures > 0) \
+            .order_by(func.abs(passes - failures).asc(), (passes + failures).desc()) \
+            .limit(limit).all()
+
+def get_pass_rate_trend(days=30, test_name=None, suite=None, board_type=None):
+    """Returns the daily pass rate over the last days, as (day, passed, total) tuples,
+    oldest first. Skipped tests are not counted."""
+    day = func.date(TestResult.timestamp)
+    query = db.session.query(day, func.sum(case((TestResult.result == 'PASS', 1), else_=0)), func.count(TestResult.id)) \
+            .filter(TestResult.timestamp >= datetime.datetime.now() - datetime.timedelta(days=days)) \
+            .filter(TestResult.result != 'SKIP')
+    if test_name:
+        query = query.filter(TestResult.test_name == test_name)
+    if suite:
+        query = query.filter(TestResult.suite == suite)
+    if board_type:
+        query = query.filter(TestResult.board_type == board_type)
+    return query.group_by(day).order_by(day).all()
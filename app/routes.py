@@ -1,5 +1,5 @@
-from flask import render_template, flash, redirect, url_for
-from app import app
+from flask import render_template, flash, redirect, url_for, request
+from app import app, results
 from app.forms import LoginForm
 
 @app.route('/')
@@ -58,4 +58,19 @@ def first_run():
 
 @app.route('/reports')
 def reporting():
-    return "Reporting center"
+    days = request.args.get('days', 7, type=int)
+    board_type = request.args.get('board_type')
+    return render_template("reports.html",
+                           days=days,
+                           flaky_tests=results.get_flaky_tests(days, board_type),
+                           trend=results.get_pass_rate_trend(days, board_type=board_type))
+
+@app.route('/reports/tests/<path:test_name>')
+def test_history(test_name):
+    count = request.args.get('count', 20, type=int)
+    board_type = request.args.get('board_type')
+    return render_template("test_history.html",
+                           test_name=test_name,
+                           last_results=results.get_last_results(test_name, count, board_type),
+                           first_failure=results.get_first_failure(test_name, board_type),
+                           trend=results.get_pass_rate_trend(30, test_name=test_name, board_type=board_type))
@@ -0,0 +1,433 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import statistics
+import contextlib
+import subprocess
+from optparse import OptionParser
+
+# The benchmarks drive the framework components directly, against the simulated lab backend
+# (see LabBackend), so they can run on any Linux host. Each benchmark times one stage of a
+# job on synthetic inputs; the input sizes depend on the selected scale.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from Constants import Constants
+from DeltaSync import DeltaSync
+from DeviceManager import DeviceManager
+from DeviceObject import DeviceObject
+from ResultParser import ResultParser
+
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "baselines")
+
+# Input sizes (and number of timed runs) for each scale
+SCALES = {
+    "small" : {"tests" : 10, "files" : 50, "result_lines" : 1000, "result_files" : 5,
+               "boot_commands" : 10, "boards" : 1, "runs" : 5},
+    "medium" : {"tests" : 1000, "files" : 1000, "result_lines" : 20000, "result_files" : 50,
+                "boot_commands" : 50, "boards" : 10, "runs" : 3},
+    "huge" : {"tests" : 5000, "files" : 5000, "result_lines" : 100000, "result_files" : 200,
+              "boot_commands" : 200, "boards" : 100, "runs" : 2},
+}
+
+# Minimum duration of a timed run, in seconds
+MIN_RUN_TIME = 0.05
+
+# name -> benchmark function, in registration order
+BENCHMARKS = {}
+
+def benchmark(name):
+    """Registers a benchmark. The function receives the BenchmarkContext, does its setup
+    and returns the callable to time (called once per run)."""
+    def register(benchmark_function):
+        BENCHMARKS[name] = benchmark_function
+        return benchmark_function
+    return register
+
+
+class BenchmarkContext:
+    """Everything the benchmarks share: a temporary folder, a synthetic board file, a test
+    repository and a DeviceManager using the simulated lab"""
+
+    BOARD_TYPE = "benchboard"
+
+    def __init__(self, scale):
+        self.scale = scale
+        self.root = tempfile.mkdtemp(prefix="damf-bench-")
+        self.board_names = ["bench-%03d" % board_index for board_index in range(scale["boards"])]
+        self.write_board_file()
+        self.test_repo = self.write_test_repository()
+        self.config_file = self.write_config()
+        self._device_manager = None
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def boot_commands(self, count):
+        """count bootloader commands using placeholders, as real board files do"""
+        return ["setenv var%d {SERVER_IP}:{IMAGE_PATH}/%d" % (command_index, command_index)
+                for command_index in range(count)]
+
+    def write_board_file(self):
+        os.makedirs(self.path("boards"))
+        with open(self.path("boards", "%s.yml" % self.BOARD_TYPE), "w") as board_file:
+            board_file.write("attributes:\n  has_ssh: yes\n  boot_timeout: 60\n  boot_command_timeout: 60\n")
+            board_file.write("commands:\n  ramdisk_boot:\n")
+            for command in self.boot_commands(self.scale["boot_commands"]) + ["bootm 0x1000000"]:
+                board_file.write("    - \"%s\"\n" % command)
+            board_file.write("boards:\n")
+            for board_name in self.board_names:
+                board_file.write("  - %s\n" % board_name)
+
+    def write_test_repository(self):
+        """A Git repository with scale["files"] files spread over folders, plus a test that
+        prints colon-format results and a package installer"""
+        repo_path = self.path("test-repo")
+        for file_index in range(self.scale["files"]):
+            folder = os.path.join(repo_path, "suite%02d" % (file_index % 20))
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            with open(os.path.join(folder, "data%05d.txt" % file_index), "w") as data_file:
+                data_file.write("test data %d\n" % file_index * 20)
+        with open(os.path.join(repo_path, "benchtest"), "w") as test_file:
+            test_file.write("#!/bin/sh\nfor i in 1 2 3 4 5; do echo \"case_$i: PASS\"; done\n")
+        with open(os.path.join(repo_path, "install.sh"), "w") as installer_file:
+            installer_file.write("#!/bin/sh\nchmod +x \"$HOME\"/git/benchtest\n")
+        for git_command in (["init", "-q"], ["add", "-A"],
+                            ["-c", "user.name=bench", "-c", "user.email=bench@localhost", "commit", "-q", "-m", "bench"]):
+            subprocess.check_call(["git"] + git_command, cwd=repo_path)
+        return repo_path
+
+    def write_config(self):
+        config_file_path = self.path("config.yml")
+        with open(config_file_path, "w") as config_file:
+            config_file.write("\n".join([
+                "workspace:",
+                "  root_path: %s/" % self.path("workspace"),
+                "  logs_dir: logs",
+                "  git_dir: git",
+                "  test_results_dir: test_results",
+                "  temp_dir: tmp",
+                "global_settings:",
+                "  board_files_path: %s/" % self.path("boards"),
+                "lab:",
+                "  backend: simulator",
+                "  state_dir: %s" % self.path("simlab"),
+                "  boot_time: 0.0",
+                "scheduler:",
+                "  workers: %d" % len(self.board_names),
+                ""]))
+        return config_file_path
+
+    @property
+    def device_manager(self):
+        if self._device_manager is None:
+            with contextlib.redirect_stdout(io.StringIO()):
+                self._device_manager = DeviceManager.DeviceManager(self.config_file)
+        return self._device_manager
+
+    def request_data(self, tests):
+        return {"boards" : {"master" : self.BOARD_TYPE},
+                "instance_config" : {"master" : {"boot_method" : "ramdisk", "server_ip" : "10.0.0.1",
+                                                 "image_path" : "/srv/images/bench"}},
+                "tests" : {"toolkit" : {"git_repos" : self.test_repo,
+                                        "env_vars" : ["PATH=$HOME/git:$PATH"] + ["VAR%d=%d" % (var_index, var_index)
+                                                                              for var_index in range(50)],
+                                        "package_installer" : "git/install.sh",
+                                        "package_repository_url" : "http://localhost/repos",
+                                        "repository_list" : "main extra"},
+                           "master" : list(tests)}}
+
+    def workspace(self, name):
+        """A fresh job workspace"""
+        workspace_path = self.path("workspace", name) + "/"
+        shutil.rmtree(workspace_path, ignore_errors=True)
+        for folder in self.device_manager.workspace_folders:
+            os.makedirs(workspace_path + folder)
+        return workspace_path
+
+    def board_object(self, board_name, workspace_path):
+        device_manager = self.device_manager
+        return DeviceObject.DeviceObject(board_name, self.BOARD_TYPE, "master", None,
+                                         device_manager.board_file_path, workspace_path,
+                                         inventory=device_manager.inventory,
+                                         board_registry=device_manager.board_registry,
+                                         ssh_pool=device_manager.ssh_pool,
+                                         ip_discovery=device_manager.ip_discovery,
+                                         lab_backend=device_manager.lab)
+
+    def write_result_file(self, file_path, lines):
+        with open(file_path, "w") as result_file:
+            for line_index in range(lines):
+                # One result line out of four; the rest is test output
+                if line_index % 4 == 0:
+                    result_file.write("case_%d: %s\n" % (line_index, "FAIL" if line_index % 40 == 0 else "PASS"))
+                else:
+                    result_file.write("output line %d of the test <&>\n" % line_index)
+
+    def close(self):
+        if self._device_manager is not None:
+            self._device_manager.shutdown()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+@benchmark("test_request_parsing")
+def bench_test_request_parsing(context):
+    request_data = context.request_data("test%d" % test_index for test_index in range(context.scale["tests"]))
+    return lambda: DeviceManager.TestRequest(request_data)
+
+@benchmark("constants_loading")
+def bench_constants_loading(context):
+    return Constants.Constants
+
+@benchmark("read_device_file")
+def bench_read_device_file(context):
+    """Board file compilation (the registry cache is dropped before every run)"""
+    board_object = context.board_object(context.board_names[0], context.workspace("device_file"))
+    def read_device_file():
+        context.device_manager.board_registry.invalidate(context.BOARD_TYPE)
+        board_object.read_device_file(context.BOARD_TYPE)
+    return read_device_file
+
+@benchmark("read_device_file_cached")
+def bench_read_device_file_cached(context):
+    board_object = context.board_object(context.board_names[0], context.workspace("device_file"))
+    return lambda: board_object.read_device_file(context.BOARD_TYPE)
+
+@benchmark("submit_config_params")
+def bench_submit_config_params(context):
+    board_object = context.board_object(context.board_names[0], context.workspace("config_params"))
+    node_config = context.request_data([])["instance_config"]["master"]
+    return lambda: board_object.submit_config_params(node_config)
+
+def boot_command_sender(context, pipelined):
+    board_name = context.board_names[0]
+    board_object = context.board_object(board_name, context.workspace("boot_sender"))
+    board_object.pipelined_boot = pipelined
+    board_object.lab_backend.power(board_name, "on")
+    console = board_object.open_console()
+    if board_object.detect_console_state(console) != "bootloader":
+        raise RuntimeError("The simulated console of %s is not at the bootloader prompt" % board_name)
+    boot_commands = context.boot_commands(context.scale["boot_commands"])
+
+    def send_boot_commands():
+        board_object._boot_command_sender(console, boot_commands)
+        # The prompt following the last command
+        console.expect(board_object.prompt_patterns["bootloader"])
+    return send_boot_commands
+
+@benchmark("boot_command_sender")
+def bench_boot_command_sender(context):
+    return boot_command_sender(context, False)
+
+@benchmark("boot_command_sender_pipelined")
+def bench_boot_command_sender_pipelined(context):
+    return boot_command_sender(context, True)
+
+def deploy_tests(context, mode):
+    device_manager = context.device_manager
+    workspace_path = context.workspace("deploy_%s" % mode)
+    shutil.copytree(context.test_repo, workspace_path + "git/test-repo")
+    test_request = DeviceManager.TestRequest(context.request_data([]))
+    test_request.workspace = workspace_path
+    board_name = context.board_names[0]
+    board_ip = device_manager.lab.get_board_address(board_name)
+
+    device_manager.deployment_settings = {"mode" : mode}
+    device_manager.delta_sync = DeltaSync.DeltaSync(context.path("manifests"), device_manager.logger) if mode == "delta" else None
+    def deploy():
+        with contextlib.redirect_stdout(io.StringIO()):
+            device_manager.deploy_tests(board_ip, workspace_path + "git/", test_request, [], board_name)
+    return deploy
+
+@benchmark("deploy_tests_tar")
+def bench_deploy_tests_tar(context):
+    return deploy_tests(context, "tar")
+
+@benchmark("deploy_tests_delta")
+def bench_deploy_tests_delta(context):
+    """Deployment of an unchanged tree (every run after the first only checks the manifest)"""
+    deploy = deploy_tests(context, "delta")
+    deploy()
+    return deploy
+
+@benchmark("result_parsing")
+def bench_result_parsing(context):
+    result_file_path = context.path("parse_test_result")
+    context.write_result_file(result_file_path, context.scale["result_lines"])
+    return lambda: sum(1 for test_record in ResultParser.parse_file(result_file_path, ResultParser.get_format("colon")))
+
+@benchmark("process_test_results")
+def bench_process_test_results(context):
+    """ResultParser run over a job's result files (process_test_results2)"""
+    workspace_path = context.workspace("results")
+    results_path = workspace_path + context.device_manager.test_results_dir + "/"
+    lines_per_file = max(1, context.scale["result_lines"] // context.scale["result_files"])
+    for file_index in range(context.scale["result_files"]):
+        context.write_result_file("%stest%d_test_result" % (results_path, file_index), lines_per_file)
+
+    def process_test_results():
+        with contextlib.redirect_stdout(io.StringIO()):
+            context.device_manager.process_test_results2(workspace_path, "colon", "bench")
+    return process_test_results
+
+@benchmark("junit_writer")
+def bench_junit_writer(context):
+    test_records = [ResultParser.TestRecord("suite", "case_%d" % record_index,
+                                            "FAIL" if record_index % 10 == 0 else "PASS", 0.5,
+                                            "output <%d> & more" % record_index if record_index % 10 == 0 else "",
+                                            None, None)
+                    for record_index in range(context.scale["result_lines"])]
+    report_file_path = context.path("junit_report.xml")
+    def write_report():
+        junit_writer = ResultParser.JUnitWriter(report_file_path, "suite", "bench-000", "bench")
+        for test_record in test_records:
+            junit_writer.add_record(test_record)
+        junit_writer.close(1.0)
+    return write_report
+
+@benchmark("merge_reports")
+def bench_merge_reports(context):
+    os.makedirs(context.path("reports"))
+    report_files = []
+    lines_per_report = max(1, context.scale["result_lines"] // context.scale["result_files"])
+    for report_index in range(context.scale["result_files"]):
+        report_file_path = context.path("reports", "suite%d.xml" % report_index)
+        junit_writer = ResultParser.JUnitWriter(report_file_path, "suite%d" % report_index)
+        for record_index in range(lines_per_report):
+            junit_writer.add_record(ResultParser.TestRecord("suite%d" % report_index, "case_%d" % record_index,
+                                                            "PASS", None, "", None, None))
+        junit_writer.close()
+        report_files.append(report_file_path)
+    return lambda: ResultParser.merge_reports(report_files, context.path("merged.xml"), "bench")
+
+@benchmark("job_throughput")
+def bench_job_throughput(context):
+    """One job per simulated board, all submitted at once and run to completion (git
+    checkout, reservation, power, boot, deployment, tests, reports, release)"""
+    device_manager = context.device_manager
+    device_manager.deployment_settings = {}
+    device_manager.delta_sync = None
+    request_data = context.request_data(["benchtest"])
+    def run_jobs():
+        with contextlib.redirect_stdout(io.StringIO()):
+            job_ids = [device_manager.submit_test_request(request_data) for board_name in context.board_names]
+            # Poll often, so that the time measured is the one of the jobs, not of the polling
+            job_states = [device_manager.wait_for_job(job_id, poll_interval=0.01)["state"] for job_id in job_ids]
+        if any(job_state != "finished" for job_state in job_states):
+            raise RuntimeError("Benchmark jobs did not finish: %s" % job_states)
+    return run_jobs
+
+
+def run_benchmarks(scale_name, names=None):
+    """Runs the benchmarks and returns the results document"""
+    scale = SCALES[scale_name]
+    results = {}
+    context = BenchmarkContext(scale)
+    try:
+        for name, benchmark_function in BENCHMARKS.items():
+            if names and name not in names:
+                continue
+            timed_function = benchmark_function(context)
+
+            # Fast stages are called several times per run, so that a run lasts at least
+            # MIN_RUN_TIME and timer resolution or noise do not dominate
+            start_time = time.perf_counter()
+            timed_function()
+            loops = max(1, int(MIN_RUN_TIME / max(time.perf_counter() - start_time, 1e-9)))
+
+            durations = []
+            for run_index in range(scale["runs"]):
+                start_time = time.perf_counter()
+                for loop_index in range(loops):
+                    timed_function()
+                durations.append((time.perf_counter() - start_time) / loops)
+            results[name] = {"median" : statistics.median(durations), "min" : min(durations),
+                             "runs" : len(durations), "loops" : loops}
+            print("%-32s median %11.6fs   min %11.6fs   (%d x %d)" % (name, results[name]["median"],
+                                                                   results[name]["min"], len(durations), loops))
+    finally:
+        context.close()
+
+    return {"scale" : scale_name,
+            "sizes" : dict((size, value) for size, value in scale.items() if size != "runs"),
+            "timestamp" : time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "host" : platform.node(),
+            "python" : platform.python_version(),
+            "results" : results}
+
+def compare_with_baseline(current, baseline, threshold):
+    """Prints the change against the baseline for every benchmark and returns the names of
+    the benchmarks whose median time grew by more than threshold (a fraction)"""
+    regressions = []
+    print("\n%-32s %12s %12s %8s" % ("benchmark", "baseline", "current", "change"))
+    for name, result in current["results"].items():
+        baseline_result = baseline["results"].get(name)
+        if baseline_result is None:
+            print("%-32s %12s %11.6fs" % (name, "-", result["median"]))
+            continue
+        change = (result["median"] - baseline_result["median"]) / baseline_result["median"] if baseline_result["median"] else 0.0
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        print("%-32s %11.6fs %11.6fs %+7.1f%%%s" % (name, baseline_result["median"], result["median"], change * 100,
+                                                  "  REGRESSION" if regressed else ""))
+    return regressions
+
+def main(argv):
+    parser = OptionParser(usage="%prog [options] [benchmark names]")
+    parser.add_option("-s", "--scale", dest="scale", choices=sorted(SCALES), default="small",
+            help="Input sizes: %s (default: small)" % ", ".join(sorted(SCALES)))
+    parser.add_option("-b", "--baseline", dest="baseline",
+            action="store", type="string",
+            help="Baseline to compare with (default: baselines/<scale>.json, if it exists)", metavar="FILE")
+    parser.add_option("-S", "--save-baseline", dest="save_baseline",
+            action="store_true", help="Store the results as the new baseline")
+    parser.add_option("-t", "--threshold", dest="threshold",
+            action="store", type="float", default=0.25,
+            help="Median time increase flagged as a regression (default: 0.25, i.e. 25%)")
+    parser.add_option("-o", "--output", dest="output",
+            action="store", type="string", help="Also write the results to this JSON file", metavar="FILE")
+    parser.add_option("-l", "--list", dest="list_benchmarks",
+            action="store_true", help="List the benchmarks and exit")
+    (options, args) = parser.parse_args(argv)
+
+    if options.list_benchmarks:
+        print("\n".join(BENCHMARKS))
+        return 0
+    unknown_benchmarks = [name for name in args if name not in BENCHMARKS]
+    if unknown_benchmarks:
+        parser.error("Unknown benchmarks: %s (use -l to list them)" % ", ".join(unknown_benchmarks))
+
+    current = run_benchmarks(options.scale, args)
+    if options.output:
+        with open(options.output, "w") as output_file:
+            json.dump(current, output_file, indent=2, sort_keys=True)
+
+    baseline_path = options.baseline or os.path.join(BASELINES_DIR, "%s.json" % options.scale)
+    regressions = []
+    if os.path.exists(baseline_path) and not options.save_baseline:
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("scale") != current["scale"]:
+            print("Warning: the baseline was recorded at the %s scale" % baseline.get("scale"))
+        regressions = compare_with_baseline(current, baseline, options.threshold)
+
+    if options.save_baseline:
+        if not os.path.exists(os.path.dirname(baseline_path)):
+            os.makedirs(os.path.dirname(baseline_path))
+        with open(baseline_path, "w") as baseline_file:
+            json.dump(current, baseline_file, indent=2, sort_keys=True)
+        print("Baseline stored in %s" % baseline_path)
+
+    if regressions:
+        print("\n%d benchmark(s) regressed by more than %d%%: %s" % (len(regressions), options.threshold * 100,
+                                                                    ", ".join(regressions)))
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,6 +1,10 @@
 import os
 import sys
+import json
+import time
 import yaml
+import signal
+import urllib.request
 from optparse import OptionParser
 
 # Append the current folder to the system path. We do this in order to be able to call 
@@ -22,12 +26,41 @@ def main(argv):
 			help="The location of the framework config file (in YAML format)", metavar="CONFIG_FILE")
     parser.add_option("-d", "--enable-debugging", dest="debug",
             action="store_true", help="Enable debug log messages")
+    parser.add_option("-p", "--priority", dest="priority",
+            action="store", type="int", default=0,
+            help="The job priority (jobs with higher values are scheduled first)", metavar="PRIORITY")
+    parser.add_option("-D", "--daemon", dest="daemon",
+            action="store_true", help="Run as a daemon, taking jobs over the HTTP API (/api/jobs)")
+    parser.add_option("-l", "--listen", dest="listen",
+            action="store", type="string", default="127.0.0.1:5000",
+            help="Where the daemon listens: <host>:<port>, or unix://<socket path>", metavar="ADDRESS")
+    parser.add_option("-s", "--server", dest="server",
+            action="store", type="string",
+            help="Submit the test request to a running daemon (e.g. http://127.0.0.1:5000)", metavar="URL")
+    parser.add_option("-n", "--finalize-nightly", dest="finalize_nightly",
+            action="store_true", help="Write the nightly reports of the days that are over (e.g. from cron)")
 
     (options, args) = parser.parse_args()
 
+    if options.finalize_nightly:
+        if not options.cfg_file:
+            parser.error('The config file has not been specified.Use -h for more instructions.')
+        finalize_nightly_reports(options.cfg_file)
+        return
+
+    if options.daemon:
+        if not options.cfg_file:
+            parser.error('The config file has not been specified.Use -h for more instructions.')
+        run_daemon(options)
+        return
+
     if not options.yaml_file:   
     	parser.error('No YAML file specified! Use -h for more instructions.')
     	sys.exit(2)
+
+    if options.server:
+        submit_to_daemon(options.server, options.yaml_file, options.priority)
+        return
 	
     if not options.cfg_file:   
     	parser.error('The config file has not been specified.Use -h for more instructions.')
@@ -36,16 +69,86 @@ def main(argv):
     print("Starting a new run...")
     if options.debug == True:
         dev_manager = DeviceManager.DeviceManager(options.cfg_file, True)
-        dev_manager.submit_test_request(extract_yaml(options.yaml_file))
     else:
         dev_manager = DeviceManager.DeviceManager(options.cfg_file)
-        dev_manager.submit_test_request(extract_yaml(options.yaml_file))
+
+    # A SIGTERM goes through the regular exit path, so that the board reservations
+    # are released
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit(1))
+
+    # The request goes through the job queue; wait for it to be processed
+    try:
+        job_id = dev_manager.submit_test_request(extract_yaml(options.yaml_file), options.priority)
+        print("Job %s submitted. Waiting for it to finish..." % job_id)
+        job_status = dev_manager.wait_for_job(job_id)
+    finally:
+        dev_manager.shutdown()
+
+    print("Job %s %s" % (job_id, job_status["state"]))
+    if job_status["error"]:
+        print(job_status["error"])
+        sys.exit(1)
+
+def run_daemon(options):
+    """Keeps a single DeviceManager (and with it the resource pool, the board file cache,
+    the inventory cache and the job queue) for all the jobs, which are submitted through the
+    web application API"""
+    # The web application is only needed in daemon mode
+    from app import app
+
+    print("Starting the DAMF daemon...")
+    dev_manager = DeviceManager.DeviceManager(options.cfg_file, options.debug == True, daemon=True)
+    app.config["DEVICE_MANAGER"] = dev_manager
+
+    # Let the running jobs finish when asked to stop
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit(0))
+    try:
+        if options.listen.startswith("unix://"):
+            app.run(host=options.listen, threaded=True)
+        else:
+            (host, port) = options.listen.rsplit(":", 1)
+            app.run(host=host, port=int(port), threaded=True)
+    finally:
+        print("Stopping the DAMF daemon...")
+        dev_manager.shutdown()
+
+def finalize_nightly_reports(cfg_file):
+    """Writes the nightly reports of the days that are over, without starting the framework"""
+    from ResultParser import ResultParser
+    with open(cfg_file) as file_stream:
+        report_settings = (yaml.safe_load(file_stream) or {}).get("reports") or {}
+    if not report_settings.get("nightly_dir"):
+        print("No nightly_dir in the reports section of %s" % cfg_file)
+        sys.exit(2)
+    for (day, totals) in sorted(ResultParser.finalize_nightly_reports(report_settings["nightly_dir"]).items()):
+        print("Nightly report of %s written: %s" % (day, totals))
+
+def submit_to_daemon(server_url, yaml_file_path, priority=0, poll_interval=5):
+    """Submits a test request to a running daemon and waits for the job to finish"""
+    with open(yaml_file_path) as file_stream:
+        submit_request = urllib.request.Request("%s/api/jobs?priority=%d" % (server_url.rstrip("/"), priority),
+                                                data=file_stream.read().encode("utf-8"),
+                                                headers={"Content-Type": "application/x-yaml"})
+    with urllib.request.urlopen(submit_request) as response:
+        job_status = json.loads(response.read().decode("utf-8"))
+    job_id = job_status["id"]
+    print("Job %s submitted to %s. Waiting for it to finish..." % (job_id, server_url))
+
+    while job_status["state"] not in ("finished", "failed"):
+        time.sleep(poll_interval)
+        with urllib.request.urlopen("%s/api/jobs/%d" % (server_url.rstrip("/"), job_id)) as response:
+            job_status = json.loads(response.read().decode("utf-8"))
+
+    print("Job %s %s" % (job_id, job_status["state"]))
+    if job_status["error"]:
+        print(job_status["error"])
+        sys.exit(1)
 
 def extract_yaml(yaml_file_path):
 	"""Parse the given YAML test request, extract the data and forward it to the Device
 	Manager component"""
 	file_stream = open(yaml_file_path)
-	yaml_content = yaml.load(file_stream)
+	yaml_content = yaml.safe_load(file_stream)
 
 	# TODO: Perform additional tasks here in order to sanitize the input
 	return yaml_content
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The components are imported the way the framework scripts import them (from Name import
+# Name), from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
@@ -0,0 +1,32 @@
+import pickle
+import unittest
+from BoardProfile import BoardProfile
+
+class BootTemplateTest(unittest.TestCase):
+
+    def test_bootloader_variables_are_not_placeholders(self):
+        boot_template = BoardProfile.BootTemplate(["setenv bootargs root=/dev/nfs nfsroot={ROOT_FS}",
+                                                   "tftp ${loadaddr} {IMAGE}",
+                                                   "tftp ${fdt_addr} {DTB}; bootz ${loadaddr} - ${fdt_addr}",
+                                                   "echo {lower_case}"])
+        values = {"IMAGE": "zImage", "DTB": "board.dtb", "ROOT_FS": "/srv/rootfs"}
+        self.assertEqual(boot_template.missing_placeholders(values), [])
+        self.assertEqual(boot_template.render(values),
+                         ["setenv bootargs root=/dev/nfs nfsroot=/srv/rootfs",
+                          "tftp ${loadaddr} zImage",
+                          "tftp ${fdt_addr} board.dtb; bootz ${loadaddr} - ${fdt_addr}",
+                          "echo {lower_case}"])
+
+    def test_missing_placeholders(self):
+        boot_template = BoardProfile.BootTemplate(["tftp ${loadaddr} {IMAGE}", "tftp ${fdt_addr} {DTB}"])
+        self.assertEqual(boot_template.missing_placeholders({"IMAGE": "zImage"}), ["DTB"])
+        with self.assertRaises(KeyError):
+            boot_template.render({"IMAGE": "zImage"})
+
+    def test_pickled_templates_are_compiled_again(self):
+        boot_template = pickle.loads(pickle.dumps(BoardProfile.BootTemplate(["tftp ${loadaddr} {IMAGE}"])))
+        self.assertEqual(boot_template.render({"IMAGE": "zImage"}), ["tftp ${loadaddr} zImage"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import unittest
+from IpDiscovery import IpDiscovery
+
+BOARD_MAC = "00:11:22:aa:bb:cc"
+
+class ConsoleOutputTest(unittest.TestCase):
+
+    def test_ifconfig_and_ip_addr_formats(self):
+        parse = IpDiscovery.IpDiscovery.parse_console_output
+        self.assertEqual(parse("eth0      Link encap:Ethernet\n"
+                               "          inet addr:10.0.0.5  Bcast:10.0.0.255  Mask:255.255.255.0"), "10.0.0.5")
+        self.assertEqual(parse("eth0: flags=4163<UP,BROADCAST,RUNNING,MULTICAST>  mtu 1500\n"
+                               "        inet 10.0.0.6  netmask 255.255.255.0  broadcast 10.0.0.255"), "10.0.0.6")
+        self.assertEqual(parse("2: eth0: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500\n"
+                               "    inet 10.0.0.7/24 brd 10.0.0.255 scope global eth0"), "10.0.0.7")
+
+    def test_loopback_and_missing_addresses(self):
+        parse = IpDiscovery.IpDiscovery.parse_console_output
+        self.assertEqual(parse("inet 127.0.0.1/8 scope host lo\ninet 10.0.0.8/24 scope global eth0"), "10.0.0.8")
+        self.assertIsNone(parse("inet 127.0.0.1/8 scope host lo"))
+        self.assertIsNone(parse("inet6 fe80::1/64 scope link"))
+        self.assertIsNone(parse(None))
+
+
+class MacLookupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="damf-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_file(self, file_name, contents):
+        file_path = os.path.join(self.temp_dir, file_name)
+        with open(file_path, "w") as output_file:
+            output_file.write(contents)
+        return file_path
+
+    def test_arp_table_skips_incomplete_entries(self):
+        arp_file = self.write_file("arp",
+            "IP address       HW type     Flags       HW address            Mask     Device\n"
+            "10.0.0.9         0x1         0x0         00:11:22:AA:BB:CC     *        eth0\n"
+            "10.0.0.10        0x1         0x2         00:11:22:AA:BB:CC     *        eth0\n")
+        discovery = IpDiscovery.IpDiscovery(lease_files=[], arp_file=arp_file)
+        self.assertEqual(discovery.lookup_mac(BOARD_MAC), "10.0.0.10")
+        self.assertIsNone(discovery.lookup_mac("00:11:22:dd:ee:ff"))
+
+    def test_dnsmasq_leases(self):
+        lease_file = self.write_file("dnsmasq.leases",
+            "1700000000 00:11:22:aa:bb:cc 10.0.0.11 board1 *\n"
+            "1700000100 00:11:22:dd:ee:ff 10.0.0.12 board2 *\n")
+        discovery = IpDiscovery.IpDiscovery(lease_files=[lease_file], arp_file=os.path.join(self.temp_dir, "none"))
+        self.assertEqual(discovery.lookup_mac(BOARD_MAC), "10.0.0.11")
+
+    def test_isc_leases_last_entry_wins(self):
+        lease_file = self.write_file("dhcpd.leases",
+            "lease 10.0.0.13 {\n  starts 4 2023/01/01 00:00:00;\n  hardware ethernet 00:11:22:aa:bb:cc;\n}\n"
+            "lease 10.0.0.14 {\n  hardware ethernet 00:11:22:dd:ee:ff;\n}\n"
+            "lease 10.0.0.15 {\n  starts 5 2023/01/02 00:00:00;\n  hardware ethernet 00:11:22:AA:BB:CC;\n}\n")
+        discovery = IpDiscovery.IpDiscovery(lease_files=[os.path.join(self.temp_dir, "none"), lease_file],
+                                            arp_file=os.path.join(self.temp_dir, "none"))
+        self.assertEqual(discovery.lookup_mac(BOARD_MAC), "10.0.0.15")
+
+
+class DiscoverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.discovery = IpDiscovery.IpDiscovery(lease_files=[], arp_file="/nonexistent")
+        self.discovery.remember("board1", "10.0.0.20")
+
+    def test_console_address_replaces_the_known_one(self):
+        self.assertEqual(self.discovery.discover("board1", "inet 10.0.0.21/24"), "10.0.0.21")
+        self.assertEqual(self.discovery.get_known_address("board1"), "10.0.0.21")
+
+    def test_previous_address_when_the_console_was_not_queried(self):
+        self.assertEqual(self.discovery.discover("board1"), "10.0.0.20")
+
+    def test_previous_address_not_trusted_without_a_check(self):
+        # The console answered, but without an address
+        self.assertIsNone(self.discovery.discover("board1", "eth0: <NO-CARRIER>"))
+        self.assertIsNone(self.discovery.get_known_address("board1"))
+
+    def test_previous_address_used_once_the_board_answers(self):
+        checked_addresses = []
+        def check_address(ip_address):
+            checked_addresses.append(ip_address)
+            return True
+        self.assertEqual(self.discovery.discover("board1", "", check_address=check_address), "10.0.0.20")
+        self.assertEqual(checked_addresses, ["10.0.0.20"])
+
+    def test_previous_address_dropped_if_the_board_does_not_answer(self):
+        self.assertIsNone(self.discovery.discover("board1", None, check_address=lambda ip_address: False))
+        self.assertIsNone(self.discovery.get_known_address("board1"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import time
+import shutil
+import logging
+import tempfile
+import unittest
+from JobScheduler import JobScheduler
+from ProcessOwner import ProcessOwner
+
+class JobQueueTest(unittest.TestCase):
+    """Several processes sharing one queue file, each one represented by a JobQueue with its
+    own owner ID"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="damf-test-")
+        self.queue_file = os.path.join(self.temp_dir, "queue.db")
+        self.queues = []
+
+    def tearDown(self):
+        for job_queue in self.queues:
+            job_queue.close()
+        shutil.rmtree(self.temp_dir)
+
+    def open_queue(self, owner=None, lease_time=120):
+        job_queue = JobScheduler.JobQueue(self.queue_file, lease_time, owner)
+        self.queues.append(job_queue)
+        return job_queue
+
+    def test_running_jobs_of_live_owners_are_not_requeued(self):
+        first_queue = self.open_queue()
+        first_queue.put({"job": 1}, "boardA")
+        (job_id, board_type, request_data) = first_queue.get()
+
+        # Another process opening the queue leaves the running job alone
+        second_queue = self.open_queue(owner="%s:%d:" % ("other-host", 1234))
+        self.assertEqual(second_queue.get_job(job_id)["state"], JobScheduler.JobQueue.JOB_RUNNING)
+        self.assertIsNone(second_queue.get())
+
+    def test_jobs_of_dead_owners_are_requeued(self):
+        # A process of this host that is not running any more
+        dead_owner = ProcessOwner.get_owner_id().rsplit(":", 1)[0] + ":1"
+        dead_queue = self.open_queue(owner=dead_owner)
+        job_id = dead_queue.put({"job": 1}, "boardA")
+        dead_queue.get()
+
+        job_queue = self.open_queue()
+        self.assertEqual(job_queue.get_job(job_id)["state"], JobScheduler.JobQueue.JOB_PENDING)
+        self.assertEqual(job_queue.get()[0], job_id)
+
+    def test_jobs_with_expired_heartbeats_are_requeued(self):
+        remote_queue = self.open_queue(owner="other-host:1234:", lease_time=1)
+        job_id = remote_queue.put({"job": 1}, "boardA")
+        remote_queue.get()
+
+        job_queue = self.open_queue(lease_time=1)
+        self.assertEqual(job_queue.requeue_interrupted_jobs(), [])
+        time.sleep(1.1)
+        self.assertEqual(job_queue.requeue_interrupted_jobs(), [job_id])
+
+        # The previous owner cannot record an outcome any more
+        self.assertEqual(job_queue.get()[0], job_id)
+        self.assertFalse(remote_queue.mark_done(job_id))
+        self.assertTrue(job_queue.mark_done(job_id))
+        self.assertEqual(job_queue.get_job(job_id)["state"], JobScheduler.JobQueue.JOB_FINISHED)
+
+    def test_board_type_limits_count_the_jobs_of_every_process(self):
+        first_queue = self.open_queue()
+        second_queue = self.open_queue(owner="other-host:1234:")
+        first_queue.put({"job": 1}, "boardA")
+        second_job_id = first_queue.put({"job": 2}, "boardA")
+        third_job_id = first_queue.put({"job": 3}, "boardB")
+
+        first_queue.get({"boardA": 1})
+        self.assertEqual(second_queue.get({"boardA": 1})[0], third_job_id)
+        self.assertIsNone(second_queue.get({"boardA": 1}))
+        self.assertEqual(second_queue.get()[0], second_job_id)
+
+    def test_only_the_requested_jobs_are_taken(self):
+        job_queue = self.open_queue()
+        job_queue.put({"job": 1}, "boardA")
+        own_job_id = job_queue.put({"job": 2}, "boardA")
+        self.assertIsNone(job_queue.get(job_ids=[]))
+        self.assertEqual(job_queue.get(job_ids=[own_job_id])[0], own_job_id)
+
+
+class JobSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="damf-test-")
+        self.job_queue = JobScheduler.JobQueue(os.path.join(self.temp_dir, "queue.db"))
+        self.handled_jobs = []
+
+    def tearDown(self):
+        self.job_queue.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_one_shot_scheduler_only_runs_its_own_jobs(self):
+        other_job_id = self.job_queue.put({"job": "daemon"}, "boardA")
+        scheduler = JobScheduler.JobScheduler(self.job_queue,
+                                              lambda job_id, request_data: self.handled_jobs.append(job_id),
+                                              logging.getLogger(__name__),
+                                              claim_all_jobs=False)
+        scheduler.start()
+        try:
+            own_job_id = scheduler.submit({"job": "own"}, "boardA")
+            self.assertEqual(scheduler.wait_for_job(own_job_id, 10, 0.01)["state"],
+                             JobScheduler.JobQueue.JOB_FINISHED)
+        finally:
+            scheduler.stop()
+        self.assertEqual(self.handled_jobs, [own_job_id])
+        self.assertEqual(self.job_queue.get_job(other_job_id)["state"], JobScheduler.JobQueue.JOB_PENDING)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import unittest
+from Exceptions import Exceptions
+from ProcessOwner import ProcessOwner
+from ReservationManager import ReservationManager
+
+# Stands in for the reservation tool: every call is appended to the log file. Boards named
+# "taken*" are reserved by somebody else.
+FAKE_TOOL = """import sys
+(log_path, action, board_name, argument) = sys.argv[1:5]
+with open(log_path, "a") as log_file:
+    log_file.write("%s %s %s\\n" % (action, board_name, argument))
+with open(log_path) as log_file:
+    call_count = len(log_file.readlines())
+if action == "reserve" and board_name.startswith("taken"):
+    print("%s is reserved by different user" % board_name)
+    sys.exit(1)
+if action == "reserve":
+    print("Reservation done, id=%s-%d" % (board_name, call_count))
+"""
+
+class ReservationManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="damf-test-")
+        self.log_path = os.path.join(self.temp_dir, "tool.log")
+        tool_path = os.path.join(self.temp_dir, "tool.py")
+        with open(tool_path, "w") as tool_file:
+            tool_file.write(FAKE_TOOL)
+        self.tool_prefix = "%s %s %s" % (sys.executable, tool_path, self.log_path)
+        self.journal_path = os.path.join(self.temp_dir, "leases.json")
+        self.managers = []
+
+    def tearDown(self):
+        for manager in self.managers:
+            manager.close()
+        shutil.rmtree(self.temp_dir)
+
+    def create_manager(self):
+        manager = ReservationManager.ReservationManager(self.tool_prefix + " reserve %s %s",
+                                                        self.tool_prefix + " release %s %s",
+                                                        self.journal_path)
+        self.managers.append(manager)
+        return manager
+
+    def get_tool_calls(self, action):
+        if not os.path.exists(self.log_path):
+            return []
+        with open(self.log_path) as log_file:
+            return [line.split()[1:] for line in log_file if line.startswith(action + " ")]
+
+    def read_journal(self, manager):
+        with open(manager.journal_path) as journal_file:
+            return json.load(journal_file)
+
+    def write_journal(self, journal_path, owner, leases):
+        with open(journal_path, "w") as journal_file:
+            json.dump({"owner": owner, "leases": leases}, journal_file)
+
+    def test_reserve_writes_the_journal(self):
+        manager = self.create_manager()
+        reservation_ids = manager.reserve(["board1", "board2"])
+        self.assertEqual(sorted(reservation_ids), ["board1", "board2"])
+        self.assertEqual(manager.get_reservation_id("board1"), reservation_ids["board1"])
+        journal = self.read_journal(manager)
+        self.assertEqual(journal["owner"], manager.owner)
+        self.assertEqual(sorted(journal["leases"]), ["board1", "board2"])
+
+    def test_failed_reservation_releases_the_others(self):
+        manager = self.create_manager()
+        with self.assertRaises(Exceptions.ReservationFailed):
+            manager.reserve(["board1", "taken1", "board2"])
+
+        # Boards reserved by somebody else are not retried
+        self.assertEqual(len([call for call in self.get_tool_calls("reserve") if call[0] == "taken1"]), 1)
+        self.assertEqual(sorted(call[0] for call in self.get_tool_calls("release")), ["board1", "board2"])
+        self.assertIsNone(manager.get_reservation_id("board1"))
+        self.assertEqual(self.read_journal(manager)["leases"], {})
+
+    def test_renew_takes_a_new_lease_before_releasing_the_old_one(self):
+        manager = self.create_manager()
+        old_reservation_id = manager.reserve(["board1"])["board1"]
+        self.assertTrue(manager.renew("board1"))
+
+        new_reservation_id = manager.get_reservation_id("board1")
+        self.assertNotEqual(new_reservation_id, old_reservation_id)
+        self.assertEqual(self.get_tool_calls("release"), [["board1", old_reservation_id]])
+        self.assertEqual(self.read_journal(manager)["leases"]["board1"]["reservation_id"], new_reservation_id)
+        self.assertFalse(manager.renew("board2"))
+
+    def test_release_and_close(self):
+        manager = self.create_manager()
+        reservation_ids = manager.reserve(["board1", "board2"])
+        self.assertTrue(manager.release("board1"))
+        self.assertFalse(manager.release("board1"))
+        manager.close()
+        self.assertEqual(sorted(self.get_tool_calls("release")),
+                         sorted([[board_name, reservation_id] for board_name, reservation_id in reservation_ids.items()]))
+        self.assertFalse(os.path.exists(manager.journal_path))
+
+    def test_leases_of_dead_processes_are_released_at_start(self):
+        # A process of this host that is not running any more, and the current one
+        dead_owner = ProcessOwner.get_owner_id().rsplit(":", 1)[0] + ":1"
+        expires_at = time.time() + 600
+        dead_journal_path = os.path.join(self.temp_dir, "leases.1.json")
+        live_journal_path = os.path.join(self.temp_dir, "leases.2.json")
+        self.write_journal(dead_journal_path, dead_owner,
+                           {"board1": {"reservation_id": "board1-7", "expires_at": expires_at},
+                            "board2": {"reservation_id": "board2-8", "expires_at": time.time() - 1}})
+        self.write_journal(live_journal_path, ProcessOwner.get_owner_id(),
+                           {"board3": {"reservation_id": "board3-9", "expires_at": expires_at}})
+
+        self.create_manager()
+        # Expired leases are not released again
+        self.assertEqual(self.get_tool_calls("release"), [["board1", "board1-7"]])
+        self.assertFalse(os.path.exists(dead_journal_path))
+        self.assertTrue(os.path.exists(live_journal_path))
+
+    def test_journals_of_other_hosts_are_kept_until_their_leases_expire(self):
+        journal_path = os.path.join(self.temp_dir, "leases.3.json")
+        self.write_journal(journal_path, "other-host:3:",
+                           {"board1": {"reservation_id": "board1-7", "expires_at": time.time() + 600}})
+        manager = self.create_manager()
+        self.assertEqual(manager.get_stale_journals(), [])
+
+        self.write_journal(journal_path, "other-host:3:",
+                           {"board1": {"reservation_id": "board1-7", "expires_at": time.time() - 1}})
+        self.assertEqual(manager.get_stale_journals(), [journal_path])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import os
+import shutil
+import tempfile
+import unittest
+from ResultParser import ResultParser
+
+def parse(format_name, line):
+    return ResultParser.get_format(format_name).parse_line(line)
+
+class ResultFormatTest(unittest.TestCase):
+
+    def test_colon(self):
+        self.assertEqual(parse("colon", "boot: PASS"), ("boot", "PASS", None))
+        self.assertEqual(parse("colon", "  net: ping: FAIL  "), ("net: ping", "FAIL", None))
+        self.assertIsNone(parse("colon", "boot: started"))
+
+    def test_tap(self):
+        self.assertEqual(parse("tap", "ok 1 - first test"), ("first test", "PASS", None))
+        self.assertEqual(parse("tap", "not ok 2 second test"), ("second test", "FAIL", None))
+        self.assertEqual(parse("tap", "ok 3 - no wifi # SKIP no device"), ("no wifi", "SKIP", None))
+        self.assertEqual(parse("tap", "not ok 4 - skipped too # skip"), ("skipped too", "SKIP", None))
+        self.assertIsNone(parse("tap", "1..4"))
+        self.assertIsNone(parse("tap", "# diagnostic line"))
+
+    def test_tap_todo(self):
+        # Known not to work yet: a failure is not reported, an unexpected pass is a pass
+        self.assertEqual(parse("tap", "not ok 5 - unfinished # TODO not implemented"), ("unfinished", "SKIP", None))
+        self.assertEqual(parse("tap", "ok 6 - unfinished # todo"), ("unfinished", "PASS", None))
+        # Anything else after the hash is a plain comment
+        self.assertEqual(parse("tap", "not ok 7 - broken # see bug 12"), ("broken", "FAIL", None))
+
+    def test_ptest(self):
+        self.assertEqual(parse("ptest", "PASS: test-a"), ("test-a", "PASS", None))
+        self.assertEqual(parse("ptest", "XFAIL: test-b"), ("test-b", "PASS", None))
+        self.assertEqual(parse("ptest", "XPASS: test-c"), ("test-c", "FAIL", None))
+        self.assertEqual(parse("ptest", "ERROR: test-d"), ("test-d", "FAIL", None))
+        self.assertEqual(parse("ptest", "UNSUPPORTED: test-e"), ("test-e", "SKIP", None))
+        self.assertIsNone(parse("ptest", "START: ptest-runner"))
+
+    def test_ltp(self):
+        self.assertEqual(parse("ltp", "abort01    PASS       0"), ("abort01", "PASS", None))
+        self.assertEqual(parse("ltp", "fcntl14    FAIL       1"), ("fcntl14", "FAIL", None))
+        self.assertEqual(parse("ltp", "quotactl01 CONF       32"), ("quotactl01", "SKIP", None))
+        self.assertEqual(parse("ltp", "mmap01     BROK       2"), ("mmap01", "FAIL", None))
+        self.assertIsNone(parse("ltp", "Testcase   Result     Exit Value"))
+
+
+class ParseLinesTest(unittest.TestCase):
+
+    def test_detect_format(self):
+        self.assertEqual(ResultParser.detect_format(["1..2\n", "ok 1 - a\n", "not ok 2 - b\n"]).name, "tap")
+        self.assertEqual(ResultParser.detect_format(["PASS: a\n", "FAIL: b\n"]).name, "ptest")
+        self.assertIsNone(ResultParser.detect_format(["nothing to see\n"]))
+
+    def test_failure_output_is_kept(self):
+        lines = ["starting\n", "a: PASS\n", "error: no route\n", "b: FAIL\n", "c: FAIL\n"]
+        test_records = list(ResultParser.parse_lines(lines, suite="net", source="net_test_result"))
+        self.assertEqual([(record.name, record.status) for record in test_records],
+                         [("a", "PASS"), ("b", "FAIL"), ("c", "FAIL")])
+        self.assertEqual([record.output for record in test_records], [None, "error: no route\n", None])
+        self.assertEqual([record.line_number for record in test_records], [2, 4, 5])
+        self.assertEqual(test_records[0].suite, "net")
+
+    def test_line_parser(self):
+        parse_line = ResultParser.get_line_parser()
+        self.assertEqual(parse_line("ok 1 - a").status, "PASS")
+        self.assertEqual(parse_line("XFAIL: b").status, "PASS")
+        self.assertIsNone(parse_line("random output"))
+        with self.assertRaises(ValueError):
+            ResultParser.get_line_parser("unknown")
+
+
+class ProcessTestResultsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="damf-test-")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_result_files(self, count):
+        for file_index in range(count):
+            with open(os.path.join(self.temp_dir, "suite%d_test_result" % file_index), "w") as result_file:
+                result_file.write("a: PASS\nb: FAIL\nc: SKIP\n")
+
+    def check_reports(self, suite_counts, count):
+        self.assertEqual(sorted(suite_counts), ["suite%d" % file_index for file_index in range(count)])
+        self.assertEqual(suite_counts["suite0"], {"PASS": 1, "FAIL": 1, "SKIP": 1})
+        with open(os.path.join(self.temp_dir, "job_7.xml")) as report_file:
+            self.assertIn('tests="%d"' % (3 * count), report_file.read())
+
+    def test_few_files_are_parsed_in_the_calling_process(self):
+        class UnusablePool:
+            def submit(self, *arguments):
+                raise AssertionError("the worker pool was used")
+        self.write_result_files(ResultParser.MIN_PARALLEL_FILES - 1)
+        result_parser = ResultParser.ResultParser(self.temp_dir, self.temp_dir, job_id=7, worker_pool=UnusablePool())
+        self.check_reports(result_parser.process_test_results(), ResultParser.MIN_PARALLEL_FILES - 1)
+
+    def test_shared_worker_pool(self):
+        self.write_result_files(ResultParser.MIN_PARALLEL_FILES)
+        with ResultParser.create_worker_pool(2) as worker_pool:
+            for run in range(2):
+                result_parser = ResultParser.ResultParser(self.temp_dir, self.temp_dir, job_id=7, worker_pool=worker_pool)
+                self.check_reports(result_parser.process_test_results(), ResultParser.MIN_PARALLEL_FILES)
+
+
+class NightlyReportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="damf-test-")
+        self.nightly_dir = os.path.join(self.temp_dir, "nightly")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def add_job(self, job_id, day):
+        result_parser = ResultParser.ResultParser(self.temp_dir, self.temp_dir, job_id=job_id,
+                                                  nightly_dir=self.nightly_dir)
+        junit_writer = ResultParser.JUnitWriter(os.path.join(self.temp_dir, "suite.xml"), "suite", job_id=job_id)
+        junit_writer.add_record(ResultParser.TestRecord("suite", "case", "FAIL", None, None, None, None))
+        totals = result_parser.write_job_report([os.path.join(self.temp_dir, "suite.xml")], junit_writer.close())
+        result_parser.add_to_nightly_report(totals, day)
+
+    def test_finished_days_are_written_outside_of_the_jobs(self):
+        self.add_job(1, "2026_01_01")
+        self.add_job(2, "2026_01_01")
+        self.add_job(3, "2026_01_02")
+        nightly_file = os.path.join(self.nightly_dir, "nightly_2026_01_01.xml")
+        self.assertFalse(os.path.exists(nightly_file))
+
+        finalized = ResultParser.finalize_nightly_reports(self.nightly_dir, "2026_01_02")
+        self.assertEqual(sorted(finalized), ["2026_01_01"])
+        self.assertEqual(finalized["2026_01_01"]["tests"], 2)
+        with open(nightly_file) as report_file:
+            self.assertIn('failures="2"', report_file.read())
+        self.assertEqual(ResultParser.get_unmerged_days(self.nightly_dir), ["2026_01_02"])
+        self.assertEqual(ResultParser.finalize_nightly_reports(self.nightly_dir, "2026_01_02"), {})
+
+
+if __name__ == "__main__":
+    unittest.main()